@@ -15,7 +15,8 @@ CREATE TABLE `series_temp` (
   `priority` boolean DEFAULT 0 COMMENT '该条目信息是否需要优先爬取，默认为 0 不需要优先，1 为优先爬取',
   `create_time` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT '首次爬取数据',
   `update_time` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新爬取时间，没有更新的情况和首次爬取时间一致',
-  PRIMARY KEY (`series_id`)
+  PRIMARY KEY (`series_id`),
+  KEY `idx_crawled_create_time` (`crawled`, `create_time`, `series_id`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci COMMENT='外源信息临时存储表';
 
 
@@ -64,7 +65,8 @@ CREATE TABLE `series_info` (
   `plot` text CHARACTER SET utf8mb4 COLLATE utf8mb4_general_ci DEFAULT NULL COMMENT '豆瓣影视条目剧情简介',
   `set_number` int DEFAULT NULL COMMENT '豆瓣影视剧集的总集数',
   `cover` varchar(150) DEFAULT NULL COMMENT '豆瓣影视条目中封面海报链接',
-  `cover_content` BLOB DEFAULT NULL COMMENT '豆瓣影视海报链接请求后的 content，避免后续无法请求的情况'
+  `cover_digest` char(64) DEFAULT NULL COMMENT '豆瓣影视海报内容的 SHA-256 摘要，内容保存在 BlobStore 中',
+  `cover_size` int UNSIGNED DEFAULT NULL COMMENT '豆瓣影视海报内容的字节数',
   `official_site` varchar(200) DEFAULT NULL COMMENT '影视条目上的官方网站',
   `recommendation_type` varchar(20) CHARACTER SET utf8mb4 COLLATE utf8mb4_general_ci DEFAULT NULL COMMENT '影视条目上的官方网站',
   `recommendation_item` varchar(1200) CHARACTER SET utf8mb4 COLLATE utf8mb4_general_ci DEFAULT NULL COMMENT '提取豆瓣对当前内容推荐对相似条目',
@@ -93,8 +95,8 @@ CREATE TABLE `episode_info` (
   -- 与 sereis_info 中 ID 一致，使用外键方式
   FOREIGN KEY (`sid`)
     REFERENCES series_info(`series_id`)
-    ON UPDATE CASCADE ON DELETE RESTRICT
-  -- UNIQUE KEY `seid` (`series_id`, `episode`) COMMENT '豆瓣影视实际 ID 和剧集集数作为唯一约束'
+    ON UPDATE CASCADE ON DELETE RESTRICT,
+  UNIQUE KEY `uk_sid_episode` (`sid`, `episode`) COMMENT '豆瓣影视实际 ID 和剧集集数作为唯一约束'
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci COMMENT='影视多季各集信息表';
 
 
@@ -110,17 +112,29 @@ CREATE TABLE `worker` (
   `name` varchar(50) CHARACTER SET utf8mb4 COLLATE utf8mb4_general_ci NOT NULL COMMENT '豆瓣影视演职人员姓名',
   `alias` varchar(40) CHARACTER SET utf8mb4 COLLATE utf8mb4_general_ci DEFAULT NULL COMMENT '豆瓣影视演职人员姓名(非中文)', 
   `sid` varchar(20) NOT NULL COMMENT '豆瓣影视剧条目 ID',
-  `duty` varchar(100) COMMENT '演职人员岗位',
+  `duty` varchar(100) NOT NULL DEFAULT '' COMMENT '演职人员岗位',
   `action` varchar(20) DEFAULT NULL COMMENT '演员或其他配音演员，参与到影片中到方式',
-  `role` varchar(100) DEFAULT NULL COMMENT '演员或其他配音演员，在影片中的角色',
+  `role` varchar(100) NOT NULL DEFAULT '' COMMENT '演员或其他配音演员，在影片中的角色',
   `create_time` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT '首次爬取数据',
   `update_time` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新爬取时间，没有更新的情况和首次爬取时间一致',
   PRIMARY KEY (`id`),
   FOREIGN KEY (`sid`)
     REFERENCES series_info(`series_id`)
-    ON UPDATE CASCADE ON DELETE RESTRICT
+    ON UPDATE CASCADE ON DELETE RESTRICT,
+  -- 岗位和角色为空时是空字符串，NULL 不会触发唯一约束冲突
+  UNIQUE KEY `uk_sid_wid_duty_role` (`sid`, `wid`, `duty`, `role`) COMMENT '同一影视中演职人员的 ID、岗位和角色唯一'
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci COMMENT='影视演职人员信息';
 
+-- 已有数据表的迁移: 先删除重复数据(保留 id 最大的一条)，再添加唯一约束
+-- DELETE a FROM `worker` a JOIN `worker` b ON a.sid = b.sid AND a.wid = b.wid
+--   AND COALESCE(a.duty, '') = COALESCE(b.duty, '') AND COALESCE(a.role, '') = COALESCE(b.role, '') AND a.id < b.id;
+-- UPDATE `worker` SET duty = COALESCE(duty, ''), role = COALESCE(role, '');
+-- ALTER TABLE `worker` MODIFY `duty` varchar(100) NOT NULL DEFAULT '' COMMENT '演职人员岗位',
+--   MODIFY `role` varchar(100) NOT NULL DEFAULT '' COMMENT '演员或其他配音演员，在影片中的角色',
+--   ADD UNIQUE KEY `uk_sid_wid_duty_role` (`sid`, `wid`, `duty`, `role`);
+-- DELETE a FROM `episode_info` a JOIN `episode_info` b ON a.sid = b.sid AND a.episode = b.episode AND a.id < b.id;
+-- ALTER TABLE `episode_info` ADD UNIQUE KEY `uk_sid_episode` (`sid`, `episode`);
+
 
 -- ----------------------------
 -- Table structure for picture
@@ -130,7 +144,8 @@ DROP TABLE IF EXISTS `picture`;
 CREATE TABLE `picture` (
   `pid` varchar(30) NOT NULL COMMENT '豆瓣影视海报和壁纸 ID',
   `url` varchar(150) NOT NULL COMMENT '豆瓣影视海报和壁纸的链接',
-  `content` BLOB NOT NULL COMMENT '豆瓣影视海报和壁纸的链接请求后的 content，避免后续无法请求的情况',
+  `digest` char(64) DEFAULT NULL COMMENT '豆瓣影视海报和壁纸内容的 SHA-256 摘要，内容保存在 BlobStore 中',
+  `size` int UNSIGNED DEFAULT NULL COMMENT '豆瓣影视海报和壁纸内容的字节数',
   `description` varchar(40) CHARACTER SET utf8mb4 COLLATE utf8mb4_general_ci DEFAULT NULL COMMENT '豆瓣影视海报和壁纸的描述信息', 
   `specification` varchar(30) DEFAULT NULL COMMENT '豆瓣影视剧海报和壁纸的规格',
   `type` varchar(10) DEFAULT NULL COMMENT '图片类型分类: 海报、壁纸和剧照',
@@ -143,6 +158,14 @@ CREATE TABLE `picture` (
     ON UPDATE CASCADE ON DELETE RESTRICT
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci COMMENT='影视海报和壁纸信息';
 
+-- 已有数据表的迁移: 图片内容保存在 BlobStore(settings.IMAGE_STORE_DIR)中，数据表只保存摘要和字节数
+-- ALTER TABLE `series_info` DROP COLUMN `cover_content`,
+--   ADD COLUMN `cover_digest` char(64) DEFAULT NULL COMMENT '豆瓣影视海报内容的 SHA-256 摘要，内容保存在 BlobStore 中' AFTER `cover`,
+--   ADD COLUMN `cover_size` int UNSIGNED DEFAULT NULL COMMENT '豆瓣影视海报内容的字节数' AFTER `cover_digest`;
+-- ALTER TABLE `picture` DROP COLUMN `content`,
+--   ADD COLUMN `digest` char(64) DEFAULT NULL COMMENT '豆瓣影视海报和壁纸内容的 SHA-256 摘要，内容保存在 BlobStore 中' AFTER `url`,
+--   ADD COLUMN `size` int UNSIGNED DEFAULT NULL COMMENT '豆瓣影视海报和壁纸内容的字节数' AFTER `digest`;
+
 
 
 -- ----------------------------
@@ -7,6 +7,9 @@ import sqlalchemy
 from sqlalchemy import orm
 
 from .datamodel import Base
+from .writer import BufferedWriter
+from .seed import SeedCursor
+from .planner import RecrawlPlanner
 
 from ..conf import configure
 
@@ -21,7 +24,7 @@ URI = URI.format(
 )
 
 
-__all__ = ["DataBaseManipulater"]
+__all__ = ["DataBaseManipulater", "BufferedWriter", "SeedCursor", "RecrawlPlanner"]
 
 class DataBaseManipulater(object):
     """使用 SQLAlchemy 操作数据
@@ -50,6 +53,37 @@ class DataBaseManipulater(object):
         Base.metadata.create_all(self._engine, checkfirst=True)
 
 
+    @property
+    def engine(self):
+        """绑定的 engine 对象，用于不经过 session 的批量操作"""
+        return self._engine
+
+
+    def iter_values(self, column, page_size=10000, distinct=False):
+        """分页读取某一列的所有值
+
+        以列值作为 keyset 分页，适用于主键等唯一列，例如预热去重数据。非唯一列需要申明
+        distinct 为 True，只读取不重复的值
+        """
+        last = None
+        while True:
+            query = sqlalchemy.select([column]).order_by(column).limit(page_size)
+            if distinct:
+                query = query.distinct()
+            if last is not None:
+                query = query.where(column > last)
+
+            with self._engine.connect() as connection:
+                values = [row[0] for row in connection.execute(query)]
+
+            for value in values:
+                yield value
+
+            if len(values) < page_size:
+                return
+            last = values[-1]
+
+
     def __enter__(self):
         self.Session.configure(bind=self._engine)
         self.__session = self.Session()
@@ -24,7 +24,11 @@ class DouBanSeriesSeed(Base):
     `douban_series.sql` 文件中确认
     """
     __tablename__ = "series_temp"
-    __table_args__ = {'mysql_engine': 'InnoDB'}
+    __table_args__ = (
+        # 未爬取种子按照 create_time 倒序分页读取
+        sqlalchemy.Index("idx_crawled_create_time", "crawled", "create_time", "series_id"),
+        {'mysql_engine': 'InnoDB'}
+    )
     
     series_id = sqlalchemy.Column(sqlalchemy.VARCHAR(20), primary_key=True, comment="豆瓣影视 ID")
     title = sqlalchemy.Column(
@@ -165,8 +169,11 @@ class DouBanSeriesInfo(Base):
     cover = sqlalchemy.Column(
         sqlalchemy.VARCHAR(150), comment='豆瓣影视条目中封面海报链接'
     )
-    cover_content = sqlalchemy.Column(
-        sqlalchemy.BLOB, nullable=True, comment="豆瓣影视海报链接请求后的 content，避免后续无法请求的情况" 
+    cover_digest = sqlalchemy.Column(
+        sqlalchemy.CHAR(64), nullable=True, comment="豆瓣影视海报内容的 SHA-256 摘要，内容保存在 BlobStore 中"
+    )
+    cover_size = sqlalchemy.Column(
+        INTEGER(unsigned=True), nullable=True, comment="豆瓣影视海报内容的字节数"
     )
     official_site = sqlalchemy.Column(
         sqlalchemy.VARCHAR(200, convert_unicode=True), \
@@ -219,7 +226,11 @@ class DouBanEpisodeInfo(Base):
     电视剧集在每一集存在不同的信息，因为单独存放在 `episode_info` 中
     """
     __tablename__ = "episode_info"
-    __table_args__ = {'mysql_engine': 'InnoDB'}
+    __table_args__ = (
+        # 影视 ID 和集数唯一，写入时使用 ON DUPLICATE KEY UPDATE 更新已有剧集
+        sqlalchemy.UniqueConstraint("sid", "episode", name="uk_sid_episode"),
+        {'mysql_engine': 'InnoDB'}
+    )
 
     id = sqlalchemy.Column(sqlalchemy.BigInteger, primary_key=True,autoincrement=True)
     sid = sqlalchemy.Column(
@@ -274,7 +285,11 @@ class DouBanEpisodeInfo(Base):
 class DouBanSeriesWorker(Base):
     """豆瓣影视演职人员信息"""
     __tablename__ = "worker"
-    __table_args__ = {"mysql_engine": "InnoDB"}
+    __table_args__ = (
+        # 同一影视中演职人员以 ID、岗位和角色区分，写入时使用 ON DUPLICATE KEY UPDATE
+        sqlalchemy.UniqueConstraint("sid", "wid", "duty", "role", name="uk_sid_wid_duty_role"),
+        {"mysql_engine": "InnoDB"}
+    )
 
     id = sqlalchemy.Column(
         BIGINT(unsigned=True), nullable=False, autoincrement=True, primary_key=True,
@@ -301,14 +316,18 @@ class DouBanSeriesWorker(Base):
         default=None, comment='豆瓣影视演职人员姓名(非中文)'
     )
 
-    duty = sqlalchemy.Column(sqlalchemy.VARCHAR(100), comment='演职人员岗位')
+    # 唯一约束中的 NULL 互不相等，岗位和角色使用空字符串表示没有
+    duty = sqlalchemy.Column(
+        sqlalchemy.VARCHAR(100), nullable=False, server_default="", comment='演职人员岗位'
+    )
 
     action = sqlalchemy.Column(
         sqlalchemy.VARCHAR(20), default=None, comment='演员或其他配音演员，参与到影片中到方式'
     )
 
     role = sqlalchemy.Column(
-        sqlalchemy.VARCHAR(100), default=None, comment='演员或其他配音演员，在影片中的角色'
+        sqlalchemy.VARCHAR(100), nullable=False, server_default="", \
+        comment='演员或其他配音演员，在影片中的角色'
     )
 
     create_time = sqlalchemy.Column(
@@ -356,8 +375,12 @@ class DouBanSeriesPic(Base):
         sqlalchemy.VARCHAR(150), nullable=False, comment='海报和壁纸的链接'
     )
 
-    content = sqlalchemy.Column(
-        sqlalchemy.BLOB, nullable=True, comment="豆瓣影视海报和壁纸的链接请求后的 content，避免后续无法请求的情况"
+    digest = sqlalchemy.Column(
+        sqlalchemy.CHAR(64), nullable=True, comment="豆瓣影视海报和壁纸内容的 SHA-256 摘要，内容保存在 BlobStore 中"
+    )
+
+    size = sqlalchemy.Column(
+        INTEGER(unsigned=True), nullable=True, comment="豆瓣影视海报和壁纸内容的字节数"
     )
 
     description = sqlalchemy.Column(
@@ -0,0 +1,193 @@
+#coding:utf8
+"""
+重新爬取计划:
+1. RecrawlPlanner 根据数据新旧程度、热度、是否正在播出以及种子优先级为影视打分，生成按分数排
+    序的待爬取列表，分数同时转换为 Scrapy 请求的 priority
+"""
+from __future__ import absolute_import
+
+import re
+import json
+import math
+import heapq
+import logging
+import datetime
+from collections import namedtuple
+
+import sqlalchemy
+from sqlalchemy import func
+
+from .datamodel import DouBanSeriesInfo, DouBanSeriesSeed, DouBanEpisodeInfo
+
+
+__all__ = ["RecrawlPlanner"]
+
+class RecrawlPlanner(object):
+    """重新爬取计划
+
+    对 `series_info` 中已经爬取的影视以及 `series_temp` 中尚未爬取的种子打分:
+
+        score = staleness * (popularity * w_popularity + airing * w_airing
+                    + priority * w_priority + recency * w_recency + new * w_new)
+
+    * staleness: 距离上一次爬取(update_time)的时间，1 - 0.5 ** (天数 / half_life)，刚爬取
+        的影视接近 0，尚未爬取的种子为 1
+    * popularity: log(1 + rate_collection) / log(1 + 最大 rate_collection)
+    * airing: 最近 airing_days 天内有剧集播出或者上映，或者总集数多于已有的剧集数量
+    * priority: `series_temp.priority`
+    * recency: 1 / (1 + 成片年数 / 10)，多年前且无人关注的影视分数很低
+    * new: 尚未爬取的种子为 1，种子没有热度等信息，以此保证种子能够进入计划
+
+    分数低于 min_score 的影视不会进入计划，最多返回 budget 个影视
+
+    Args:
+    ---------
+    manipulater: DataBaseManipulater 对象，提供 engine
+    budget: 最多返回的影视数量
+    half_life: staleness 的半衰期，单位为天
+    airing_days: 判断正在播出的天数范围
+    min_score: 最低分数
+    weights: 各项权重，key 为 popularity、airing、priority、recency、new
+    max_priority: 分数为 1 时对应的 Scrapy 请求 priority
+    """
+    frontier = namedtuple("frontier", ["series_id", "score", "priority", "crawled"])
+    weights = {"popularity": 0.4, "airing": 0.3, "priority": 0.2, "recency": 0.1, "new": 0.3}
+    logger = logging.getLogger(__name__ + ".RecrawlPlanner")
+
+    def __init__(self, manipulater, budget=1000, half_life=30, airing_days=60, \
+            min_score=0.05, weights=None, max_priority=100):
+        self.manipulater = manipulater
+        self.budget = budget
+        self.half_life = half_life
+        self.airing_days = airing_days
+        self.min_score = min_score
+        self.weights = dict(self.weights, **(weights or {}))
+        self.max_priority = max_priority
+
+
+    def plan(self, now=None):
+        """生成按分数倒序排列的待爬取列表"""
+        now = now or datetime.datetime.now()
+        max_collection = self._max_collection()
+
+        candidates = (self.score(row, now, max_collection) for row in self._rows())
+        candidates = (i for i in candidates if i.score >= self.min_score)
+        result = heapq.nlargest(self.budget, candidates, key=lambda i: i.score)
+        self.logger.info(f"重新爬取计划: {len(result)} 个影视")
+        return result
+
+
+    def __iter__(self):
+        return iter(self.plan())
+
+
+    def score(self, row, now, max_collection):
+        """计算一个影视的分数"""
+        if row.update_time is None:
+            staleness = 1.0
+        else:
+            days = max((now - row.update_time).total_seconds() / 86400, 0)
+            staleness = 1 - 0.5 ** (days / self.half_life)
+
+        popularity = 0.0
+        if row.rate_collection and max_collection:
+            popularity = math.log1p(row.rate_collection) / math.log1p(max_collection)
+
+        recency = 0.0
+        if row.release_year:
+            recency = 1 / (1 + max(now.year - row.release_year, 0) / 10)
+
+        score = staleness * (
+            popularity * self.weights["popularity"] +
+            self.airing(row, now) * self.weights["airing"] +
+            (1.0 if row.priority else 0.0) * self.weights["priority"] +
+            recency * self.weights["recency"] +
+            (1.0 if row.update_time is None else 0.0) * self.weights["new"]
+        )
+        return self.frontier(series_id=row.series_id, score=score, \
+            priority=int(round(score * self.max_priority)), crawled=row.update_time is not None)
+
+
+    def airing(self, row, now):
+        """是否正在播出，返回 1.0 或者 0.0"""
+        dates = [self._parse_date(row.last_episode)]
+        if row.release_date:
+            try:
+                dates.extend(self._parse_date(i) for i in json.loads(row.release_date).values())
+            except (ValueError, AttributeError):
+                pass
+
+        window = datetime.timedelta(days=self.airing_days)
+        if any(date is not None and date >= now - window for date in dates):
+            return 1.0
+
+        # 总集数多于已经爬取的剧集，且是近两年的影视，说明仍在更新
+        if row.set_number and row.episodes < row.set_number and row.release_year and \
+                row.release_year >= now.year - 1:
+            return 1.0
+        return 0.0
+
+
+    @staticmethod
+    def _parse_date(text):
+        if not text:
+            return None
+        matchobj = re.search(r"(\d{4})-(\d{1,2})-(\d{1,2})", text)
+        if matchobj is None:
+            return None
+        try:
+            return datetime.datetime(*(int(i) for i in matchobj.groups()))
+        except ValueError:
+            return None
+
+
+    def _max_collection(self):
+        with self.manipulater.engine.connect() as connection:
+            return connection.execute(
+                sqlalchemy.select([func.max(DouBanSeriesInfo.rate_collection)])
+            ).scalar() or 0
+
+
+    def _rows(self):
+        """读取已经爬取的影视以及尚未爬取的种子"""
+        info = DouBanSeriesInfo.__table__
+        seed = DouBanSeriesSeed.__table__
+        episode = DouBanEpisodeInfo.__table__
+
+        # 剧集日期以 YYYY-MM-DD 开头，字符串的最大值就是最近一集的日期
+        episodes = sqlalchemy.select([
+            episode.c.sid,
+            func.max(episode.c.date).label("last_episode"),
+            func.count().label("episodes")
+        ]).group_by(episode.c.sid).alias("episodes")
+
+        crawled = sqlalchemy.select([
+            info.c.series_id, info.c.update_time, info.c.rate_collection, info.c.release_year,
+            info.c.release_date, info.c.set_number, episodes.c.last_episode,
+            func.coalesce(episodes.c.episodes, 0).label("episodes"),
+            func.coalesce(seed.c.priority, False).label("priority")
+        ]).select_from(
+            info.outerjoin(episodes, episodes.c.sid == info.c.series_id)
+                .outerjoin(seed, seed.c.series_id == info.c.series_id)
+        )
+
+        uncrawled = sqlalchemy.select([
+            seed.c.series_id, sqlalchemy.null().label("update_time"),
+            sqlalchemy.null().label("rate_collection"), sqlalchemy.null().label("release_year"),
+            sqlalchemy.null().label("release_date"), sqlalchemy.null().label("set_number"),
+            sqlalchemy.null().label("last_episode"), sqlalchemy.literal(0).label("episodes"),
+            seed.c.priority
+        ]).where(sqlalchemy.and_(
+            seed.c.crawled == False,
+            ~sqlalchemy.exists().where(info.c.series_id == seed.c.series_id)
+        ))
+
+        with self.manipulater.engine.connect() as connection:
+            for query in (crawled, uncrawled):
+                result = connection.execution_options(stream_results=True).execute(query)
+                while True:
+                    rows = result.fetchmany(10000)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield row
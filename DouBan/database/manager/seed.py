@@ -0,0 +1,85 @@
+#coding:utf8
+"""
+种子表读取:
+1. SeedCursor 以 keyset 分页的方式流式读取 `series_temp` 中尚未爬取的种子
+"""
+from __future__ import absolute_import
+
+import logging
+
+import sqlalchemy
+
+from .datamodel import DouBanSeriesSeed
+
+
+__all__ = ["SeedCursor"]
+
+class SeedCursor(object):
+    """种子表流式读取对象
+
+    按照 create_time 倒序、series_id 倒序读取 crawled 为 0 的种子，每页最多 page_size 条。
+    下一页以上一页最后一条的 (create_time, series_id) 作为起点，不使用 OFFSET，也不会一次性加
+    载整张表，迭代过程中内存只保留一页数据。
+
+    种子状态不在读取时更新，只有详情页数据写入 `series_info` 之后才通过 mark_crawled 批量更新
+
+    Args:
+    ---------
+    manipulater: DataBaseManipulater 对象，提供 engine
+    page_size: 每页读取的种子数量
+    """
+    logger = logging.getLogger(__name__ + ".SeedCursor")
+
+    def __init__(self, manipulater, page_size=1000):
+        self.manipulater = manipulater
+        self.page_size = page_size
+
+
+    def __iter__(self):
+        table = DouBanSeriesSeed.__table__
+        create_time, series_id = table.c.create_time, table.c.series_id
+
+        last = None
+        while True:
+            query = sqlalchemy.select([series_id, create_time, table.c.priority]) \
+                        .where(table.c.crawled == False)
+
+            if last is not None:
+                query = query.where(sqlalchemy.or_(
+                    create_time < last.create_time,
+                    sqlalchemy.and_(create_time == last.create_time, \
+                        series_id < last.series_id)
+                ))
+            query = query.order_by(create_time.desc(), series_id.desc()) \
+                        .limit(self.page_size)
+
+            with self.manipulater.engine.connect() as connection:
+                rows = connection.execute(query).fetchall()
+
+            self.logger.debug(f"读取种子 {len(rows)} 条")
+            for row in rows:
+                yield row
+
+            if len(rows) < self.page_size:
+                return
+            last = rows[-1]
+
+
+    def mark_crawled(self, series_ids):
+        """批量更新种子为已爬取状态
+
+        一次 UPDATE 更新所有给定的种子，返回更新的数量
+        """
+        series_ids = list(set(series_ids))
+        if not series_ids:
+            return 0
+
+        table = DouBanSeriesSeed.__table__
+        statement = table.update() \
+                        .where(table.c.series_id.in_(series_ids)) \
+                        .values(crawled=True)
+
+        with self.manipulater.engine.begin() as connection:
+            result = connection.execute(statement)
+        self.logger.info(f"更新种子状态: {result.rowcount} 条")
+        return result.rowcount
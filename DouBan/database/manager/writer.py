@@ -0,0 +1,244 @@
+#coding:utf8
+"""
+批量缓冲写入:
+1. BufferedWriter 按数据表缓存 item 数据，达到数量或者时间阈值后以一条多行 upsert 语句写入
+"""
+from __future__ import absolute_import
+
+import time
+import logging
+import threading
+
+import sqlalchemy
+from sqlalchemy import func
+from sqlalchemy.schema import sort_tables
+from sqlalchemy.dialects.mysql import insert
+
+
+__all__ = ["BufferedWriter"]
+
+class BufferedWriter(object):
+    """缓冲写入对象
+
+    各个 Pipeline 共享同一个写入对象，数据按照表名缓存，满足以下任一条件时写入数据库:
+    * 表中缓存数量达到 batch_size
+    * 距离上一次写入超过 flush_interval 秒
+    * 手动调用 flush，例如在 close_spider 时
+
+    缓存的总数量不超过 max_buffer，超过时会在当前调用中同步写入缓存最多的表，以此对上游产生
+    背压。写入使用 `INSERT ... ON DUPLICATE KEY UPDATE`，数据是否已经存在由表的主键和唯一约束
+    判断。
+
+    Args:
+    ---------
+    manipulater: DataBaseManipulater 对象，提供 engine
+    batch_size: 单表批量写入的数量阈值
+    flush_interval: 单表写入的时间阈值，单位为秒
+    max_buffer: 所有表缓存数量的上限
+    """
+    logger = logging.getLogger(__name__ + ".BufferedWriter")
+
+    def __init__(self, manipulater, batch_size=200, flush_interval=5, max_buffer=2000):
+        self.manipulater = manipulater
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+
+        self._tables = {}
+        self._buffers = {}
+        self._last_flush = {}
+        self.stats = {}
+        self._callbacks = {}
+        self._lock = threading.RLock()
+
+
+    def configure(self, batch_size=None, flush_interval=None, max_buffer=None):
+        """调整写入阈值
+
+        Pipeline 在 from_crawler 中根据 settings 调整阈值，参数为 None 时保留原值
+        """
+        if batch_size is not None:
+            self.batch_size = int(batch_size)
+        if flush_interval is not None:
+            self.flush_interval = float(flush_interval)
+        if max_buffer is not None:
+            self.max_buffer = int(max_buffer)
+
+        # 背压阈值不能小于单表批量数量，否则无法攒满一个批次
+        self.max_buffer = max(self.max_buffer, self.batch_size)
+
+
+    def register(self, model):
+        """注册需要缓冲写入的数据模型
+
+        Args:
+        ---------
+        model: datamodel 中的数据模型，需要有主键或者唯一约束
+        """
+        table = model.__tablename__
+        with self._lock:
+            if table not in self._tables:
+                self._tables[table] = model
+                self._buffers[table] = []
+                self._last_flush[table] = time.time()
+                self.stats[table] = {
+                    "flushes": 0, "rows": 0, "errors": 0, "seconds": 0.0, "max_batch": 0
+                }
+        return table
+
+
+    def on_flush(self, table, callback):
+        """注册写入完成的回调
+
+        回调的参数是本次成功写入的数据列表，例如详情数据写入后批量更新种子表状态
+        """
+        with self._lock:
+            callbacks = self._callbacks.setdefault(table, [])
+            if callback not in callbacks:
+                callbacks.append(callback)
+
+
+    def add(self, table, data, copy=True):
+        """添加一条数据到缓存
+
+        数据会被复制为字典，避免 Scrapy 回调中复用的 item 对象在写入前被修改。data 已经是
+        不会被修改的字典时(例如 Record.to_row 的结果)，copy 为 False 直接缓存
+        """
+        with self._lock:
+            self._buffers[table].append(dict(data) if copy or not isinstance(data, dict) else data)
+
+            if len(self._buffers[table]) >= self.batch_size or self._expired(table):
+                self.flush(table)
+
+            # 背压: 缓存总量超过上限时同步写入缓存最多的表
+            while self.buffered() > self.max_buffer:
+                largest = max(self._buffers, key=lambda name: len(self._buffers[name]))
+                self.flush(largest)
+
+
+    def buffered(self, table=None):
+        """当前缓存的数据数量"""
+        if table is not None:
+            return len(self._buffers.get(table, []))
+        return sum(len(rows) for rows in self._buffers.values())
+
+
+    def flush_expired(self, table=None):
+        """写入超过时间阈值的表
+
+        用于定时任务调用，避免数据量较少的表长时间停留在缓存中。table 为 None 时检查所有表
+        """
+        with self._lock:
+            tables = list(self._buffers) if table is None else [table]
+            for table in tables:
+                if self._buffers[table] and self._expired(table):
+                    self.flush(table)
+
+
+    def flush(self, table=None):
+        """写入缓存数据
+
+        table 为 None 时写入所有表。写入子表之前会先写入其外键依赖的父表，保证外键约束
+        """
+        with self._lock:
+            if table is None:
+                for name in self._ordered_tables():
+                    self.flush(name)
+                return
+
+            model = self._tables[table]
+            # 先写入外键依赖的表
+            for fk in model.__table__.foreign_keys:
+                parent = fk.column.table.name
+                if parent != table and self._buffers.get(parent):
+                    self.flush(parent)
+
+            rows, self._buffers[table] = self._buffers[table], []
+            self._last_flush[table] = time.time()
+            if not rows:
+                return
+
+            start = time.time()
+            try:
+                self._write(table, rows)
+                written = rows
+            except sqlalchemy.exc.SQLAlchemyError as err:
+                self.logger.error(f"批量写入 {table} 失败，改为逐条写入: {err}")
+                written = self._write_each(table, rows)
+
+            for callback in self._callbacks.get(table, []):
+                try:
+                    callback(written)
+                except Exception as err:
+                    self.logger.error(f"{table} 写入回调 {callback} 执行失败: {err}")
+
+            stats = self.stats[table]
+            stats["flushes"] += 1
+            stats["rows"] += len(rows)
+            stats["seconds"] += time.time() - start
+            stats["max_batch"] = max(stats["max_batch"], len(rows))
+            self.logger.debug(f"批量写入 {table} 完成: {len(rows)} 条")
+
+
+    def close(self):
+        """写入所有缓存数据"""
+        self.flush()
+
+
+    def _expired(self, table):
+        return time.time() - self._last_flush[table] >= self.flush_interval
+
+
+    def _ordered_tables(self):
+        """根据外键依赖排序的表名"""
+        tables = [model.__table__ for model in self._tables.values()]
+        return [tb.name for tb in sort_tables(tables)]
+
+
+    def _write(self, table, rows):
+        """一次事务内写入多行数据"""
+        model = self._tables[table]
+        engine = self.manipulater.engine
+
+        with engine.begin() as connection:
+            for statement in self._statements(model, rows):
+                connection.execute(statement)
+
+
+    def _write_each(self, table, rows):
+        """逐条写入，用于定位批量写入中出错的数据，返回成功写入的数据"""
+        written = []
+        for row in rows:
+            try:
+                self._write(table, [row])
+                written.append(row)
+            except sqlalchemy.exc.SQLAlchemyError as err:
+                self.stats[table]["errors"] += 1
+                self.logger.error(f"写入 {table} 数据失败: {row}, 因为 {err}")
+        return written
+
+
+    def _statements(self, model, rows):
+        """生成多行 upsert 语句
+
+        按照字段集合分组，未提供的字段不会被更新为 NULL
+        """
+        groups = {}
+        for row in rows:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+
+        columns = model.__table__.c
+        primary_keys = {column.name for column in model.__table__.primary_key.columns}
+        for fields, values in groups.items():
+            statement = insert(model.__table__).values(values)
+            update = {field: statement.inserted[field] for field in fields \
+                        if field not in primary_keys}
+            # onupdate 不会作用于 ON DUPLICATE KEY UPDATE，需要手动更新
+            if "update_time" in columns:
+                update["update_time"] = func.now()
+
+            if update:
+                statement = statement.on_duplicate_key_update(**update)
+            else:
+                statement = statement.prefix_with("IGNORE")
+            yield statement
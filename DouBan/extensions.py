@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+
+# Define here the extensions for the project
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/extensions.html
+import os
+import json
+import time
+import logging
+import signal
+import numbers
+from urllib.parse import urlparse
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+import redis
+from twisted.internet import defer, reactor, task, threads
+from twisted.internet.error import CannotListenError
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+from DouBan.utils.metrics import metrics, instrument_sqlalchemy, instrument_pymongo
+from DouBan.utils.profiling import profiler
+
+
+class _MetricsResource(Resource):
+    """/metrics 返回 Prometheus 文本格式，/metrics.json 返回 JSON"""
+    isLeaf = True
+
+    def __init__(self, extension):
+        super().__init__()
+        self.extension = extension
+
+    def render_GET(self, request):
+        if request.path.endswith(b".json"):
+            request.setHeader(b"Content-Type", b"application/json; charset=utf-8")
+            return json.dumps(self.extension.snapshot(), ensure_ascii=False).encode("utf8")
+
+        request.setHeader(b"Content-Type", b"text/plain; version=0.0.4; charset=utf-8")
+        return self.extension.render().encode("utf8")
+
+
+class MetricsExtension:
+    """爬虫运行指标
+
+    记录以下指标(默认的 metrics 集合，名称前缀为 douban_):
+
+    * callback_seconds{spider, callback}: 回调耗时，由 MetricsSpiderMiddleware 记录
+    * pipeline_seconds{pipeline}: 每个 Pipeline 的 process_item 耗时，返回 Deferred 时计算到
+        Deferred 触发为止
+    * items_total{item, outcome}: 按照 Item 类型统计 scraped、dropped、error 数量
+    * download_seconds{slot}、responses_total{status}: 下载耗时以及响应状态码
+    * db_seconds{backend, operation}、db_errors_total: SQLAlchemy(DataBaseManipulater)和
+        pymongo 的数据库往返
+    * stat{key}: crawler.stats 中 METRICS_STATS_PREFIXES 开头的数值，例如代理池和重试计数
+
+    METRICS_PORT 大于 0 时在 METRICS_HOST:METRICS_PORT 提供 HTTP 接口(/metrics 以及
+    /metrics.json)；METRICS_DUMP_PATH 不为空时每隔 METRICS_DUMP_INTERVAL 秒写入一次 JSON 文件
+    """
+    logger = logging.getLogger(__name__ + ".MetricsExtension")
+
+    def __init__(self, crawler, registry=metrics, host="127.0.0.1", port=9410, dump_path=None, \
+            dump_interval=60, stats_prefixes=()):
+        self.crawler = crawler
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.dump_path = dump_path
+        self.dump_interval = dump_interval
+        self.stats_prefixes = tuple(stats_prefixes)
+        self.listener = None
+        self._loop = None
+
+        self.pipeline_seconds = registry.histogram("pipeline_seconds", \
+            "Pipeline process_item 耗时", ["pipeline"])
+        self.items = registry.counter("items_total", "Item 数量", ["item", "outcome"])
+        self.download_seconds = registry.histogram("download_seconds", "下载耗时", ["slot"])
+        self.responses = registry.counter("responses_total", "响应数量", ["status"])
+        self.stat = registry.gauge("stat", "crawler.stats 中的数值", ["key"])
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("METRICS_ENABLED"):
+            raise NotConfigured
+
+        extension = cls(crawler,
+            host=settings.get("METRICS_HOST", "127.0.0.1"),
+            port=settings.getint("METRICS_PORT", 9410),
+            dump_path=settings.get("METRICS_DUMP_PATH"),
+            dump_interval=settings.getfloat("METRICS_DUMP_INTERVAL", 60),
+            stats_prefixes=settings.getlist("METRICS_STATS_PREFIXES"))
+
+        # pymongo 只对之后创建的客户端生效，Pipeline 在 open_spider 中创建客户端
+        instrument_sqlalchemy(extension.registry)
+        try:
+            instrument_pymongo(extension.registry)
+        except ImportError:
+            pass
+
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(extension.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(extension.item_dropped, signal=signals.item_dropped)
+        crawler.signals.connect(extension.item_error, signal=signals.item_error)
+        crawler.signals.connect(extension.response_received, signal=signals.response_received)
+        return extension
+
+    def spider_opened(self, spider):
+        self.instrument_pipelines()
+
+        if self.port > 0:
+            try:
+                self.listener = reactor.listenTCP(self.port, Site(_MetricsResource(self)), \
+                    interface=self.host)
+                self.logger.info(f"Metrics: http://{self.host}:{self.port}/metrics")
+            except CannotListenError as err:
+                self.logger.warning(f"Metrics 端口不可用，只写入 JSON 文件: {err}")
+
+        if self.dump_path:
+            self._loop = task.LoopingCall(self.dump)
+            self._loop.start(self.dump_interval, now=False)
+
+    def instrument_pipelines(self):
+        """替换 ItemPipelineManager 中每个 Pipeline 的 process_item，记录耗时"""
+        itemproc = self.crawler.engine.scraper.itemproc
+        methods = getattr(itemproc, "methods", {}).get("process_item")
+        if not methods:
+            return
+        for index, method in enumerate(list(methods)):
+            owner = getattr(method, "__self__", None)
+            name = owner.__class__.__name__ if owner is not None else repr(method)
+            methods[index] = self.timed(name, method)
+
+    def timed(self, name, method):
+        def process_item(item, spider):
+            start = time.perf_counter()
+            try:
+                result = method(item, spider)
+            except Exception:
+                self.pipeline_seconds.observe(name, value=time.perf_counter() - start)
+                raise
+
+            if isinstance(result, defer.Deferred):
+                def observe(value):
+                    self.pipeline_seconds.observe(name, value=time.perf_counter() - start)
+                    return value
+                return result.addBoth(observe)
+
+            self.pipeline_seconds.observe(name, value=time.perf_counter() - start)
+            return result
+        return process_item
+
+    def item_scraped(self, item, response, spider):
+        self.items.inc(item.__class__.__name__, "scraped")
+
+    def item_dropped(self, item, response, exception, spider):
+        self.items.inc(item.__class__.__name__, "dropped")
+
+    def item_error(self, item, response, spider, failure):
+        self.items.inc(item.__class__.__name__, "error")
+
+    def response_received(self, response, request, spider):
+        if "cached" in response.flags:
+            return
+        self.responses.inc(response.status)
+        if "download_latency" in request.meta:
+            slot = request.meta.get("download_slot") or urlparse(request.url).hostname or ""
+            self.download_seconds.observe(slot, value=request.meta["download_latency"])
+
+    def collect_stats(self):
+        """crawler.stats 中的代理、重试等数值写入 stat 指标"""
+        for key, value in self.crawler.stats.get_stats().items():
+            if isinstance(value, numbers.Number) and key.startswith(self.stats_prefixes):
+                self.stat.set(key, value=value)
+
+    def render(self):
+        self.collect_stats()
+        return self.registry.render()
+
+    def snapshot(self):
+        self.collect_stats()
+        return {"time": time.time(), "metrics": self.registry.to_dict()}
+
+    def dump(self):
+        """原子写入 JSON 文件"""
+        directory = os.path.dirname(self.dump_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp = self.dump_path + ".tmp"
+        with open(temp, "w", encoding="utf8") as file:
+            json.dump(self.snapshot(), file, ensure_ascii=False)
+        os.replace(temp, self.dump_path)
+
+    def spider_closed(self, spider):
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+        if self.dump_path:
+            self.dump()
+        if self.listener is not None:
+            return self.listener.stopListening()
+
+
+class ProfilerExtension:
+    """按需启用的性能分析
+
+    PROFILER_ENABLED 为 True 时包装 PROFILER_PIPELINES 中 Pipeline 的 process_item(为空时包装所
+    有 Pipeline)，回调由 ProfilerSpiderMiddleware 包装。包装之后并不立即分析，以下方式可以在运行
+    中开始或者停止分析，不需要重启爬虫:
+
+    * PROFILER_ACTIVE 为 True 时启动后立即开始
+    * 向进程发送 PROFILER_SIGNAL(默认 SIGUSR2)，每次切换一次
+    * Redis 中 PROFILER_REDIS_KEY 的值: sample、cprofile 或者 on 开始，off 停止，每隔
+        PROFILER_POLL_INTERVAL 秒在后台线程中读取一次，只在值变化时生效
+
+    分析结果每隔 PROFILER_INTERVAL 秒写入 PROFILER_OUTPUT_DIR 中的一个文件
+    """
+    logger = logging.getLogger(__name__ + ".ProfilerExtension")
+
+    def __init__(self, crawler, profiler=profiler, pipelines=(), interval=60, active=False, \
+            signal_name="SIGUSR2", connection=None, redis_key=None, poll_interval=5):
+        self.crawler = crawler
+        self.profiler = profiler
+        self.pipelines = set(pipelines)
+        self.interval = interval
+        self.active = active
+        self.signal_name = signal_name
+        self.connection = connection
+        self.redis_key = redis_key
+        self.poll_interval = poll_interval
+        self.prefix = "douban"
+        self._loops = []
+        self._polling = False
+        self._command = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("PROFILER_ENABLED"):
+            raise NotConfigured
+
+        profiler.configure(
+            mode=settings.get("PROFILER_MODE", "sample"),
+            output_dir=settings.get("PROFILER_OUTPUT_DIR", "profile"),
+            sample_interval=settings.getfloat("PROFILER_SAMPLE_INTERVAL", 0.01))
+
+        connection = None
+        if settings.get("PROFILER_REDIS_KEY"):
+            connection = redis.StrictRedis(connection_pool=redis.ConnectionPool(
+                **settings.getdict("DATABASE_CONF")["redis"]))
+
+        extension = cls(crawler,
+            pipelines=settings.getlist("PROFILER_PIPELINES"),
+            interval=settings.getfloat("PROFILER_INTERVAL", 60),
+            active=settings.getbool("PROFILER_ACTIVE"),
+            signal_name=settings.get("PROFILER_SIGNAL", "SIGUSR2"),
+            connection=connection,
+            redis_key=settings.get("PROFILER_REDIS_KEY"),
+            poll_interval=settings.getfloat("PROFILER_POLL_INTERVAL", 5))
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def spider_opened(self, spider):
+        self.prefix = spider.name
+        self.redis_key = self.redis_key and self.redis_key % {"spider": spider.name}
+        self.instrument_pipelines()
+
+        if self.signal_name and hasattr(signal, self.signal_name):
+            signal.signal(getattr(signal, self.signal_name), \
+                lambda signum, frame: reactor.callFromThread(self.profiler.toggle))
+
+        self._loops.append(task.LoopingCall(self.flush))
+        self._loops[-1].start(self.interval, now=False)
+        if self.connection is not None:
+            self._loops.append(task.LoopingCall(self.poll))
+            self._loops[-1].start(self.poll_interval, now=True)
+
+        if self.active:
+            self.profiler.start()
+
+    def instrument_pipelines(self):
+        itemproc = self.crawler.engine.scraper.itemproc
+        methods = getattr(itemproc, "methods", {}).get("process_item")
+        if not methods:
+            return
+        for index, method in enumerate(list(methods)):
+            owner = getattr(method, "__self__", None)
+            name = owner.__class__.__name__ if owner is not None else repr(method)
+            if not self.pipelines or name in self.pipelines:
+                methods[index] = self.profiler.wrap(f"pipeline:{name}", method)
+
+    def flush(self):
+        self.profiler.flush(prefix=self.prefix)
+
+    def poll(self):
+        """在后台线程中读取 Redis 中的开关"""
+        if self._polling:
+            return
+        self._polling = True
+        d = threads.deferToThread(self.connection.get, self.redis_key)
+        d.addCallbacks(self.apply, lambda failure: self.logger.warning( \
+            f"读取性能分析开关失败: {failure.getErrorMessage()}"))
+        d.addBoth(lambda _: setattr(self, "_polling", False))
+
+    def apply(self, value):
+        command = value.decode("utf8").strip().lower() if value else None
+        if command == self._command:
+            return
+        self._command = command
+
+        if command in self.profiler.modes:
+            self.profiler.start(mode=command)
+        elif command in ("1", "on", "true"):
+            self.profiler.start()
+        elif command in ("0", "off", "false"):
+            self.profiler.stop()
+
+    def spider_closed(self, spider):
+        for loop in self._loops:
+            if loop.running:
+                loop.stop()
+        self.profiler.stop()
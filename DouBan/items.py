@@ -7,6 +7,9 @@
 
 import scrapy
 import json
+from dataclasses import dataclass
+
+from DouBan.utils.records import Record
 
 
 
@@ -45,7 +48,8 @@ class DouBanDetailItem(scrapy.Item):
     plot = scrapy.Field()   # 豆瓣影视条目剧情简介
     set_number = scrapy.Field() # 豆瓣影视剧集总集数
     cover = scrapy.Field()  # 豆瓣影视条目中封面海报链接
-    cover_content = scrapy.Field()  # 豆瓣影视海报链接请求后的 content，避免后续无法请求的情况
+    cover_digest = scrapy.Field()  # 豆瓣影视海报内容的 SHA-256 摘要，内容保存在 BlobStore 中
+    cover_size = scrapy.Field()  # 豆瓣影视海报内容的字节数
     official_site = scrapy.Field()  # 影视条目上的官方网站
     recommendation_type = scrapy.Field()
     recommendation_item = scrapy.Field()
@@ -61,18 +65,19 @@ class DouBanAwardItem(scrapy.Item):
     status = scrapy.Field() # 最终获奖状态, 1 为获奖，0 表示只有提名
     
 
-class DouBanWorkerItem(scrapy.Item):
+@dataclass(slots=True)
+class DouBanWorkerItem(Record):
     """演职人员简介信息 Item
     
     是属于简介信息，并不是详细的 profile 信息
     """
-    wid = scrapy.Field()    # 豆瓣影视演职人员 ID
-    name = scrapy.Field()    # 豆瓣影视演职人员姓名
-    alias = scrapy.Field()  # 豆瓣影视演职人员姓名(非中文)
-    sid = scrapy.Field()    # 豆瓣影视剧条目 ID
-    duty = scrapy.Field()   # 演职人员岗位
-    action = scrapy.Field() # 演员或其他配音演员，参与到影片中到方式
-    role = scrapy.Field()   # 演员或其他配音演员，在影片中的角色
+    wid: str = None    # 豆瓣影视演职人员 ID
+    name: str = None    # 豆瓣影视演职人员姓名
+    alias: str = None  # 豆瓣影视演职人员姓名(非中文)
+    sid: str = None    # 豆瓣影视剧条目 ID
+    duty: str = None   # 演职人员岗位
+    action: str = None # 演员或其他配音演员，参与到影片中到方式
+    role: str = None   # 演员或其他配音演员，在影片中的角色
 
 
 class DouBanPeopleItem(scrapy.Item):
@@ -92,20 +97,23 @@ class DouBanPeopleItem(scrapy.Item):
     official_web = scrapy.Field()   # 官方网站
     introduction = scrapy.Field()   # 简介
     imgs = scrapy.Field() # 演职人员图片链接
-    imgs_content = scrapy.Field() # 链接转换为已经请求的内容
+    imgs_digest = scrapy.Field() # 图片内容的 SHA-256 摘要列表，内容保存在 BlobStore 中
+    imgs_size = scrapy.Field() # 图片内容的字节数列表
 
 
-class DouBanPhotosItem(scrapy.Item):
+@dataclass(slots=True)
+class DouBanPhotosItem(Record):
     """豆瓣影视图片
     
     """
-    pid = scrapy.Field()    # 图片链接，保存的数据形式为 array
-    sid = scrapy.Field()    # 影视 ID
-    url = scrapy.Field()    # 原始图片链接
-    content = scrapy.Field()    # 图片的请求到的二进制内容
-    description = scrapy.Field() # 图片描述性信息
-    specification = scrapy.Field()  # 图片规格
-    type = scrapy.Field()   # 当前页面爬取的类型，包括了剧照、海报和壁纸
+    pid: str = None    # 图片链接，保存的数据形式为 array
+    sid: str = None    # 影视 ID
+    url: str = None    # 原始图片链接
+    digest: str = None    # 图片内容的 SHA-256 摘要，内容保存在 BlobStore 中
+    size: int = None    # 图片内容的字节数
+    description: str = None # 图片描述性信息
+    specification: str = None  # 图片规格
+    type: str = None   # 当前页面爬取的类型，包括了剧照、海报和壁纸
 
 
     
@@ -121,7 +129,8 @@ class DouBanEpisodeItem(scrapy.Item):
 
 
 
-class DouBanCommentsItemM(scrapy.Item):
+@dataclass(slots=True)
+class DouBanCommentsItemM(Record):
     """豆瓣用户影视评论内容
 
     包括短评论：想看和已看的短评论内容
@@ -144,22 +153,22 @@ class DouBanCommentsItemM(scrapy.Item):
         * watched 短评用户是否已经观看过影视内容，False 表示想看，True 表示看过
         * type 评论的类型，包括了两个方面，短评论和影评
     """
-    sid = scrapy.Field()    
-    uname = scrapy.Field() 
-    uid = scrapy.Field() 
-    upic = scrapy.Field()   
-    date = scrapy.Field()   
-    comment_id = scrapy.Field() 
-    title = scrapy.Field()  
-    content = scrapy.Field()    
-    content_url = scrapy.Field()
-    content_full = scrapy.Field()
-    rate = scrapy.Field()   
-    thumb = scrapy.Field()  
-    down = scrapy.Field()   
-    reply = scrapy.Field()   
-    watched = scrapy.Field()
-    type = scrapy.Field() 
+    sid: str = None
+    uname: str = None
+    uid: str = None
+    upic: str = None
+    date: str = None
+    comment_id: str = None
+    title: str = None
+    content: str = None
+    content_url: str = None
+    content_full: str = None
+    rate: str = None
+    thumb: str = None
+    down: str = None
+    reply: str = None
+    watched: bool = None
+    type: str = None
 
 
 
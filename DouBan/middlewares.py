@@ -4,23 +4,33 @@
 #
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
+import re
 import random
 import logging
 import base64
+import time
 import urllib
+import redis
 from scrapy import signals
 
 from DouBan.utils.login import *
-from DouBan.utils.proxy import configure, request_abuyun
+from DouBan.utils.proxy import configure, ProxyPool
+from DouBan.utils.httpcache import ResponseCache, TTLPolicy
+from DouBan.utils.throttle import AIMDController
+from DouBan.utils.metrics import metrics
+from DouBan.utils.profiling import profiler
 
 
 from scrapy import signals
-from twisted.internet import defer
+from twisted.internet import defer, reactor, task, threads
 from twisted.internet.error import (
     TimeoutError, DNSLookupError, ConnectionRefusedError, ConnectionDone, 
     ConnectError, ConnectionLost, TCPTimedOutError
 )
-from scrapy.http import HtmlResponse
+from scrapy.http import HtmlResponse, Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.exceptions import NotConfigured, IgnoreRequest
+from scrapy.utils.misc import load_object
 from twisted.web.client import ResponseFailed
 from scrapy.core.downloader.handlers.http11 import TunnelError
 from scrapy.downloadermiddlewares.retry import RetryMiddleware
@@ -74,6 +84,62 @@ class DoubanSpiderMiddleware(object):
         spider.logger.info('Spider opened: %s' % spider.name)
 
 
+class MetricsSpiderMiddleware:
+    """记录每个回调的耗时
+
+    只计算回调生成结果的时间，不包括结果被下游处理的时间。需要设置在内置 spider 中间件之后
+    (优先级数值更大)，才能直接拿到回调的输出
+    """
+    def __init__(self, registry):
+        self.seconds = registry.histogram("callback_seconds", "回调耗时", ["spider", "callback"])
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("METRICS_ENABLED"):
+            raise NotConfigured
+        return cls(metrics)
+
+    def process_spider_output(self, response, result, spider):
+        callback = response.request.callback if response.request is not None else None
+        name = getattr(callback, "__name__", None) or "parse"
+
+        elapsed, result = 0.0, iter(result or ())
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    value = next(result)
+                except StopIteration:
+                    break
+                finally:
+                    elapsed += time.perf_counter() - start
+                yield value
+        finally:
+            self.seconds.observe(spider.name, name, value=elapsed)
+
+
+class ProfilerSpiderMiddleware:
+    """把 PROFILER_CALLBACKS 中的回调(为空时所有回调)交给 profiler 分析
+
+    只包装回调的输出，没有开始分析时几乎没有额外开销，开关见 ProfilerExtension
+    """
+    def __init__(self, callbacks=()):
+        self.callbacks = set(callbacks)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("PROFILER_ENABLED"):
+            raise NotConfigured
+        return cls(crawler.settings.getlist("PROFILER_CALLBACKS"))
+
+    def process_spider_output(self, response, result, spider):
+        callback = response.request.callback if response.request is not None else None
+        name = getattr(callback, "__name__", None) or "parse"
+        if self.callbacks and name not in self.callbacks:
+            return result
+        return profiler.wrap_iter(f"callback:{name}", result or ())
+
+
 class DoubanDownloaderMiddleware(object):
     # Not all methods need to be defined. If a method is not defined,
     # scrapy acts as if the downloader middleware does not modify the
@@ -154,7 +220,7 @@ class UserAgentDownloaderMiddleware(object):
 
 
 class ABuYunDynamicProxyMiddleware:
-    """使用阿布云动态代理通道
+    """使用阿布云动态代理通道，请求 meta 中 dont_proxy 为 True 时不使用代理
     """
     def __init__(self):
         proxyUser = configure.parser.get("abuyun", "PROXY_USER")
@@ -168,48 +234,246 @@ class ABuYunDynamicProxyMiddleware:
         # import ipdb; ipdb.set_trace()
 
     def process_request(self, request, spider):
+        # 图片等不需要代理的请求
+        if request.meta.get("dont_proxy"):
+            return None
         request.meta["proxy"] = self.proxyServer
         request.headers["Proxy-Authorization"] = self.proxyAuth
         spider.logger.debug(f"当前页面使用代理服务: {request.url}")
         
     
-class ABuYunHighQuantityProxyMiddleware:
-    """使用阿布云高质量代理服务
+class ProxyPoolMiddleware:
+    """代理池
+
+    代理由 PROXY_POOL_PROVIDER 提供(默认阿布云高质量代理，本地测试可以使用 StaticProvider 和
+    PROXY_POOL_STATIC)，provider 在线程中调用，不阻塞 reactor。每隔 PROXY_POOL_REFILL_INTERVAL
+    秒检查一次，健康代理少于 PROXY_POOL_MIN_SIZE 时补充；没有健康代理时请求等待补充完成
+
+    每个请求选择 ProxyPool 中最快的健康代理，根据响应状态和 download_latency 更新代理的成功率
+    和响应时间。状态码在 PROXY_POOL_BAN_CODES 中、跳转到安全验证页面以及网络异常都记为失败，
+    并更换代理重试，最多 PROXY_POOL_RETRY_TIMES 次。请求结束(响应、异常或者被其他中间件重新发出)
+    时释放代理，正在使用的请求数量不会累积。请求 meta 中 dont_proxy 为 True 时不使用代理
+
+    中间件需要在 RetryMiddleware(550)之后、RedirectMiddleware(600)之前，先于重试中间件看到
+    原始的响应和网络异常；代理池自己更换代理重试，启用时需要停用 ABuYunDynamicProxyRetryMiddleware
+
+    代理池指标写入 stats: proxy_pool/healthy、proxy_pool/success_rate、proxy_pool/latency 等
     """
-    def __init__(self):
-        # get proxies
-        self.proxy_count = configure.parser.getint("abuyun", "PROXY_COUNT")
-        data = request_abuyun(cnt=1)
+    logger = logging.getLogger(__name__ + ".ProxyPoolMiddleware")
+    block_pattern = re.compile(r"(sec|movie)\.douban\.com/b\?r=")
 
-        self.proxies = data["proxies"] if "proxy" in data else []
+    def __init__(self, pool, provider, refill_interval=10, retry_times=3, ban_codes=(), \
+            stats=None):
+        self.pool = pool
+        self.provider = provider
+        self.refill_interval = refill_interval
+        self.retry_times = retry_times
+        self.ban_codes = set(ban_codes)
+        self.stats = stats
+        self.refills = 0
+        self.refill_failures = 0
+        self._refilling = None
+        self._waiters = []
+        self._loop = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        provider = load_object(settings.get("PROXY_POOL_PROVIDER", \
+            "DouBan.utils.proxy.ABuYunProvider"))
+        provider = provider.from_settings(settings) if hasattr(provider, "from_settings") \
+            else provider()
+
+        pool = ProxyPool(
+            min_size=settings.getint("PROXY_POOL_MIN_SIZE", 5),
+            alpha=settings.getfloat("PROXY_POOL_EWMA_ALPHA", 0.3),
+            min_success=settings.getfloat("PROXY_POOL_MIN_SUCCESS", 0.5),
+            min_samples=settings.getint("PROXY_POOL_MIN_SAMPLES", 5),
+            max_failures=settings.getint("PROXY_POOL_MAX_FAILURES", 3),
+            cooldown=settings.getfloat("PROXY_POOL_COOLDOWN", 60),
+            max_cooldown=settings.getfloat("PROXY_POOL_MAX_COOLDOWN", 1800),
+            max_ejections=settings.getint("PROXY_POOL_MAX_EJECTIONS", 3),
+            max_age=settings.getfloat("PROXY_POOL_MAX_AGE", 0),
+        )
+        middleware = cls(pool, provider,
+            refill_interval=settings.getfloat("PROXY_POOL_REFILL_INTERVAL", 10),
+            retry_times=settings.getint("PROXY_POOL_RETRY_TIMES", 3),
+            ban_codes=[int(i) for i in settings.getlist("PROXY_POOL_BAN_CODES", \
+                [403, 407, 429, 502, 503, 504])],
+            stats=crawler.stats)
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_opened(self, spider):
+        self._loop = task.LoopingCall(self.tick)
+        self._loop.start(self.refill_interval, now=True)
+
+    def tick(self):
+        if self.pool.needs_refill:
+            self.refill()
+        self.publish()
+
+    def refill(self):
+        """在线程中调用 provider 补充代理，同一时间只有一个补充任务
+
+        返回补充完成(无论成功与否)之后触发的 Deferred
+        """
+        waiter = defer.Deferred()
+        self._waiters.append(waiter)
+        if self._refilling is None:
+            self._refilling = threads.deferToThread(self.provider)
+            self._refilling.addCallbacks(self._refilled, self._refill_failed)
+            self._refilling.addBoth(self._refill_done)
+        return waiter
+
+    def _refilled(self, proxies):
+        self.refills += 1
+        count = self.pool.add(proxies)
+        self.logger.debug(f"补充代理 {count} 个，当前健康代理 {self.pool.healthy()} 个")
+
+    def _refill_failed(self, failure):
+        self.refill_failures += 1
+        self.logger.warning(f"补充代理失败: {failure.getErrorMessage()}")
+
+    def _refill_done(self, _):
+        self._refilling = None
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            waiter.callback(None)
 
     def process_request(self, request, spider):
-        if len(self.proxies) == 0:
-            spider.logger.debug("代理数量消耗殆尽")
+        # RedirectMiddleware 跳转之后的请求继续使用原来的代理，跳转到安全验证页面时记在这个代理上
+        if request.meta.get("redirect_urls") and self.held(request):
+            return None
+        # 其他中间件重新发出的请求没有经过 process_response，先释放原来的代理
+        self.release(request)
+        # 请求自己指定的代理以及不需要代理的请求不做处理
+        if "proxy" in request.meta or request.meta.get("dont_proxy"):
+            return None
+
+        proxy = self.pool.get()
+        if proxy is not None:
+            if self.pool.needs_refill:
+                self.refill()
+            return self.assign(request, proxy)
+
+        # 没有健康代理时等待补充完成，不阻塞其他请求
+        return self.refill().addCallback(lambda _: self.assign(request, self.pool.get()))
+
+    def assign(self, request, proxy):
+        if proxy is None:
+            self.logger.warning(f"没有可用的代理，直接请求: {request.url}")
+            return None
 
-        # 随机选择一个代理
-        proxy_selected = random.choice(self.proxies)
-        proxy = "http://" + proxy_selected
         request.meta["proxy"] = proxy
+        request.meta["_proxy_pool"] = proxy
+        request.meta["_proxy_start"] = time.time()
+        return None
 
-        spider.logger.debug('Use Proxy: ' + proxy)
+    @staticmethod
+    def held(request):
+        """请求正在使用代理池中的代理"""
+        proxy = request.meta.get("_proxy_pool")
+        return proxy is not None and request.meta.get("proxy") == proxy
 
+    def release(self, request):
+        """释放请求占用的代理并从 meta 中删除，重新发出的请求会重新选择代理，返回代理地址"""
+        proxy = request.meta.pop("_proxy_pool", None)
+        if proxy is None:
+            return None
+        self.pool.release(proxy)
+        if request.meta.get("proxy") == proxy:
+            del request.meta["proxy"]
+        return proxy
 
     def process_response(self, request, response, spider):
-        """处理异常请求结果
+        if not self.held(request):
+            self.release(request)
+            return response
+
+        proxy = request.meta["_proxy_pool"]
+        try:
+            latency = request.meta.get("download_latency", \
+                time.time() - request.meta.get("_proxy_start", time.time()))
+            ok = response.status not in self.ban_codes and not self.banned(request, response)
+            self.pool.report(proxy, ok, latency)
+        finally:
+            self.release(request)
+
+        if ok:
+            return response
+        return self.retry(request, f"status {response.status}", spider) or response
+
+    def process_exception(self, request, exception, spider):
+        if not self.held(request):
+            self.release(request)
+            return None
+
+        proxy = request.meta["_proxy_pool"]
+        try:
+            network = isinstance(exception, ABuYunDynamicProxyRetryMiddleware.EXCEPTIONS_TO_RETRY)
+            if network:
+                self.pool.report(proxy, False)
+        finally:
+            self.release(request)
+
+        if network:
+            return self.retry(request, exception.__class__.__name__, spider)
+        return None
+
+    def banned(self, request, response):
+        """跳转到豆瓣安全验证页面
+
+        中间件在 RedirectMiddleware 之前(优先级数值更小)，跳转已经完成，根据跳转之后的 URL 判断；
+        请求设置了 dont_redirect 时根据 Location 判断
         """
-        if int(response.status) not in [200, 301, 302]:
-            
-            data = request_abuyun(cnt=self.proxy_count)
+        if response.status in (301, 302, 303, 307):
+            location = (response.headers.get("Location") or b"").decode("utf8", "ignore")
+            return bool(self.block_pattern.search(location))
+        return bool(request.meta.get("redirect_urls")) and \
+            bool(self.block_pattern.search(response.url))
 
-            proxy = data["proxies"]
-            request.meta["proxy"] = random.choice(proxy)
-            self.logger.debug("Use New Proxy: {}".format(proxy))
-            return request
-        return response
+    def retry(self, request, reason, spider):
+        retries = request.meta.get("proxy_retry_times", 0) + 1
+        if retries > self.retry_times:
+            self.logger.debug(f"更换代理达到最大次数 ({reason}): {request.url}")
+            self.inc("proxy_pool/retry/max_reached", spider=spider)
+            return None
+
+        self.inc("proxy_pool/retry/count", spider=spider)
+        self.inc(f"proxy_pool/retry/reason/{reason}", spider=spider)
+        # 跳转到安全验证页面时重新请求原来的 URL
+        redirect_urls = request.meta.get("redirect_urls")
+        retry = request.replace(url=redirect_urls[0] if redirect_urls else request.url, \
+            dont_filter=True)
+        for key in ("redirect_urls", "redirect_reasons", "redirect_times", "redirect_ttl"):
+            retry.meta.pop(key, None)
+        retry.meta["proxy_retry_times"] = retries
+        return retry
+
+    def inc(self, key, count=1, spider=None):
+        if self.stats is not None:
+            self.stats.inc_value(key, count, spider=spider)
+
+    def publish(self):
+        """代理池指标写入 stats"""
+        if self.stats is None:
+            return
+        values = dict(self.pool.stats, refills=self.refills, refill_failures=self.refill_failures)
+        for key, value in values.items():
+            self.stats.set_value(f"proxy_pool/{key}", value)
 
+    def spider_closed(self, spider):
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+        self.publish()
+        spider.logger.info(f"代理池: {self.pool.stats}")
+
+
+# 原来的阿布云高质量代理中间件，保留名称兼容已有配置
+ABuYunHighQuantityProxyMiddleware = ProxyPoolMiddleware
 
-   
 
 class ABuYunDynamicProxyRetryMiddleware(RetryMiddleware):
     """
@@ -244,6 +508,14 @@ class ABuYunDynamicProxyRetryMiddleware(RetryMiddleware):
 
 
     def process_response(self, request, response, spider):
+        # 不使用代理的请求(例如图片)由 Scrapy 的 RetryMiddleware 处理
+        if request.meta.get("dont_proxy"):
+            return response
+
+        # ResponseCacheMiddleware 条件请求返回的 304 表示缓存仍然有效，交给缓存中间件处理，不能重试
+        if response.status == 304 and "_cache_fingerprint" in request.meta:
+            return response
+
         # 如果达到最大尝试次数记录异常日志
         if request.meta.get('retry_times') and request.meta.get('retry_times') == self.max_retry_times:
             spider.logger.error(f"达到最大尝试次数限制: {response.url}")
@@ -290,6 +562,8 @@ class ABuYunDynamicProxyRetryMiddleware(RetryMiddleware):
 
 
     def process_exception(self, request, exception, spider):
+        if request.meta.get("dont_proxy"):
+            return None
         if isinstance(exception, self.EXCEPTIONS_TO_RETRY):
             spider.logger.debug("Catch Exception: {}".format(exception))
             
@@ -305,28 +579,502 @@ class ABuYunDynamicProxyRetryMiddleware(RetryMiddleware):
 
 class RandomDelayMiddleware:
     """设置随机延迟时间
-    
+
+    每个请求延迟 1 到 RANDOM_DELAY 秒之间的随机时间，延迟通过返回 reactor.callLater 的
+    Deferred 实现，不会阻塞 reactor，不同请求的延迟可以同时进行。延迟按照下载 slot 统计，
+    slot 依次取 download_slot、代理地址以及域名；RANDOM_DELAY_SLOT_INTERVAL 大于 0 时，
+    同一 slot 相邻请求之间至少间隔该秒数。请求 meta 中 dont_delay 为 True 时不延迟。
+
+    实际注入的延迟写入 stats: random_delay/seconds、random_delay/count 以及各 slot 的
+    random_delay/slot/<slot>/seconds
     """
-    def __init__(self, delay):
+    def __init__(self, delay, interval=0, stats=None):
         self.delay = delay
+        self.interval = interval
+        self.stats = stats
+        # slot 最近一次请求的计划发出时间
+        self.schedule = {}
+        # slot 累计注入的延迟时间和请求数量
+        self.injected = {}
 
     @classmethod
     def from_crawler(cls, crawler):
         delay = crawler.settings.get("RANDOM_DELAY", 4)
         if not isinstance(delay, int):
             raise ValueError("RANDOM_DELAY need a int")
+        interval = crawler.settings.getfloat("RANDOM_DELAY_SLOT_INTERVAL", 0)
         
-        return cls(delay)
+        middleware = cls(delay, interval, crawler.stats)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
 
     def process_request(self, request, spider):
-        delay = random.randint(1, self.delay)
-        spider.logger.debug("{name} Delay: {time}s".format(
-            name=spider.name, time=delay))
-        time.sleep(delay)
+        if request.meta.get("dont_delay"):
+            return None
+
+        slot = self.get_slot(request)
+        now = time.time()
+        scheduled = now + random.uniform(1, self.delay)
+        if self.interval > 0 and slot in self.schedule:
+            scheduled = max(scheduled, self.schedule[slot] + self.interval)
+        self.schedule[slot] = scheduled
+        delay = scheduled - now
+
+        self.record(slot, delay, spider)
+        spider.logger.debug("{name} Delay: {time:.2f}s, slot: {slot}".format(
+            name=spider.name, time=delay, slot=slot))
+        return task.deferLater(reactor, delay, lambda: None)
+
+    def get_slot(self, request):
+        """请求所属的 slot"""
+        if "download_slot" in request.meta:
+            return request.meta["download_slot"]
+        if request.meta.get("proxy"):
+            return request.meta["proxy"]
+        return urllib.parse.urlparse(request.url).hostname or ""
+
+    def record(self, slot, delay, spider):
+        """记录注入的延迟"""
+        seconds, count = self.injected.get(slot, (0.0, 0))
+        self.injected[slot] = (seconds + delay, count + 1)
+
+        if self.stats is not None:
+            self.stats.inc_value("random_delay/seconds", delay, spider=spider)
+            self.stats.inc_value("random_delay/count", spider=spider)
+            self.stats.inc_value(f"random_delay/slot/{slot}/seconds", delay, spider=spider)
+
+    def spider_closed(self, spider):
+        for slot, (seconds, count) in self.injected.items():
+            spider.logger.info(f"RandomDelay slot {slot}: {count} 个请求共延迟 {seconds:.2f}s")
+
+
+class AdaptiveConcurrencyMiddleware:
+    """根据封禁信号调整每个下载 slot 的并发数量和请求间隔
+
+    封禁信号: 跳转到 sec.douban.com/b?r= 或者 movie.douban.com/b?r= 安全验证页面，状态码在
+    ADAPTIVE_BLOCK_CODES 中，以及 ADAPTIVE_EXCEPTIONS_AS_BLOCKS 为 True 时的网络异常。每个响应
+    交给 AIMDController，出现封禁时乘性降低速率，封禁率低于 ADAPTIVE_TARGET_BLOCK_RATE 时加性提
+    高速率，结果写入下载 slot 的 concurrency 和 delay
 
+    ADAPTIVE_SLOT_BY_PROXY 为 True 时同一个域名使用不同代理的请求分配到不同的 slot，每个代理
+    单独调整。中间件需要在 RedirectMiddleware 之后(优先级数值更大)，才能看到原始的跳转响应。
+    AutoThrottle 同样会修改 slot.delay，两者不能同时启用。请求 meta 中 dont_throttle 为 True
+    时(例如图片请求)不统计也不调整
+
+    当前限制写入 stats: adaptive/slot/<slot>/concurrency、delay、block_rate
+    """
+    logger = logging.getLogger(__name__ + ".AdaptiveConcurrencyMiddleware")
+    block_pattern = re.compile(r"(sec|movie)\.douban\.com/b\?r=")
+
+    def __init__(self, crawler, controller, block_codes=(403, 429), by_proxy=True, \
+            exceptions_as_blocks=True):
+        self.crawler = crawler
+        self.controller = controller
+        self.block_codes = set(block_codes)
+        self.by_proxy = by_proxy
+        self.exceptions_as_blocks = exceptions_as_blocks
+        self.stats = crawler.stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("ADAPTIVE_ENABLED"):
+            raise NotConfigured
+        if settings.getbool("AUTOTHROTTLE_ENABLED"):
+            cls.logger.warning("AutoThrottle 和 AdaptiveConcurrencyMiddleware 同时修改下载间隔")
+
+        controller = AIMDController(
+            target=settings.getfloat("ADAPTIVE_TARGET_BLOCK_RATE", 0.02),
+            min_concurrency=settings.getint("ADAPTIVE_MIN_CONCURRENCY", 1),
+            max_concurrency=settings.getint("ADAPTIVE_MAX_CONCURRENCY", 16),
+            min_delay=settings.getfloat("ADAPTIVE_MIN_DELAY", 0),
+            max_delay=settings.getfloat("ADAPTIVE_MAX_DELAY", 60),
+            start_concurrency=settings.getint("ADAPTIVE_START_CONCURRENCY", 1),
+            start_delay=settings.getfloat("ADAPTIVE_START_DELAY", \
+                settings.getfloat("DOWNLOAD_DELAY")),
+            delay_step=settings.getfloat("ADAPTIVE_DELAY_STEP", 0.25),
+            decrease_factor=settings.getfloat("ADAPTIVE_DECREASE_FACTOR", 0.5),
+            alpha=settings.getfloat("ADAPTIVE_EWMA_ALPHA", 0.1),
+            interval=settings.getfloat("ADAPTIVE_INTERVAL", 5),
+        )
+        middleware = cls(crawler, controller,
+            block_codes=[int(i) for i in settings.getlist("ADAPTIVE_BLOCK_CODES", [403, 429])],
+            by_proxy=settings.getbool("ADAPTIVE_SLOT_BY_PROXY", True),
+            exceptions_as_blocks=settings.getbool("ADAPTIVE_EXCEPTIONS_AS_BLOCKS", True))
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
 
-class CookiesRetryDownloaderMidddleware(RetryMiddleware):
     def process_request(self, request, spider):
-        cookies = random.choice(list(douban_cookie()))
+        if request.meta.get("dont_throttle"):
+            return None
+        if self.by_proxy and request.meta.get("proxy") and "download_slot" not in request.meta:
+            host = urllib.parse.urlparse(request.url).hostname or ""
+            request.meta["download_slot"] = f"{host}@{request.meta['proxy']}"
+            request.meta["_adaptive_slot"] = True
+        elif request.meta.get("_adaptive_slot") and not request.meta.get("proxy"):
+            # 重试的请求不再使用代理
+            request.meta.pop("download_slot", None)
+            request.meta.pop("_adaptive_slot", None)
+
+        self.apply(self.slot_key(request, spider))
+        return None
+
+    def process_response(self, request, response, spider):
+        if "cached" in response.flags or request.meta.get("dont_throttle"):
+            return response
+        self.record(request, self.blocked(request, response), spider)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        if request.meta.get("dont_throttle"):
+            return None
+        if self.exceptions_as_blocks and not isinstance(exception, IgnoreRequest):
+            self.record(request, True, spider)
+        return None
+
+    def blocked(self, request, response):
+        if response.status in self.block_codes:
+            return True
+        if response.status in (301, 302, 303, 307):
+            location = (response.headers.get("Location") or b"").decode("utf8", "ignore")
+            return bool(self.block_pattern.search(location))
+        # 没有经过跳转直接请求了安全验证页面
+        return not request.meta.get("redirect_urls") and \
+            bool(self.block_pattern.search(request.url))
+
+    def slot_key(self, request, spider):
+        downloader = self.crawler.engine.downloader
+        if hasattr(downloader, "get_slot_key"):
+            return downloader.get_slot_key(request)
+        return downloader._get_slot_key(request, spider)
+
+    def record(self, request, blocked, spider):
+        key = self.slot_key(request, spider)
+        if self.controller.record(key, blocked):
+            self.apply(key)
+            limit = self.controller.limit(key)
+            spider.logger.debug(f"调整下载 slot {key}: {limit}")
+            self.stats.set_value(f"adaptive/slot/{key}/concurrency", limit.concurrency)
+            self.stats.set_value(f"adaptive/slot/{key}/delay", limit.delay)
+
+        self.stats.set_value(f"adaptive/slot/{key}/block_rate", \
+            self.controller.limit(key).block_rate)
+        for name, value in self.controller.stats.items():
+            self.stats.set_value(f"adaptive/{name}", value)
+
+    def apply(self, key):
+        """把 controller 中的限制写入下载 slot，slot 在第一个请求进入下载器之后才会创建"""
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is None:
+            return
+        limit = self.controller.limit(key)
+        slot.concurrency = limit.concurrency
+        slot.delay = limit.delay
+
+    def spider_closed(self, spider):
+        for key, limit in self.controller.slots.items():
+            spider.logger.info(f"AdaptiveConcurrency slot {key}: {limit}, " +
+                f"{limit.blocks}/{limit.responses} 个封禁")
+
+
+class ResponseCacheMiddleware:
+    """响应内容磁盘缓存
+
+    重复爬取的详情、演职人员以及获奖页面直接使用缓存，不再通过代理下载。缓存有效期根据
+    CACHE_TTLS 中的 URL 规则确定，有效期内直接返回缓存的响应；过期后如果保存了 ETag 或者
+    Last-Modified，使用 If-None-Match、If-Modified-Since 发出条件请求，服务器返回 304 时
+    继续使用缓存。只缓存 GET 请求的 200 响应，请求 meta 中 dont_cache 为 True 时不使用缓存。
+
+    需要放在代理、随机延迟中间件之前，命中缓存的请求不会经过代理和延迟。条件请求带有
+    _cache_fingerprint，ABuYunDynamicProxyRetryMiddleware 不会重试它的 304。统计信息写入 stats:
+    cache/hit、cache/miss、cache/revalidate、cache/revalidated、cache/store、
+    cache/evicted、cache/bytes_saved 以及 cache/size_bytes
+
+    SQLite 的读写通过 deferToThread 在线程池中执行，不会阻塞 reactor；访问时间和写入由
+    ResponseCache 累计之后批量提交(CACHE_COMMIT_SIZE、CACHE_COMMIT_INTERVAL)
+    """
+    def __init__(self, storage, policy, stats=None, fingerprint=None):
+        self.storage = storage
+        self.policy = policy
+        self.stats = stats
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("CACHE_ENABLED", False):
+            raise NotConfigured
+
+        storage = ResponseCache(
+            settings.get("CACHE_PATH"),
+            max_bytes=int(settings.getfloat("CACHE_MAX_GB", 0) * 1024 ** 3),
+            commit_size=settings.getint("CACHE_COMMIT_SIZE", 100),
+            commit_interval=settings.getfloat("CACHE_COMMIT_INTERVAL", 5)
+        )
+        policy = TTLPolicy(settings.getlist("CACHE_TTLS", []), \
+            settings.getint("CACHE_DEFAULT_TTL", 0))
+
+        # Scrapy 2.7 之后使用 crawler.request_fingerprinter
+        fingerprinter = getattr(crawler, "request_fingerprinter", None)
+        if fingerprinter is not None:
+            fingerprint = lambda request: fingerprinter.fingerprint(request).hex()
+        else:
+            from scrapy.utils.request import request_fingerprint as fingerprint
+
+        middleware = cls(storage, policy, crawler.stats, fingerprint)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def process_request(self, request, spider):
+        if request.method != "GET" or request.meta.get("dont_cache"):
+            return None
+
+        ttl = self.policy(request.url)
+        if ttl <= 0:
+            return None
+
+        fingerprint = self.fingerprint(request)
+        dfd = threads.deferToThread(self.storage.get, fingerprint)
+        dfd.addCallback(self._lookup, request, fingerprint, ttl, spider)
+        return dfd
+
+    def _lookup(self, entry, request, fingerprint, ttl, spider):
+        if entry is None:
+            self.inc("cache/miss", spider=spider)
+            return None
+
+        if time.time() - entry.stored < ttl:
+            self.inc("cache/hit", spider=spider)
+            self.inc("cache/bytes_saved", entry.raw_size, spider=spider)
+            return self.build_response(entry)
+
+        # 过期的缓存，使用条件请求确认内容是否变化
+        if entry.etag or entry.last_modified:
+            if entry.etag:
+                request.headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                request.headers["If-Modified-Since"] = entry.last_modified
+            request.meta["_cache_fingerprint"] = fingerprint
+            self.inc("cache/revalidate", spider=spider)
+        else:
+            self.inc("cache/miss", spider=spider)
+        return None
+
+    def process_response(self, request, response, spider):
+        if "cached" in response.flags:
+            return response
+
+        fingerprint = request.meta.get("_cache_fingerprint")
+        if response.status == 304 and fingerprint is not None:
+            dfd = threads.deferToThread(self._revalidate, fingerprint)
+            dfd.addCallback(self._revalidated, request, response, spider)
+            return dfd
+        return self._store(request, response, spider)
+
+    def _revalidate(self, fingerprint):
+        """在线程中执行，读取缓存并更新保存时间"""
+        entry = self.storage.get(fingerprint)
+        if entry is not None:
+            self.storage.touch(fingerprint)
+        return entry
+
+    def _revalidated(self, entry, request, response, spider):
+        if entry is None:
+            return self._store(request, response, spider)
+
+        self.inc("cache/revalidated", spider=spider)
+        self.inc("cache/bytes_saved", entry.raw_size, spider=spider)
+        return self.build_response(entry)
+
+    def _store(self, request, response, spider):
+        fingerprint = request.meta.get("_cache_fingerprint")
+        if response.status != 200 or request.method != "GET" or \
+                request.meta.get("dont_cache") or self.policy(request.url) <= 0:
+            return response
+
+        headers = {
+            key.decode("latin1"): [value.decode("latin1") for value in values] \
+                for key, values in response.headers.items()
+        }
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        dfd = threads.deferToThread(self.storage.set,
+            fingerprint or self.fingerprint(request), response.url, response.status, \
+            headers, response.body,
+            etag=etag.decode("latin1") if etag else None,
+            last_modified=last_modified.decode("latin1") if last_modified else None
+        )
+        dfd.addCallback(self._stored, response, spider)
+        return dfd
+
+    def _stored(self, evicted, response, spider):
+        self.inc("cache/store", spider=spider)
+        self.inc("cache/evicted", evicted, spider=spider)
+        return response
+
+    def build_response(self, entry):
+        headers = Headers(entry.headers)
+        respcls = responsetypes.from_args(headers=headers, url=entry.url, body=entry.body)
+        return respcls(url=entry.url, status=entry.status, headers=headers, body=entry.body, \
+            flags=["cached"])
+
+    def inc(self, key, count=1, spider=None):
+        if self.stats is not None and count:
+            self.stats.inc_value(key, count, spider=spider)
+
+    def spider_closed(self, spider):
+        if self.stats is not None:
+            self.stats.set_value("cache/size_bytes", self.storage.size, spider=spider)
+        self.storage.close()
+
+
+class CookiePoolMiddleware:
+    """登录 cookie 池
+
+    启动时读取 COOKIE_POOL_ACCOUNTS 中的账号，在后台线程中逐个登录(不会同时登录多个账号)，
+    之后每隔 COOKIE_POOL_REFRESH_INTERVAL 秒为过期、失效的账号重新登录。COOKIE_POOL_REDIS 为
+    True 时 cookie 同时保存在 Redis 中，重启之后不需要重新登录
+
+    process_request 只从内存中按照 COOKIE_POOL_STRATEGY 选择 cookie，不会等待登录；没有可用的
+    cookie 时不带 cookie 请求。每个账号使用单独的 cookiejar，避免不同账号的 cookie 混在一起。
+    响应跳转到登录页面时该账号的 cookie 作废，原请求换一个账号重新请求
+    """
+    logger = logging.getLogger(__name__ + ".CookiePoolMiddleware")
+    login_pattern = re.compile(r"accounts\.douban\.com/passport/login|douban\.com/accounts/login")
+
+    def __init__(self, pool, refresh_interval=30, retry_times=2, stats=None):
+        self.pool = pool
+        self.refresh_interval = refresh_interval
+        self.retry_times = retry_times
+        self.stats = stats
+        self._logging_in = False
+        self._loop = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        accounts = list(extract_info(settings.get("COOKIE_POOL_ACCOUNTS")))
+        if not accounts:
+            raise NotConfigured("没有可以登录的账号")
+
+        store = None
+        if settings.getbool("COOKIE_POOL_REDIS"):
+            connection = redis.StrictRedis(connection_pool=redis.ConnectionPool(
+                **settings.getdict("DATABASE_CONF")["redis"]))
+            store = RedisCookieStore(connection, settings.get("COOKIE_POOL_REDIS_KEY", \
+                "douban:cookies"))
+
+        pool = CookiePool(accounts,
+            ttl=settings.getfloat("COOKIE_POOL_TTL", 12 * 3600),
+            strategy=settings.get("COOKIE_POOL_STRATEGY", "round-robin"),
+            store=store,
+            login_cooldown=settings.getfloat("COOKIE_POOL_LOGIN_COOLDOWN", 300),
+            retire_cooldown=settings.getfloat("COOKIE_POOL_RETIRE_COOLDOWN", 60))
+        middleware = cls(pool,
+            refresh_interval=settings.getfloat("COOKIE_POOL_REFRESH_INTERVAL", 30),
+            retry_times=settings.getint("COOKIE_POOL_RETRY_TIMES", 2),
+            stats=crawler.stats)
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_opened(self, spider):
+        self._loop = task.LoopingCall(self.refresh)
+        self._loop.start(self.refresh_interval, now=True)
+
+    def refresh(self):
+        """在后台线程中逐个登录需要登录的账号"""
+        if self._logging_in:
+            return
+        pending = self.pool.pending()
+        if not pending:
+            self.publish()
+            return
+
+        account = pending[0]
+        self._logging_in = True
+        d = threads.deferToThread(self.pool.login, account)
+        d.addCallback(self._logged_in, account["name"])
+        d.addBoth(self._login_done)
+
+    def _logged_in(self, cookies, name):
+        if cookies:
+            self.pool.put(name, cookies)
+            self.logger.debug(f"账号 {name} 登录成功")
+        else:
+            self.pool.failed(name)
+
+    def _login_done(self, result):
+        self._logging_in = False
+        self.publish()
+        # 还有需要登录的账号时继续，不等待下一次定时检查
+        if self.pool.pending():
+            reactor.callLater(0, self.refresh)
+
+    def process_request(self, request, spider):
+        if request.meta.get("dont_merge_cookies"):
+            return None
+        # 跳转之后的请求继续使用原来的账号，登录页面跳转才能找到失效的 cookie
+        if request.meta.get("redirect_urls") and "_cookie_account" in request.meta:
+            return None
+
+        selected = self.pool.get()
+        if selected is None:
+            self.inc("cookie_pool/anonymous", spider=spider)
+            request.meta.pop("_cookie_account", None)
+            return None
+
+        name, cookies = selected
         request.cookies = cookies
-        # return request
\ No newline at end of file
+        request.meta["cookiejar"] = name
+        request.meta["_cookie_account"] = name
+        self.inc("cookie_pool/used", spider=spider)
+        return None
+
+    def process_response(self, request, response, spider):
+        name = request.meta.get("_cookie_account")
+        if name is None or not self.login_required(response):
+            return response
+
+        self.pool.retire(name)
+        self.inc("cookie_pool/retired", spider=spider)
+
+        retries = request.meta.get("cookie_retry_times", 0) + 1
+        if retries > self.retry_times:
+            spider.logger.debug(f"更换 cookie 达到最大次数: {request.url}")
+            return response
+
+        # 跳转之后的请求 URL 是登录页面，使用跳转之前的 URL 重新请求
+        url = (request.meta.get("redirect_urls") or [request.url])[0]
+        retry = request.replace(url=url, dont_filter=True)
+        for key in ("redirect_urls", "redirect_times", "redirect_ttl", "redirect_reasons", \
+                "cookiejar", "_cookie_account"):
+            retry.meta.pop(key, None)
+        retry.meta["cookie_retry_times"] = retries
+        return retry
+
+    def login_required(self, response):
+        if response.status in (301, 302):
+            location = (response.headers.get("Location") or b"").decode("utf8", "ignore")
+            return bool(self.login_pattern.search(location))
+        return bool(self.login_pattern.search(response.url))
+
+    def inc(self, key, count=1, spider=None):
+        if self.stats is not None:
+            self.stats.inc_value(key, count, spider=spider)
+
+    def publish(self):
+        if self.stats is None:
+            return
+        for key, value in self.pool.stats.items():
+            self.stats.set_value(f"cookie_pool/{key}", value)
+
+    def spider_closed(self, spider):
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+        self.publish()
+        spider.logger.info(f"cookie 池: {self.pool.stats}")
+
+
+# 原来每个请求都重新登录所有账号的中间件，保留名称兼容已有配置
+CookiesRetryDownloaderMidddleware = CookiePoolMiddleware
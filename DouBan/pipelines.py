@@ -7,26 +7,36 @@
 
 import pymysql
 import copy
+import inspect
+import scrapy
 import logging
 import json
 import bson
 import pymongo
 from os import path
+from urllib.parse import urlparse
 from scrapy.exceptions import DropItem
+from twisted.internet import task, defer, threads
 
 from DouBan.utils.base import BaseSQLPipeline, BasePipeline
-from DouBan.utils.hammers import extract1st_char
+from DouBan.utils.hammers import extract1st_char, extract1st_chars
+from DouBan.utils.pinyin import initials
+from DouBan.utils.dedup import Deduplicator, RedisSetBackend
+from DouBan.utils.archive import ItemArchive
+from DouBan.utils.blobstore import BlobStore
 from DouBan.items import (
     DouBanDetailItem, DouBanAwardItem, CoverImageItem, ListItem, DouBanWorkerItem,
     DouBanPeopleItem, DouBanPhotosItem, DouBanEpisodeItem, DouBanCommentsItemM
 )
 from DouBan.database.manager.datamodel import *
 from DouBan.database.conf import configure
-from DouBan.database.manager import DataBaseManipulater
+from DouBan.database.manager import DataBaseManipulater, BufferedWriter, SeedCursor
 from DouBan.utils.exceptions import InappropriateArgument
 
 cur_path = path.dirname(__file__)
 manipulater = DataBaseManipulater()
+# 各个 Pipeline 共享的批量写入对象
+writer = BufferedWriter(manipulater)
 class DoubanStoragePipeline(BaseSQLPipeline):
     """Store Data Item Pipeline
     
@@ -36,6 +46,9 @@ class DoubanStoragePipeline(BaseSQLPipeline):
     is mapping with item keys.
     """
     db_type = "mysql"
+    # the tables which store video details, and the first field is `video_id`
+    child_tables = ("video_actor", "video_director", "video_type", "video_review", \
+        "video_extension_region", "video_character")
     
     def __init__(self, basic_config, redis_config, schema, **kwargs):
         self.basic_config = basic_config
@@ -53,176 +66,211 @@ class DoubanStoragePipeline(BaseSQLPipeline):
         # basic_config["database"] = settings[cls.db_type]["database"]
         redis_config = settings["redis"]
         
+        initials.configure(maxsize=crawler.settings.getint("PINYIN_CACHE_SIZE", 100000), \
+            path=crawler.settings.get("PINYIN_CACHE_PATH"))
 
-        return cls(
+        pipeline = cls(
             basic_config=basic_config,
             redis_config=redis_config,
             schema=schema
         )
+        pipeline.warm_pinyin = crawler.settings.getbool("PINYIN_WARM_TABLES", False)
+        pipeline.stats = crawler.stats
+        pipeline.group_size = crawler.settings.getint("STORAGE_GROUP_SIZE", 1)
+        pipeline.flush_interval = crawler.settings.getfloat("STORAGE_FLUSH_INTERVAL", 5)
+        pipeline.archive = ItemArchive(
+            crawler.settings.get("ARCHIVE_DIR", path.join(cur_path, "log/archive")),
+            compression=crawler.settings.get("ARCHIVE_COMPRESSION", "gzip"),
+            level=crawler.settings.get("ARCHIVE_LEVEL"),
+            max_bytes=crawler.settings.getint("ARCHIVE_MAX_BYTES", 64 * 1024 * 1024),
+            max_seconds=crawler.settings.getint("ARCHIVE_MAX_SECONDS", 3600),
+            flush_interval=crawler.settings.getfloat("ARCHIVE_FLUSH_INTERVAL", 5),
+            queue_size=crawler.settings.getint("ARCHIVE_QUEUE_SIZE", 10000)
+        )
+        return pipeline
 
 
     def open_spider(self, spider):
+        # names stored in person and worker tables pre-warm the PinYin initials cache
+        if getattr(self, "warm_pinyin", False):
+            initials.warm_from_tables(manipulater)
+
         self.redis_pool = self.create_connection("redis", self.redis_config)
+        # item class name is the redis key
+        self.dedup = Deduplicator(RedisSetBackend(self.redis_pool, key_format="{namespace}"))
         self.db_connection = self.create_connection(self.db_type, self.basic_config, **self._options)
 
         self.db_cursor = self.db_connection.cursor()
         # store the exceptions data item
         self.error_file_store = open(path.join(cur_path, f"log/err_{spider.name}.txt"), "a")
         
-        # Store all data
-        self.file = open(path.join(cur_path, f"log/.all.txt"), "a")
+        # Store all data into the rotated, compressed archive
+        if getattr(self, "archive", None) is None:
+            self.archive = ItemArchive(path.join(cur_path, "log/archive"))
+        self.archive.open()
 
+        # items are written in groups, flush the incomplete group periodically
+        self.group = []
+        self.group_size = getattr(self, "group_size", 1)
+        self.counters = {"items": 0, "groups": 0, "errors": 0}
+        self.flush_task = task.LoopingCall(self.flush)
+        self.flush_task.start(getattr(self, "flush_interval", 5), now=False)
 
-    def process_item(self, item, spider):
-        def insert(sentence, data, query_step=None, single_query=True):
-            """Insert Data Into Table"""
-            try:
-                # insert a single data
-                if single_query:
-                    self.db_cursor.execute(sentence, data)
-                    self.db_connection.commit()
-                # insert many data with executemany method
-                else:
-                    self.db_cursor.executemany(sentence, data)
-                    self.db_connection.commit()
-                
-                self.log(f"Insert data at {query_step} success", level=logging.INFO)
-            except Exception as err:
-                self.error_file_store.write(json.dumps(dict(item, query_step=query_step), ensure_ascii=False)+ "\n")
-                self.log(f"Insert value error: {data}, because {err}, At insert step {query_step}", \
-                        level=logging.ERROR)
-        
 
+    def process_item(self, item, spider):
         # if item is not DoubanDataItem object, just return item
         if not isinstance(item, DoubanDataItem):
             return item
 
         # use the item key as redis key, and check the data id exists
         redis_key = item.__class__.__name__
-        if self.redis_pool.sismember(redis_key, item["id"]):
+        if not self.dedup.add(redis_key, item["id"]):
             raise DropItem(f"Duplicated DataItem {item['id']}-{item['title']}")
-        else:
-            self.redis_pool.sadd(redis_key, item["id"])
 
-        # !important 写入所有数据到 file
-        self.file.write(json.dumps(dict(item), ensure_ascii=False)+"\n")    
+        # !important 归档所有数据
+        self.archive.write(redis_key, dict(item))
 
-        # reconnect the database
-        self.db_connection.ping(reconnect=True)
+        self.group.append(item)
+        if len(self.group) >= self.group_size:
+            self.flush()
 
-        # store video data into table, and query id
-        try:
-            video_sent = self.insert_sentence("video", self.schema["video"].keys())
-            video_data = self.extract_data(self.schema["video"], item, jane_key="title")
+        return item
 
-            self.db_cursor.execute(video_sent, video_data)
-            self.db_connection.commit()
-            # self.db_cursor.execute("SELECT id FROM video WHERE name=%s LIMIT 1;", \
-            #                         (item['title'], item['rate']))
-            # item["video_id"] = self.db_cursor.fetchone()[0]
-        except TypeError as err:
-            self.error_file_store.write(json.dumps(dict(item, query_step="video"), ensure_ascii=False) + "\n")
-            self.log(f"Insert value error: {item}, because {err}",level=logging.ERROR)
-        except Exception as err:
-            self.error_file_store.write(json.dumps(dict(item, query_step="video"), ensure_ascii=False) + "\n")
 
-        self.db_cursor.execute("SELECT id FROM video WHERE `name` = %s ORDER BY create_time DESC;", \
-            (item['title'],))
-        item["video_id"] = self.db_cursor.fetchone()[0]
+    def flush(self):
+        """Write the grouped items in a single transaction
+
+        If the transaction fails, write the items one by one, so only the wrong items are
+        stored into the error file
+        """
+        items, self.group = self.group, []
+        if items:
+            self.write(items)
 
-        # store actor data into table, and query id
-        actor_sent = self.insert_sentence("video_actor", self.schema["video_actor"].keys())
-        actors_data = self.extract_list(item["actors"], True, item["video_id"])
 
-        if len(actors_data) > 0:
-            insert(actor_sent, actors_data, query_step="actor", single_query=False) # insert step
-            # query id 
-            
-            query_sent = f"SELECT DISTINCT id FROM video_actor WHERE `name` in ({'%s, ' * (len(actors_data)-1)}%s) AND `video_id`=%s;"
-            query_condition = [i[1] for i in actors_data] + [item["video_id"]]
-            self.db_cursor.execute(query_sent, tuple(query_condition))
-            actors_id = [i[0] for i in self.db_cursor.fetchall()]
-        else:
+    def write(self, items):
+        # reconnect the database
+        self.db_connection.ping(reconnect=True)
+        try:
+            self.write_group(items)
+            self.db_connection.commit()
+            self.counters["groups"] += 1
+            self.log(f"Insert {len(items)} items success", level=logging.INFO)
+            return
+        except Exception as err:
+            self.db_connection.rollback()
+            if len(items) == 1:
+                query_step = getattr(err, "query_step", None)
+                self.store_error(items[0], query_step)
+                self.counters["errors"] += 1
+                self.log(f"Insert value error: {items[0]}, because {err}, At insert step " + 
+                    f"{query_step}", level=logging.ERROR)
+                return
+            self.log(f"Insert group of {len(items)} items failed, because {err}, retry one by one", \
+                level=logging.WARNING)
+
+        for item in items:
+            self.write([item])
+
+
+    def write_group(self, items):
+        """Insert the video rows and then all child rows of the items
+
+        The video id comes from `cursor.lastrowid`, and the child rows of all items are inserted
+        with one multi-row statement per table. The exception raised is marked with the step
+        """
+        children = {table: [] for table in self.child_tables}
+        step = "video"
+        try:
+            video_sent = self.insert_id_sentence("video", self.schema["video"].keys())
+            for item in items:
+                step = "video"
+                video_data = self.extract_data(self.schema["video"], item, jane_key="title")
+                # build child rows before inserting, so the wrong data doesn't insert video
+                rows = self.child_rows(item)
+
+                # ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id) makes lastrowid the existed id
+                # of a duplicated video, so the id is never queried by name
+                self.db_cursor.execute(video_sent, video_data)
+                video_id = self.db_cursor.lastrowid
+                item["video_id"] = video_id
+
+                for table, table_rows in rows.items():
+                    children[table].extend((video_id,) + tuple(row[1:]) for row in table_rows)
+
+            for table, table_rows in children.items():
+                step = table
+                if table_rows:
+                    self.db_cursor.executemany(self.insert_sentence(table, \
+                        self.schema[table].keys()), table_rows)
+        except Exception as err:
+            err.query_step = step
+            raise
+
+        self.counters["items"] += len(items)
+
+
+    def child_rows(self, item):
+        """Extract the child table rows of an item, the first column `video_id` is None"""
+        rows = {}
+        rows["video_actor"] = [(None,) + row for row in \
+            self.extract_list(item["actors"], True) or []]
+        rows["video_director"] = [(None,) + row for row in \
+            self.extract_list(item["director"], True) or []]
+        rows["video_type"] = [(None, category) for category in \
+            self.extract_list(item["category"]) or []]
+        if not rows["video_actor"]:
             self.log(f"{item['id']} doesn't contain <actors>", level=logging.INFO)
-            actors_id = []
-        
-        # store director data into table, and query id
-        director_sent = self.insert_sentence("video_director", self.schema["video_director"].keys())
-        directors_data = self.extract_list(item["director"], True, item["video_id"])
-        insert(director_sent, directors_data, query_step="director", single_query=False)
-        
-        # query id
-        if len(directors_data) > 0:
-            query_sent  = f"SELECT DISTINCT id FROM video_director WHERE `name` in ({'%s, ' * (len(directors_data)-1)}%s) AND `video_id`=%s;"
-            query_condition = [i[1] for i in directors_data] + [item["video_id"]]
-            self.db_cursor.execute(query_sent, tuple(query_condition))
-            directors_id = [i[0] for i in self.db_cursor.fetchall()]
-        else:
-            self.log(f"{item['id']} doesn't contain <directors>", level=logging.INFO)
-            directors_id = []
-        
-        # store category data into table
-        category_sent = self.insert_sentence("video_type", self.schema["video_type"].keys())
-        category_data = self.extract_list(item["category"], appendix=item["video_id"])
-        if len(category_data) > 0:
-            insert(category_sent, category_data, query_step="category", single_query=False)
-        else:
-            self.log(f"{item['id']} doesn't contain <category>", level=logging.INFO)
-        
-        # store review data into table
-        review_sent = self.insert_sentence("video_review", self.schema["video_review"].keys())
+
         reviews = json.loads(item["short_comment"])
-        
-        review_data = [(item["video_id"], index, time_, score, content)  \
+        rows["video_review"] = [(None, index, time_, score, content) \
                 for index, (time_, score, content) in enumerate(zip(
                     reviews["time"], reviews["rate"], reviews["comment"]))]
-        if len(review_data) > 0:
-            insert(review_sent, review_data, query_step="review", single_query=False)
-        else:
-            self.log(f"{item['id']} doesn't contain <review>", level=logging.INFO)
+
         # store video extension region
         """
         [(1, '中国大陆', '2019', '2020', '135分钟', 0),
         (1, '美国', '2019', '2019-12-25', '135分钟', 0)]
         """
-        extension_region_sent = self.insert_sentence("video_extension_region", \
-                                self.schema["video_extension_region"].keys())
-        
-        regions = self.extract_list(item["play_location"])
-        release_times = self.extract_list(item["play_year"])
-        extension_region_data = []
-        for region, time_ in zip(regions, release_times):
-            extension_region_data.append((item["video_id"], region, \
-                            item["release_year"], time_, item["play_duration"], 0))
-        if len(extension_region_data) > 0:
-            insert(extension_region_sent, extension_region_data, \
-                query_step="video_extention_region", single_query=False)
-        else:
-            self.log(f"{item['id']} doesn't contain <extention region>", level=logging.INFO)
-
-        # store role information into table
-        character_role_sent = self.insert_sentence("video_character", \
-                            self.schema["video_character"].keys())
-        character_role_data = [(item['video_id'], index, name, role, url) \
-                                for index, (name, role, url) in \
-                        enumerate(zip(*json.loads(item["worker_detail"]).values()))]
-        
-        if len(character_role_data) >= 1:
-            insert(character_role_sent, character_role_data, \
-            query_step="video_character", single_query=False)
-        else:
+        regions = self.extract_list(item["play_location"]) or []
+        release_times = self.extract_list(item["play_year"]) or []
+        rows["video_extension_region"] = [(None, region, item["release_year"], time_, \
+            item["play_duration"], 0) for region, time_ in zip(regions, release_times)]
+
+        rows["video_character"] = [(None, index, name, role, url) \
+                for index, (name, role, url) in \
+                enumerate(zip(*json.loads(item["worker_detail"]).values()))]
+        if not rows["video_character"]:
             self.log(f"Data id: {item['id']} has no character information!")
-        
-
-        return item
+        return rows
 
     
     def close_spider(self, spider):
         """Close Spider"""
+        if self.flush_task.running:
+            self.flush_task.stop()
+        self.flush()
         self.db_connection.close()
         self.redis_pool.close()
         self.error_file_store.close()
-        self.file.close()
+        self.archive.close()
+
+        pinyin_stats = initials.stats
+        self.log(f"PinYin initials cache: {pinyin_stats}", logging.INFO)
+        if getattr(self, "stats", None) is not None:
+            for key, value in pinyin_stats.items():
+                self.stats.set_value(f"pinyin/{key}", value)
+            for key, value in self.archive.stats.items():
+                self.stats.set_value(f"archive/{key}", value)
+            for key, value in self.counters.items():
+                self.stats.set_value(f"storage/{key}", value)
+
+
+    def store_error(self, item, query_step):
+        """Store the failed item into the error file for Dealer, and into the archive"""
+        record = dict(item, query_step=query_step)
+        self.error_file_store.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.archive.write("errors", record)
 
 
     def extract_data(self, mapping, item, jane_key=None, append_data=None):
@@ -287,7 +335,7 @@ class DoubanStoragePipeline(BaseSQLPipeline):
         split_data = [i.strip() for i in text.split(split_char)]
 
         if jane:
-            jane_data = [extract1st_char(i) for i in split_data]
+            jane_data = extract1st_chars(split_data)
             result = []
             for item, jane in zip(split_data, jane_data):
                 if appendix is not None:
@@ -368,7 +416,208 @@ class ListPipeline(BaseSQLPipeline):
 
 
 
-class DouBanDetailPipeline(BasePipeline):
+class DouBanImagePipeline(BasePipeline):
+    """异步请求图片内容
+
+    参考 Scrapy 的 MediaPipeline，将图片链接转换为 Scrapy 请求交给 engine 下载，不阻塞
+    reactor。下载完成后原始内容写入 BlobStore(以 SHA-256 摘要为 key，相同的图片只保存一次)，
+    item 中只保存摘要和字节数，再传递给后续的 Pipeline:
+    * DouBanDetailItem: cover -> cover_digest、cover_size，需要 douban_seed.crawl_img 为 True
+    * DouBanPhotosItem: url -> digest、size，需要 optional.crawl_people_img 为 True
+    * DouBanPeopleItem: imgs -> imgs_digest、imgs_size，需要 optional.crawl_people_img 为 True
+
+    IMAGE_CONCURRENT_REQUESTS 限制图片同时下载的数量，IMAGE_MAX_SIZE 限制单张图片的字节数，
+    超过限制或者下载失败的图片摘要为 None。图片保存在 IMAGE_STORE_DIR 中，写入文件在线程池中
+    执行
+
+    图片请求使用图片域名的 Host 和 Referer，不发送 DEFAULT_REQUEST_HEADERS 中豆瓣接口的请求头；
+    meta 中的 dont_cache、dont_delay、dont_proxy 和 dont_throttle 使图片请求不经过缓存、随机延迟
+    和代理，也不作为封禁信号调整并发
+    """
+    # item 类型: (配置 section, 配置 option, 链接字段, 摘要字段, 字节数字段)
+    mapping = {
+        DouBanDetailItem: ("douban_seed", "crawl_img", "cover", "cover_digest", "cover_size"),
+        DouBanPhotosItem: ("optional", "crawl_people_img", "url", "digest", "size"),
+        DouBanPeopleItem: ("optional", "crawl_people_img", "imgs", "imgs_digest", "imgs_size"),
+    }
+
+    def __init__(self, crawler, concurrency=4, maxsize=5 * 1024 * 1024, store=None):
+        self.crawler = crawler
+        self.concurrency = concurrency
+        self.maxsize = maxsize
+        self.store = store
+
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            crawler,
+            concurrency=settings.getint("IMAGE_CONCURRENT_REQUESTS", 4),
+            maxsize=settings.getint("IMAGE_MAX_SIZE", 5 * 1024 * 1024),
+            store=BlobStore(settings.get("IMAGE_STORE_DIR", path.join(cur_path, "data/images")), \
+                depth=settings.getint("IMAGE_STORE_DEPTH", 2))
+        )
+
+
+    def open_spider(self, spider):
+        self.semaphore = defer.DeferredSemaphore(self.concurrency)
+
+
+    def process_item(self, item, spider):
+        option = self.mapping.get(type(item))
+        if option is None:
+            return item
+
+        section, name, url_field, digest_field, size_field = option
+        urls = item.get(url_field)
+        if not urls or not spider.config.getboolean(section, name):
+            return item
+
+        # 图片链接可能是单个链接或者链接列表
+        multiple = isinstance(urls, (list, tuple))
+        urls = urls if multiple else [urls]
+
+        downloads = [self.semaphore.run(self.download, url, spider) for url in urls]
+        dfd = defer.DeferredList(downloads, consumeErrors=True)
+        dfd.addCallback(self.item_completed, item, (digest_field, size_field), multiple, spider)
+        return dfd
+
+
+    def download(self, url, spider):
+        """使用 engine 下载图片，请求会经过下载中间件，但不会进入 spider 回调"""
+        request = scrapy.Request(url, dont_filter=True, headers={
+            "Host": urlparse(url).netloc,
+            "Referer": "https://movie.douban.com/",
+            "Accept": "image/webp,image/apng,image/*,*/*;q=0.8",
+            "Sec-Fetch-Mode": "no-cors",
+            "Sec-Fetch-Site": "cross-site",
+            # None 表示不发送 DefaultHeadersMiddleware 添加的请求头
+            "X-Requested-With": None,
+        }, meta={
+            "download_maxsize": self.maxsize,
+            "handle_httpstatus_all": True,
+            "dont_cache": True,
+            "dont_delay": True,
+            "dont_proxy": True,
+            "dont_throttle": True,
+        })
+        engine = self.crawler.engine
+        # Scrapy 2.6 之后 engine.download 不再需要 spider 参数
+        if "spider" in inspect.signature(engine.download).parameters:
+            return engine.download(request, spider)
+        return engine.download(request)
+
+
+    def item_completed(self, results, item, fields, multiple, spider):
+        """将下载的内容写入 BlobStore，摘要和字节数写回 item"""
+        bodies = []
+        for success, response in results:
+            if success and response.status == 200:
+                bodies.append(response.body)
+            else:
+                reason = response.getErrorMessage() if not success else response.status
+                self.logger.error(f"Request Image content failed: {reason}")
+                bodies.append(None)
+
+        dfd = threads.deferToThread(self.store_many, bodies)
+        dfd.addCallback(self.store_completed, item, fields, multiple)
+        return dfd
+
+
+    def store_many(self, bodies):
+        """写入图片内容，返回 [(摘要, 字节数), ...]，没有内容时为 (None, None)"""
+        return [self.store.put(body) if body else (None, None) for body in bodies]
+
+
+    def store_completed(self, stored, item, fields, multiple):
+        digest_field, size_field = fields
+        digests = [digest for digest, _ in stored]
+        sizes = [size for _, size in stored]
+        item[digest_field] = digests if multiple else digests[0]
+        item[size_field] = sizes if multiple else sizes[0]
+        return item
+
+
+    def close_spider(self, spider):
+        store_stats = self.store.stats
+        if self.crawler.stats is not None:
+            for key, value in store_stats.items():
+                self.crawler.stats.set_value(f"image_store/{key}", value, spider=spider)
+        self.logger.info(f"图片存储统计: {store_stats}")
+
+
+
+class BufferedPipeline(BasePipeline):
+    """批量写入 Pipeline 基类
+
+    子类申明 model，数据交给共享的 writer 缓存，按照 settings 中 WRITER_BATCH_SIZE、
+    WRITER_FLUSH_INTERVAL 以及 WRITER_MAX_BUFFER 的阈值批量写入。close_spider 时写入剩余的
+    数据，并将各表的写入统计保存到 crawler.stats 中
+    """
+    model = None
+
+    def __init__(self, stats=None):
+        self.stats = stats
+        self.table = writer.register(self.model)
+
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        writer.configure(
+            batch_size=settings.getint("WRITER_BATCH_SIZE", 200),
+            flush_interval=settings.getfloat("WRITER_FLUSH_INTERVAL", 5),
+            max_buffer=settings.getint("WRITER_MAX_BUFFER", 2000)
+        )
+        return cls(stats=crawler.stats)
+
+
+    def open_spider(self, spider):
+        # 定时写入，避免数据量少的表长时间停留在缓存中
+        self.flush_task = task.LoopingCall(writer.flush_expired, self.table)
+        self.flush_task.start(writer.flush_interval, now=False)
+
+
+    def close_spider(self, spider):
+        if self.flush_task.running:
+            self.flush_task.stop()
+        writer.flush(self.table)
+
+        stats = writer.stats[self.table]
+        if self.stats is not None:
+            for key, value in stats.items():
+                self.stats.set_value(f"writer/{self.table}/{key}", value, spider=spider)
+        self.logger.info(f"{self.table} 批量写入统计: {stats}")
+
+
+
+class DouBanDetailPipeline(BufferedPipeline):
+    model = DouBanSeriesInfo
+
+    def open_spider(self, spider):
+        super().open_spider(spider)
+        # 根据全局配置参数 update_table 确认是否需要更新种子状态，只更新已经写入的详情数据
+        if spider.config.getboolean("douban_seed", "update_table"):
+            self.seeds = SeedCursor(manipulater)
+            writer.on_flush(self.table, self.mark_seeds)
+
+        # 写入后记录到去重对象中
+        self.dedup = getattr(spider, "dedup", None)
+        if self.dedup is not None:
+            writer.on_flush(self.table, self.mark_dedup)
+
+
+    def mark_seeds(self, rows):
+        """详情数据写入后批量更新种子状态"""
+        self.seeds.mark_crawled(row["series_id"] for row in rows)
+
+
+    def mark_dedup(self, rows):
+        """详情数据写入后批量记录影视 ID"""
+        self.dedup.mark_many("series", [row["series_id"] for row in rows])
+
+
     def process_item(self, item, spider):
         """处理豆瓣影视详情页数据
 
@@ -381,67 +630,83 @@ class DouBanDetailPipeline(BasePipeline):
             self.log(f"爬取的页面中没有获取到详情内容: {item['series_id']}", logging.ERROR)
             return 
             
-        with manipulater.get_session() as session:
-            # 根据全局配置参数 update_table 确认是否需要更新
-            if spider.config.getboolean("douban_seed", "update_table"):
-                temp = session.query(DouBanSeriesSeed).filter(DouBanSeriesSeed.series_id==item["series_id"]).first()
-                if temp:
-                    temp.crawled = True
-                    session.merge(temp)
-                    session.commit()
-                    self.log(f"Update Seed Status: {temp.series_id}", logging.INFO)
-            
-            data = DouBanSeriesInfo(**item)
-            session.merge(data)
-            session.commit()
-            self.logger.info(f"影视条目写入完成 {item['series_id']}: {item['name']}")
+        writer.add(self.table, item)
+        self.logger.info(f"影视条目加入写入队列 {item['series_id']}: {item['name']}")
+        return item
 
 
 
 
-class DouBanAwardPipeline(BasePipeline):
+class DouBanAwardPipeline(BufferedPipeline):
+    model = DouBanSeriesAwards
+
     def process_item(self, item, spider):
         """处理豆瓣影视条目中获奖数据
         """
         if not isinstance(item, DouBanAwardItem):
             return item
         
-        with manipulater.get_session() as session:
-            data = DouBanSeriesAwards(**item)
-            session.merge(data)
-            session.commit()
-            self.logger.debug(f"获奖信息写入 awards 完成: {item['sid']}")
+        writer.add(self.table, item)
+        self.logger.debug(f"获奖信息加入 awards 写入队列: {item['sid']}")
+        return item
+
 
 
+class DouBanWorkerPipeline(BufferedPipeline):
+    model = DouBanSeriesWorker
 
-class DouBanWorkerPipeline(BasePipeline):
     def process_item(self, item, spider):
         """处理豆瓣影视演职人员数据
         """
         if not isinstance(item, DouBanWorkerItem):
             return item
 
-        with manipulater.get_session() as session:
-            query = session.query(DouBanSeriesWorker) \
-                    .filter_by(**item)
+        # 同一影视中演职人员以 ID、岗位和角色区分(唯一约束)，没有岗位或者角色时使用空字符串，
+        # 重复的数据由 ON DUPLICATE KEY UPDATE 更新
+        row = item.to_row()
+        row["duty"] = row["duty"] or ""
+        row["role"] = row["role"] or ""
+        writer.add(self.table, row, copy=False)
+        self.logger.debug(f"演职人员信息加入 worker 写入队列: {item['sid']}")
+        return item
+
 
-            if query.count() == 0:
-                data = DouBanSeriesWorker(**item)
-                session.merge(data)
-                session.commit()
-                self.logger.debug(f"演职人员信息写入 worker 完成: {item['sid']}")
 
+class MongoBulkPipeline(BasePipeline):
+    """MongoDB 批量写入 Pipeline 基类
+
+    子类申明 collection_option(database.ini 中 mongodb section 的 collection 配置项) 以及
+    key(文档唯一字段)。open_spider 时在 key 上创建唯一索引，数据按 key 缓存，缓存数量达到
+    MONGO_BATCH_SIZE 或者每隔 MONGO_FLUSH_INTERVAL 秒使用无序的 bulk_write 写入，每条数
+    据是一个 upsert 的 UpdateOne 操作。写入失败的文档单独记录日志，写入统计保存到
+    crawler.stats 中
+    """
+    collection_option = None
+    key = None
+
+    def __init__(self, stats=None, batch_size=500, flush_interval=5):
+        self.stats = stats
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            stats=crawler.stats,
+            batch_size=settings.getint("MONGO_BATCH_SIZE", 500),
+            flush_interval=settings.getfloat("MONGO_FLUSH_INTERVAL", 5)
+        )
 
 
-class DouBanPeoplePipeline(BasePipeline):
     def open_spider(self, spider):
-        # import ipdb; ipdb.set_trace()
         port = configure.parser.getint("mongodb", "port")
         host = configure.parser.get("mongodb", "host")
         tz_aware = configure.parser.getboolean("mongodb", "tz_aware")
         minPoolSize = configure.parser.getint("mongodb", "minPoolSize")
         database = configure.parser.get("mongodb", "database")
-        collection = configure.parser.get("mongodb", "person_collection")
+        collection = configure.parser.get("mongodb", self.collection_option)
 
         self.mongo_client = pymongo.MongoClient(port=port, host=host, \
             tz_aware=tz_aware, minPoolSize=minPoolSize)
@@ -449,6 +714,95 @@ class DouBanPeoplePipeline(BasePipeline):
         self.collection = self.database[collection]
         self.logger.info("连接到 MongoDB 服务器")
 
+        # upsert 以 key 查询，需要唯一索引保证查询效率以及数据唯一
+        try:
+            self.collection.create_index([(self.key, pymongo.ASCENDING)], unique=True)
+        except pymongo.errors.PyMongoError as err:
+            self.logger.error(f"创建唯一索引 {collection}.{self.key} 失败: {err}")
+
+        self.buffer = {}
+        self.bulk_stats = {"flushes": 0, "upserted": 0, "modified": 0, "errors": 0}
+        self.flush_task = task.LoopingCall(self.flush)
+        self.flush_task.start(self.flush_interval, now=False)
+
+
+    def add(self, document):
+        """添加文档到缓存，同一个 key 的文档合并为一次更新
+
+        document 可以是任意 Mapping，例如 Record，只有同一个 key 出现多次时才复制为字典合并
+        """
+        key = document[self.key]
+        existed = self.buffer.get(key)
+        if existed is None:
+            self.buffer[key] = document
+        else:
+            if not isinstance(existed, dict):
+                existed = self.buffer[key] = dict(existed)
+            existed.update(document)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+
+    def flush(self):
+        """批量写入缓存的文档"""
+        if not self.buffer:
+            return
+        documents, self.buffer = list(self.buffer.values()), {}
+
+        operations = [pymongo.UpdateOne({self.key: document[self.key]}, \
+            {"$set": document}, upsert=True) for document in documents]
+        try:
+            result = self.collection.bulk_write(operations, ordered=False)
+            details = result.bulk_api_result
+        except pymongo.errors.BulkWriteError as err:
+            details = err.details
+            for error in details.get("writeErrors", []):
+                document = documents[error["index"]]
+                self.logger.error(f"写入 {self.collection.name} 失败 {self.key}=" + 
+                    f"{document[self.key]}: {error.get('errmsg')}")
+            self.bulk_stats["errors"] += len(details.get("writeErrors", []))
+
+        self.bulk_stats["flushes"] += 1
+        self.bulk_stats["upserted"] += details.get("nUpserted", 0)
+        self.bulk_stats["modified"] += details.get("nModified", 0)
+        self.logger.debug(f"批量写入 {self.collection.name} 完成: {len(documents)} 条")
+
+
+    def close_spider(self, spider):
+        if self.flush_task.running:
+            self.flush_task.stop()
+        self.flush()
+
+        if self.stats is not None:
+            for key, value in self.bulk_stats.items():
+                self.stats.set_value(f"mongo/{self.collection.name}/{key}", value, spider=spider)
+        self.logger.info(f"{self.collection.name} 批量写入统计: {self.bulk_stats}")
+        # 关闭链接
+        self.mongo_client.close()
+
+
+
+class DouBanPeoplePipeline(MongoBulkPipeline):
+    collection_option = "person_collection"
+    key = "id"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.table = writer.register(DouBanSeriesPerson)
+
+
+    def open_spider(self, spider):
+        super().open_spider(spider)
+        # 写入 people 表后记录到去重对象中，没有写入的演职人员下次仍然会请求 profile 页面
+        self.dedup = getattr(spider, "dedup", None)
+        if self.dedup is not None:
+            writer.on_flush(self.table, self.mark_dedup)
+
+
+    def mark_dedup(self, rows):
+        """演职人员数据写入后批量记录 ID"""
+        self.dedup.mark_many("people", [row["id"] for row in rows])
+
 
     def process_item(self, item, spider):
         """处理豆瓣影视演职人员 Profile数据
@@ -461,28 +815,31 @@ class DouBanPeoplePipeline(BasePipeline):
         # 该条数据是表示的是关于演职人员的 图片信息，数据是 array——解析的 item 来源是 
         # parse_person_imgs
         # * 需要将数据写入到 MongoDB 中
-        query_item = self.collection.find_one({"id": item['id']})
-        if query_item:
-            self.collection.update_one({"_id": query_item.get('_id')}, {"$set": dict(item)})
-            self.logger.debug(f"更新演职人员数据(MongoDb): {item['id']}")
-        else:
-            self.collection.insert_one(dict(item))
-            self.logger.debug(f"插入演职人员数据(MongoDb): {item['id']}")
-        
-        with manipulater.get_session() as session:
-            del item['imgs'], item['imgs_content']
-            data = DouBanSeriesPerson(**item)
-            session.merge(data)
-            session.commit()
-            self.logger.debug(f"演职人员 Profile 信息写入 people 完成: {item['id']}")
+        self.add(dict(item))
+        self.logger.debug(f"演职人员数据加入写入队列(MongoDb): {item['id']}")
+
+        # 图片信息只保存在 MongoDB 中
+        data = {key: value for key, value in item.items() \
+            if key not in ("imgs", "imgs_digest", "imgs_size")}
+        writer.add(self.table, data)
+        self.logger.debug(f"演职人员 Profile 信息加入 people 写入队列: {item['id']}")
+        return item
             
 
+    def flush(self):
+        super().flush()
+        # 定时写入时同时检查 person 表的缓存
+        writer.flush_expired(self.table)
+
+
     def close_spider(self, spider):
-        # 关闭链接
-        self.mongo_client.close()
+        writer.flush(self.table)
+        super().close_spider(spider)
         
         
-class DouBanPicturePipeline(BasePipeline):
+class DouBanPicturePipeline(BufferedPipeline):
+    model = DouBanSeriesPic
+
     def process_item(self, item, spider):
         """处理豆瓣影视海报、剧照以及壁纸
         
@@ -490,52 +847,33 @@ class DouBanPicturePipeline(BasePipeline):
         if not isinstance(item, DouBanPhotosItem):
             return item
 
-        with manipulater.get_session() as session:
-            data = DouBanSeriesPic(**item)
-            session.merge(data)
-            session.commit()
-            self.logger.debug(f"影视海报等图片信息写入 picture 完成: {item['sid']}")
+        writer.add(self.table, item.to_row(), copy=False)
+        self.logger.debug(f"影视海报等图片信息加入 picture 写入队列: {item['sid']}")
+        return item
         
 
 
-class DouBanEpisodePipeline(BasePipeline):
+class DouBanEpisodePipeline(BufferedPipeline):
+    model = DouBanEpisodeInfo
+    # 剧集以影视 ID 和集数区分(唯一约束)，已有的剧集由 ON DUPLICATE KEY UPDATE 更新
+
     def process_item(self, item, spider):
         """处理豆瓣影视剧集信息
         """
         if not isinstance(item, DouBanEpisodeItem):
             return item
 
-        with manipulater.get_session() as session:
-            data = DouBanEpisodeInfo(**item) 
-            query = session.query(DouBanEpisodeInfo).filter_by(sid=item["sid"], episode=item["episode"]).first()
-
-            if query:
-                data.id = query.id
-            
-            session.merge(data)
-            session.commit()
-            self.logger.debug(f"影视剧集信息写入 episode_info 完成：{item['sid']}")
+        writer.add(self.table, item)
+        self.logger.debug(f"影视剧集信息加入 episode_info 写入队列：{item['sid']}")
+        return item
 
         
 
 
-class DouBanCommentPipelineM(BasePipeline):
-    def open_spider(self, spider):
-        # import ipdb; ipdb.set_trace()
-        port = configure.parser.getint("mongodb", "port")
-        host = configure.parser.get("mongodb", "host")
-        tz_aware = configure.parser.getboolean("mongodb", "tz_aware")
-        minPoolSize = configure.parser.getint("mongodb", "minPoolSize")
-        database = configure.parser.get("mongodb", "database")
-        collection = configure.parser.get("mongodb", "comments_collection")
-
-        self.mongo_client = pymongo.MongoClient(port=port, host=host, \
-            tz_aware=tz_aware, minPoolSize=minPoolSize)
-        self.database = self.mongo_client[database]
-        self.collection = self.database[collection]
-        self.logger.info("连接到 MongoDB 服务器")
+class DouBanCommentPipelineM(MongoBulkPipeline):
+    collection_option = "comments_collection"
+    key = "comment_id"
 
-    
     def process_item(self, item, spider):
         """豆瓣评论数据
 
@@ -544,16 +882,8 @@ class DouBanCommentPipelineM(BasePipeline):
         if not isinstance(item, DouBanCommentsItemM):
             return item
 
-        query_item = self.collection.find_one({"comment_id": item['comment_id']})
-        if query_item:
-            self.collection.update_one({"_id": query_item.get('_id')}, {"$set": dict(item)})
-            self.logger.debug(f"更新评论数据: {item['comment_id']}")
-        else:
-            self.collection.insert_one(dict(item))
-            self.logger.debug(f"插入评论数据: {item['comment_id']}")
-        
-
-    
-    def close_spider(self, spider):
-        # 关闭链接
-        self.mongo_client.close()
\ No newline at end of file
+        # 不做去重，已有的评论由 comment_id 唯一索引 upsert 更新点赞、回复以及内容，同一批次中
+        # 重复的评论在 add 中合并
+        self.add(item.to_document())
+        self.logger.debug(f"评论数据加入写入队列: {item['comment_id']}")
+        return item
@@ -22,11 +22,13 @@ NEWSPIDER_MODULE = 'DouBan.spiders'
 ROBOTSTXT_OBEY = False
 
 # Configure maximum concurrent requests performed by Scrapy (default: 16)
-CONCURRENT_REQUESTS = 5
+# 全局并发上限，每个下载 slot 的并发数量和间隔由 AdaptiveConcurrencyMiddleware 调整
+CONCURRENT_REQUESTS = 32
 
 # Configure a delay for requests for the same website (default: 0)
 # See https://docs.scrapy.org/en/latest/topics/settings.html#download-delay
 # See also autothrottle settings and docs
+# 启用 AdaptiveConcurrencyMiddleware 时作为新 slot 的初始间隔
 DOWNLOAD_DELAY = 3
 # The download delay setting will honor only one of:
 #CONCURRENT_REQUESTS_PER_DOMAIN = 16
@@ -53,31 +55,41 @@ DEFAULT_REQUEST_HEADERS = {
 
 # Enable or disable spider middlewares
 # See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-# SPIDER_MIDDLEWARES = {
+SPIDER_MIDDLEWARES = {
 #    'DouBan.middlewares.DoubanSpiderMiddleware': 543,
-# }
+    'DouBan.middlewares.MetricsSpiderMiddleware': 950,
+    'DouBan.middlewares.ProfilerSpiderMiddleware': 960,
+}
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 DOWNLOADER_MIDDLEWARES = {
     'DouBan.middlewares.ABuYunDynamicProxyMiddleware': 490,
     'DouBan.middlewares.ABuYunDynamicProxyRetryMiddleware': 495,
+    # 代理池和阿布云动态代理二选一，启用代理池时把上面两个阿布云中间件设置为 None；代理池需要在
+    # RetryMiddleware(550)之后、RedirectMiddleware(600)之前，先看到原始的响应和异常
+    # 'DouBan.middlewares.ProxyPoolMiddleware': 560,
+    'DouBan.middlewares.ResponseCacheMiddleware': 2,
     'DouBan.middlewares.UserAgentDownloaderMiddleware': 3,
     'DouBan.middlewares.RandomDelayMiddleware': 4,
-    # "DouBan.middlewares.CookiesRetryDownloaderMidddleware": 100
+    'DouBan.middlewares.AdaptiveConcurrencyMiddleware': 950,
+    # "DouBan.middlewares.CookiePoolMiddleware": 100
     # 'DouBan.middlewares.ProxyDownloaderMiddleware': 555,
     # 'DouBan.middlewares.DoubanDownloaderMiddleware': 543,
 }
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
+EXTENSIONS = {
 #    'scrapy.extensions.telnet.TelnetConsole': None,
-#}
+    'DouBan.extensions.MetricsExtension': 500,
+    'DouBan.extensions.ProfilerExtension': 510,
+}
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 ITEM_PIPELINES = {
     # "DouBan.pipelines.ListPipeline": 200
+    "DouBan.pipelines.DouBanImagePipeline": 100,
     "DouBan.pipelines.DouBanDetailPipeline": 200,
     "DouBan.pipelines.DouBanAwardPipeline": 201,
     "DouBan.pipelines.DouBanPeoplePipeline": 202,
@@ -92,7 +104,8 @@ ITEM_PIPELINES = {
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
-AUTOTHROTTLE_ENABLED = True
+# AdaptiveConcurrencyMiddleware 根据封禁信号调整下载间隔，不能和 AutoThrottle 同时启用
+AUTOTHROTTLE_ENABLED = False
 # The initial download delay
 #AUTOTHROTTLE_START_DELAY = 5
 # The maximum download delay to be set in case of high latencies
@@ -125,6 +138,160 @@ RETRY_TIMES = 5
 
 # Random Delay
 RANDOM_DELAY = 2
+# 同一下载 slot 相邻请求之间的最小间隔(秒)，0 表示不限制
+RANDOM_DELAY_SLOT_INTERVAL = 0
+
+# 批量写入配置: 单表批量数量、写入时间间隔(秒)以及所有表缓存数量上限
+WRITER_BATCH_SIZE = 200
+WRITER_FLUSH_INTERVAL = 5
+WRITER_MAX_BUFFER = 2000
+
+# MongoDB 批量写入配置: 单次 bulk_write 的最大文档数量以及写入时间间隔(秒)
+MONGO_BATCH_SIZE = 500
+MONGO_FLUSH_INTERVAL = 5
+
+# 去重配置: DEDUP_BACKEND 可选 bloom、redis、redis-bloom、sql，sql 使用数据表预热进程内集合，
+# DEDUP_SQL_BLOOM 为 True 时预热数据保存在布隆过滤器中
+DEDUP_BACKEND = "sql"
+DEDUP_SQL_BLOOM = False
+DEDUP_BLOOM_CAPACITY = 1000000
+DEDUP_BLOOM_ERROR_RATE = 0.001
+DEDUP_REDIS_KEY_PREFIX = "dedup:"
+
+# 图片内容下载配置: 同时下载图片的数量以及单张图片的字节数上限
+IMAGE_CONCURRENT_REQUESTS = 4
+IMAGE_MAX_SIZE = 5 * 1024 * 1024
+# 图片内容以 SHA-256 摘要为 key 保存在 IMAGE_STORE_DIR 中(IMAGE_STORE_DEPTH 层目录)，数据表只保存
+# 摘要和字节数；python -m DouBan.utils.blobstore.gc 删除未被引用且超过 IMAGE_STORE_GC_GRACE 秒的内容
+IMAGE_STORE_DIR = path.join(path.dirname(__file__), "data/images")
+IMAGE_STORE_DEPTH = 2
+IMAGE_STORE_GC_GRACE = 86400
+
+# 响应内容磁盘缓存: CACHE_TTLS 按顺序匹配 URL 规则，值为缓存有效期(秒)，没有匹配的 URL 使用
+# CACHE_DEFAULT_TTL，0 表示不缓存；CACHE_MAX_GB 为压缩后缓存大小上限，0 表示不限制
+CACHE_ENABLED = True
+CACHE_PATH = path.join(path.dirname(__file__), "log/httpcache.sqlite3")
+CACHE_TTLS = [
+    (r"/celebrity/\d+/?$", 30 * 24 * 3600),
+    (r"/subject/\d+/awards", 7 * 24 * 3600),
+    (r"/subject/\d+/celebrities", 7 * 24 * 3600),
+    (r"/subject/\d+/?$", 24 * 3600),
+    (r"/comments", 3600),
+    (r"/reviews", 3600),
+]
+CACHE_DEFAULT_TTL = 0
+CACHE_MAX_GB = 5
+# 缓存的写入和访问时间累计 CACHE_COMMIT_SIZE 条或者 CACHE_COMMIT_INTERVAL 秒之后批量提交
+CACHE_COMMIT_SIZE = 100
+CACHE_COMMIT_INTERVAL = 5
+
+# 运行指标: METRICS_PORT 大于 0 时在本机提供 Prometheus 接口(/metrics、/metrics.json)，
+# METRICS_DUMP_PATH 定时写入 JSON 文件；METRICS_STATS_PREFIXES 开头的 stats 数值同时导出
+METRICS_ENABLED = True
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9410
+METRICS_DUMP_PATH = path.join(path.dirname(__file__), "log/metrics.json")
+METRICS_DUMP_INTERVAL = 60
+METRICS_STATS_PREFIXES = ["proxy_pool/", "cookie_pool/", "adaptive/", "retry/", "cache/", \
+    "dupefilter/", "scheduler/", "downloader/exception_type_count/"]
+
+# DoubanStoragePipeline 每 STORAGE_GROUP_SIZE 条数据在一个事务中写入，未满的一组每
+# STORAGE_FLUSH_INTERVAL 秒写入一次
+STORAGE_GROUP_SIZE = 20
+STORAGE_FLUSH_INTERVAL = 5
+
+# 原始数据归档: DoubanStoragePipeline 把每条数据按照类型写入 ARCHIVE_DIR 中压缩的 JSON 行分片，
+# 未压缩大小超过 ARCHIVE_MAX_BYTES 或者超过 ARCHIVE_MAX_SECONDS 秒之后轮转；ARCHIVE_COMPRESSION 可选
+# gzip、zstd(需要安装 zstandard)、none，manifest.jsonl 记录每个分片的时间范围和数据条数
+ARCHIVE_DIR = path.join(path.dirname(__file__), "log/archive")
+ARCHIVE_COMPRESSION = "gzip"
+ARCHIVE_LEVEL = None
+ARCHIVE_MAX_BYTES = 64 * 1024 * 1024
+ARCHIVE_MAX_SECONDS = 3600
+ARCHIVE_FLUSH_INTERVAL = 5
+ARCHIVE_QUEUE_SIZE = 10000
+
+# 性能分析: PROFILER_ENABLED 为 True 时包装回调和 Pipeline，PROFILER_ACTIVE 为 True 时立即开始；
+# 运行中可以发送 PROFILER_SIGNAL 切换，或者在 Redis 的 PROFILER_REDIS_KEY(%(spider)s 替换为爬虫
+# 名称)中写入 sample、cprofile、off；PROFILER_CALLBACKS、PROFILER_PIPELINES 为空时包装全部
+PROFILER_ENABLED = False
+PROFILER_ACTIVE = False
+PROFILER_MODE = "sample"
+PROFILER_SAMPLE_INTERVAL = 0.01
+PROFILER_INTERVAL = 60
+PROFILER_OUTPUT_DIR = path.join(path.dirname(__file__), "log/profile")
+PROFILER_CALLBACKS = ["detail_page", "parse_worker", "parse_comments"]
+PROFILER_PIPELINES = []
+PROFILER_SIGNAL = "SIGUSR2"
+PROFILER_REDIS_KEY = "douban:profiler:%(spider)s"
+PROFILER_POLL_INTERVAL = 5
+
+# 封禁感知的并发控制: 出现封禁信号时乘性降低 slot 的并发数量、增大间隔，封禁率低于
+# ADAPTIVE_TARGET_BLOCK_RATE 时每 ADAPTIVE_INTERVAL 秒加性提高一次速率(先减小间隔，再增加并发)
+ADAPTIVE_ENABLED = True
+ADAPTIVE_TARGET_BLOCK_RATE = 0.02
+ADAPTIVE_MIN_CONCURRENCY = 1
+ADAPTIVE_MAX_CONCURRENCY = 16
+ADAPTIVE_START_CONCURRENCY = 1
+ADAPTIVE_MIN_DELAY = 0
+ADAPTIVE_MAX_DELAY = 60
+ADAPTIVE_DELAY_STEP = 0.25
+ADAPTIVE_DECREASE_FACTOR = 0.5
+ADAPTIVE_EWMA_ALPHA = 0.1
+ADAPTIVE_INTERVAL = 5
+ADAPTIVE_BLOCK_CODES = [403, 429]
+ADAPTIVE_SLOT_BY_PROXY = True
+ADAPTIVE_EXCEPTIONS_AS_BLOCKS = True
+
+# 代理池: PROXY_POOL_PROVIDER 是提供代理列表的可调用对象(可以实现 from_settings)，本地测试可以
+# 使用 DouBan.utils.proxy.StaticProvider 和 PROXY_POOL_STATIC；成功率和响应时间使用 EWMA 统计，
+# 成功率低于 PROXY_POOL_MIN_SUCCESS 或者连续失败 PROXY_POOL_MAX_FAILURES 次的代理冷却
+# PROXY_POOL_COOLDOWN 秒(随剔除次数翻倍)
+PROXY_POOL_PROVIDER = "DouBan.utils.proxy.ABuYunProvider"
+PROXY_POOL_STATIC = []
+PROXY_POOL_MIN_SIZE = 5
+PROXY_POOL_REFILL_SIZE = 0 # 0 表示使用 proxy.ini 中的 PROXY_COUNT
+PROXY_POOL_REFILL_INTERVAL = 10
+PROXY_POOL_EWMA_ALPHA = 0.3
+PROXY_POOL_MIN_SUCCESS = 0.5
+PROXY_POOL_MIN_SAMPLES = 5
+PROXY_POOL_MAX_FAILURES = 3
+PROXY_POOL_COOLDOWN = 60
+PROXY_POOL_MAX_COOLDOWN = 1800
+PROXY_POOL_MAX_EJECTIONS = 3
+PROXY_POOL_MAX_AGE = 0
+PROXY_POOL_RETRY_TIMES = 3
+PROXY_POOL_BAN_CODES = [403, 407, 429, 502, 503, 504]
+
+# 登录 cookie 池: COOKIE_POOL_ACCOUNTS 是账号文件(None 表示 utils/login/user_pw.txt)；
+# COOKIE_POOL_STRATEGY 可选 round-robin、lru；COOKIE_POOL_REDIS 为 True 时 cookie 保存在
+# DATABASE_CONF["redis"] 的 COOKIE_POOL_REDIS_KEY 哈希表中
+COOKIE_POOL_ACCOUNTS = None
+COOKIE_POOL_TTL = 12 * 3600
+COOKIE_POOL_STRATEGY = "round-robin"
+COOKIE_POOL_REDIS = False
+COOKIE_POOL_REDIS_KEY = "douban:cookies"
+COOKIE_POOL_REFRESH_INTERVAL = 30
+COOKIE_POOL_LOGIN_COOLDOWN = 300
+COOKIE_POOL_RETIRE_COOLDOWN = 60
+COOKIE_POOL_RETRY_TIMES = 2
+
+# 分布式调度: 启用 SCHEDULER 之后多个爬虫进程共享 Redis 中的优先级队列和指纹集合。FRONTIER_REDIS_URL
+# 为 None 时使用 DATABASE_CONF["redis"]；FRONTIER_EXTERNAL_SEEDS 为 True 时爬虫不扫描种子表，种子由
+# python -m DouBan.utils.frontier.feeder 写入；队列为空 FRONTIER_IDLE_TIMEOUT 秒之后关闭爬虫
+# SCHEDULER = "DouBan.utils.frontier.RedisScheduler"
+FRONTIER_REDIS_URL = None
+FRONTIER_QUEUE_KEY = "%(spider)s:requests"
+FRONTIER_DUPEFILTER_KEY = "%(spider)s:dupefilter"
+FRONTIER_PERSIST = True
+FRONTIER_IDLE_TIMEOUT = 60
+FRONTIER_EXTERNAL_SEEDS = False
+
+# 拼音首字母缓存: 进程内 LRU 容量、SQLite 缓存文件(None 表示不使用)以及是否使用 person、
+# worker 表中的姓名预热
+PINYIN_CACHE_SIZE = 100000
+PINYIN_CACHE_PATH = path.join(path.dirname(__file__), "log/pinyin.sqlite3")
+PINYIN_WARM_TABLES = False
 
 # DataBase configuration
 DATABASE_CONF = {
@@ -20,6 +20,7 @@ from DouBan.settings import DEFAULT_REQUEST_HEADERS as HEADERS
 from DouBan.settings import DATABASE_CONF
 
 from DouBan.utils.exceptions import ConnectionError
+from DouBan.utils.dedup import Deduplicator, RedisSetBackend
 from scrapy.exceptions import IgnoreRequest
 
 logger = logging.getLogger(__name__)
@@ -63,6 +64,8 @@ class DoubanSpider(scrapy.Spider):
         raise ConnectionError("Can't connect the redis server. Checkout" + 
                             " network and config parameters.")
     redis_key = DouBanDetailItem.__name__
+    # item class name is the redis key
+    dedup = Deduplicator(RedisSetBackend(redis_connect, key_format="{namespace}"))
 
     def start_requests(self):
         # if movies is not None, request the movies url and stop another requests
@@ -206,6 +209,10 @@ class DoubanSpider(scrapy.Spider):
             logger.critical(f"{tags} crawled Done")
              
 
+        # check all the ids of the page in one batch
+        seen = dict(zip((i["id"] for i in data), \
+            self.dedup.seen_many(self.redis_key, [i["id"] for i in data])))
+
         for page_item in data:
             item["name"] = page_item["title"]
             item["id"] = page_item["id"]
@@ -220,7 +227,7 @@ class DoubanSpider(scrapy.Spider):
                         "cover_page": page_item["cover"],
                         "title": page_item["title"]})
 
-            if not self.redis_connect.sismember(self.redis_key, item["id"]):
+            if not seen[item["id"]]:
                 yield scrapy.Request(page_item["url"], callback=self.parse, meta=meta)
             else:
                 logger.info(f"{item['id']} Crawled")
@@ -1,8 +1,6 @@
 # -*- coding: utf-8 -*-
 import scrapy
 
-import requests
-import requests_html
 import json
 import ssl
 import logging
@@ -10,12 +8,10 @@ import sys
 import re
 import redis
 import configparser
-import base64
 import string
 import numpy as np
 
 import numbers
-import pymongo
 from os import path, remove
 from pyquery import PyQuery
 from lxml import etree
@@ -24,15 +20,15 @@ from DouBan.items import (
     CoverImageItem, DouBanDetailItem, ListItem, DouBanAwardItem, DouBanWorkerItem,
     DouBanPeopleItem, DouBanPhotosItem, DouBanEpisodeItem, DouBanCommentsItemM
 )
-from DouBan.database.manager.datamodel import DouBanSeriesInfo
-from DouBan.database.manager import DataBaseManipulater
+from DouBan.database.manager.datamodel import DouBanSeriesInfo, DouBanSeriesPerson
+from DouBan.database.manager import DataBaseManipulater, SeedCursor, RecrawlPlanner
 from DouBan.utils import compress
 from DouBan.settings import DEFAULT_REQUEST_HEADERS as HEADERS
 from DouBan.settings import DATABASE_CONF
 
 from DouBan.utils.exceptions import ConnectionError
+from DouBan.utils.dedup import Deduplicator
 from DouBan.utils.pages import *
-from DouBan.database.conf import configure
 
 from scrapy.exceptions import IgnoreRequest
 
@@ -74,6 +70,18 @@ class SeriesSpider(scrapy.Spider):
     
     # 配置文件传输，设置为属性方式传递
     config = global_config
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        # 影视和演职人员去重对象，Pipeline 中通过 spider.dedup 共享
+        spider.dedup = Deduplicator.from_settings(crawler.settings, loaders={
+            "series": lambda: manipulater.iter_values(DouBanSeriesInfo.series_id),
+            "people": lambda: manipulater.iter_values(DouBanSeriesPerson.id),
+        })
+        return spider
+
+
     def start_requests(self):
         """
         如果存在待处理的 series 信息，优先处理
@@ -84,49 +92,24 @@ class SeriesSpider(scrapy.Spider):
                     yield scrapy.Request(url, callback=self.direct_parse_page)
                 # 如果是数字数据，那么直接用于检查该 ID 是否已经写入
                 elif url.isdigit():
-                    url = "https://movie.douban.com/subject/{seed}/"
                     if not self.check_series_id(url):
-                        yield scrapy.Request(url.format(seed=url), \
+                        yield scrapy.Request(f"https://movie.douban.com/subject/{url}/", \
                             callback=self.detail_page)
 
         
 
-        # * 需要完成对存储在表中的影视内容进行爬去和解析——用于解析详情内容
-        if global_config.getboolean("douban_seed", "check_table"):
-            # load 数据管理对象
-            from DouBan.database.manager.datamodel import DouBanSeriesSeed
+        # * 需要完成对存储在表中的影视内容进行爬去和解析——用于解析详情内容，种子由单独的 feeder 写入
+        # 共享队列时(FRONTIER_EXTERNAL_SEEDS)，各个爬虫进程不再重复扫描种子表
+        if global_config.getboolean("douban_seed", "check_table") and \
+                not self.settings.getbool("FRONTIER_EXTERNAL_SEEDS", False):
             self.database_manipulater = manipulater # 作为数据操作对象传递
-            url = "https://movie.douban.com/subject/{seed}/"
-            # 从种子数据库中提取未爬取的数据
-            with manipulater.get_session() as session:
-                # seeds = session.query(DouBanSeriesSeed).filter(DouBanSeriesSeed.crawled == 0).order_by(DouBanSeriesSeed.create_time.desc())
-                seed = session.query(DouBanSeriesSeed) \
-                    .filter(DouBanSeriesSeed.crawled == 0) \
-                    .order_by(DouBanSeriesSeed.create_time.desc())
-                
-            while seed.count() > 0:
-                seed = seed.first()
-
-                if not self.check_series_id(seed.series_id):
 
-                    yield scrapy.Request(url.format(seed=seed.series_id), \
-                        callback=self.detail_page)
-                    
-                    # 开发阶段只测试一个源
-                    if global_config.getboolean("env", "development"):
-                        return 
-                        
+            for request in self.seed_requests():
+                yield request
                 
-                # 请求下一个 seed
-                with manipulater.get_session() as session:
-                    # 更新已经爬取的种子状态
-                    seed.crawled = True
-                    session.merge(seed)
-                    session.commit()
-                    # 获取新种子
-                    seed = session.query(DouBanSeriesSeed) \
-                            .filter(DouBanSeriesSeed.crawled == 0) \
-                            .order_by(DouBanSeriesSeed.create_time.desc()) 
+                # 开发阶段只测试一个源
+                if global_config.getboolean("env", "development"):
+                    return 
 
         # * 仅获取到电视剧相关页面的内容保存到数据库以备下一步解析用，不需要进行下一级页面解析
         if global_config.getboolean("douban_seed", "crawl_new"):
@@ -145,6 +128,31 @@ class SeriesSpider(scrapy.Spider):
                         return 
                     
 
+    def seed_requests(self):
+        """种子表中影视详情页的请求，爬虫和 feeder(DouBan.utils.frontier.feeder) 共用"""
+        url = "https://movie.douban.com/subject/{seed}/"
+
+        # * 按照重新爬取计划的分数排序，同时包括已经爬取的影视以及未爬取的种子
+        if global_config.getboolean("douban_seed", "recrawl", fallback=False):
+            planner = RecrawlPlanner(manipulater, \
+                budget=global_config.getint("douban_seed", "recrawl_budget", fallback=1000), \
+                half_life=global_config.getfloat("douban_seed", "recrawl_half_life", \
+                    fallback=30))
+            seeds = ((seed.series_id, seed.priority) for seed in planner)
+        else:
+            # 分页流式读取未爬取的种子，种子状态由 DouBanDetailPipeline 在详情数据写入后批量更新
+            page_size = global_config.getint("douban_seed", "page_size", fallback=1000)
+            seeds = ((seed.series_id, 10 if seed.priority else 0) \
+                for seed in SeedCursor(manipulater, page_size=page_size))
+
+        # 种子由种子表和重新爬取计划决定是否需要爬取，不经过指纹去重；启用 RedisScheduler 时指纹
+        # 永久保存(FRONTIER_PERSIST)，去重会丢弃所有爬取过的影视，重新爬取计划失效。队列以序列化
+        # 的请求为成员，同一个种子重复写入不会重复
+        for series_id, priority in seeds:
+            yield scrapy.Request(url.format(seed=series_id), \
+                callback=self.detail_page, priority=priority, dont_filter=True)
+
+
     def list_page(self, response):
         """
         用于解析详情页内容，不解析具体的详情内容
@@ -173,70 +181,47 @@ class SeriesSpider(scrapy.Spider):
         self.logger.info(f"爬取影视条目页面: {response.url}")
         item = DouBanDetailItem()
         item["series_id"] = re.search("subject/(\d{3,})", response.url).group(1)
-        item["name"] = Details.extract_title(response).name
-        item["alias"] = Details.extract_nick_name(response)
-        item["rate"] = Details.extract_rate(response)
-        item["rate_collection"] = Details.extract_rate_collections(response)
+        # * 一次解析得到所有详情字段，div#info 只遍历一次
+        detail = Details.extract(response)
+        item["name"] = detail.title.name
+        item["alias"] = detail.nick_name
+        item["rate"] = detail.rate
+        item["rate_collection"] = detail.rate_collection
         # 需要在后续根据分类页面的内容重新调整，目前暂时只提取电视剧和电影的分类
-        item["main_tag"] = Details.extract_main_tag(response)
-        item["genres"] = Details.extract_genres(response)
-        item["product_country"] = Details.extract_product_country(response)
-        item["language"] = Details.extract_language(response)
-        item["release_year"] = Details.extract_release_year(response)
+        item["main_tag"] = detail.main_tag
+        item["genres"] = detail.genres
+        item["product_country"] = detail.product_country
+        item["language"] = detail.language
+        item["release_year"] = detail.release_year
 
         # 如果能提取到日期数据，转换为 JSON 数据
-        item["release_date"] = json.dumps(Details.extract_release_date(response), \
-            ensure_ascii=False)
+        item["release_date"] = json.dumps(detail.release_date, ensure_ascii=False)
 
-        item["play_duration"] = Details.extract_play_duration(response)
-        item["imdb_id"] = Details.extract_imdb_id(response)
-        item["tags"] = Details.extract_tags(response) 
+        item["play_duration"] = detail.play_duration
+        item["imdb_id"] = detail.imdb_id
+        item["tags"] = detail.tags
 
-        directors = Details.extract_directors(response)
-        if directors:
-            item["directors"] = "/".join(i.name for i in directors)
-        else:
-            item["directors"] = None
+        for field in ["directors", "screenwriters", "actors"]:
+            people = getattr(detail, field)
+            item[field] = "/".join(i.name for i in people) if people else None
 
-        screenwriters = Details.extract_screenwriter(response)
-        if screenwriters:
-            item["screenwriters"] = "/".join(i.name for i in screenwriters)
-        else:
-            item["screenwriters"] = None
-        
-        actors = Details.extract_actors(response)
-        if actors:
-            item["actors"] = "/".join(i.name for i in actors)
-        else:
-            item["actors"] = None
+        item["plot"] = detail.plot
+        item["cover"] = detail.cover
+        # * 图片内容由 DouBanImagePipeline 根据 crawl_img 选项异步请求
+        item["cover_digest"] = None
+        item["cover_size"] = None
 
-        item["plot"] = Details.extract_plot(response)
-        item["cover"] = Details.extract_cover_url(response)
-        
-        # * 根据 crawl_img 选项判断是否需要将图片链接转换为实际请求的内容
-        if global_config.getboolean("douban_seed", "crawl_img"):
-            res = requests.get(item.cover)
-            if int(res.status_code) == 200:
-                item["cover_content"] = base64.b64encode(res.content)
-            else:
-                logger.error(f"Request Image content failed:{item.cover}")
-                item["cover_content"] = None
-
-        item["official_site"] = Details.extract_official_web(response)
+        item["official_site"] = detail.official_site
 
-        item["recommendation_type"] = Details.extract_recommendation_type(response)
-        recommendation_items = Details.extract_recommendation_item(response) 
-
-        if recommendation_items:
+        item["recommendation_type"] = detail.recommendation_type
+        if detail.recommendation_item:
             item["recommendation_item"] = json.dumps(
-                {i.id:i.name for i in recommendation_items}, ensure_ascii=False
+                {i.id:i.name for i in detail.recommendation_item}, ensure_ascii=False
             )
         else:
             item["recommendation_item"] = None
         
-        item["set_number"] = response.xpath(
-            "//div[@id='info']//span[@class='pl' and contains(text(), '集数')]/following-sibling::text()"
-        ).extract_first()
+        item["set_number"] = detail.set_number or None
 
         yield item
         
@@ -297,33 +282,40 @@ class SeriesSpider(scrapy.Spider):
         解析演职人员基本信息之前，需要将各个演职人员的 profile 信息写入 people 表中，因此设计
         爬取流程上需要在生成 item 数据之前完成爬取
         """
-        item = DouBanWorkerItem()
         # 对演员的角色进行调整，使用 mapping 加快搜索
         duties = {duty.id:duty for duty in Workers.extract_duties(response)}
         # profile 页面链接
         url = "https://movie.douban.com/celebrity/{id}/"
 
-        for worker in Workers.extract_basic(response):
+        sid = re.search("subject/(\d{3,})", response.url).group(1)
+        workers = list(Workers.extract_basic(response))
+        # 批量去重，只请求尚未写入的 profile 页面；DouBanPeoplePipeline 写入 people 表之后才记录
+        # ID，请求失败的演职人员下次仍然会被请求
+        ids = list(dict.fromkeys(worker.id for worker in workers if worker.id is not None))
+        new_people = {id for id, seen in zip(ids, self.dedup.seen_many("people", ids)) if not seen}
+
+        for worker in workers:
             if worker.id is None:
                 logger.debug(f"{worker.name} 没有ID信息，随机生成一个 15 位 ID")
                 id = "".join(np.random.choice(list(string.ascii_letters), 15))
             else:
                 id = worker.id
 
-            item["wid"] = id
-            item["name"] = worker.name
-            item["alias"] = worker.alias
-            item["sid"] = re.search("subject/(\d{3,})", response.url).group(1)
-            item["duty"] = duties[worker.id].duty if duties.get(worker.id) else None
-            item["action"] = duties[worker.id].action if duties.get(worker.id) else None
-            item["role"] = duties[worker.id].role if duties.get(worker.id) else None
+            # 每个演职人员使用独立的 item，写入时不需要再复制
+            duty = duties.get(worker.id)
+            item = DouBanWorkerItem(
+                wid=id,
+                name=worker.name,
+                alias=worker.alias,
+                sid=sid,
+                duty=duty.duty if duty else None,
+                action=duty.action if duty else None,
+                role=duty.role if duty else None
+            )
 
             # 请求 profile 页面信息
             if worker.id is not None:
-                # 去重复筛选
-                collection = configure.parser.get("mongodb", "person_collection")
-                count = self.mongodb_query_count(collection, {"id": worker.id})
-                if count == 0:
+                if worker.id in new_people:
                     yield scrapy.Request(url.format(id=worker.id), \
                         callback=self.parse_people)
             else:
@@ -373,7 +365,8 @@ class SeriesSpider(scrapy.Spider):
                 yield scrapy.Request(url, callback=self.parse_person_imgs, meta={"data": item})
             else:
                 item["imgs"] = None
-                item["imgs_content"] = None
+                item["imgs_digest"] = None
+                item["imgs_size"] = None
                 yield item
         except AttributeError as err:
             self.log(f"Profile 解析错误: {response.url} \n {err}", level=logging.ERROR)
@@ -390,19 +383,10 @@ class SeriesSpider(scrapy.Spider):
             "div.article > ul.clearfix > li > div.cover img::attr(src)"
         ).extract()
 
-        if self.config.getboolean("optional", "crawl_people_img"):
-            contents = []
-            for link in imgs:
-                res = requests.get(link)
-                if int(res.status_code) == 200:
-                    contents.append(base64.b64encode(res.content))
-                else:
-                    contents.append(None)
-        else:
-            contents = None
-
+        # 图片内容由 DouBanImagePipeline 根据 crawl_people_img 选项异步请求
         item["imgs"] = imgs
-        item["imgs_content"] = contents
+        item["imgs_digest"] = None
+        item["imgs_size"] = None
 
         yield item
 
@@ -411,31 +395,29 @@ class SeriesSpider(scrapy.Spider):
         """解析所有相关的图片
 
         """
-        item = DouBanPhotosItem()
-        item["sid"] = re.search("subject/(\d{3,})", response.url).group(1)
+        sid = re.search("subject/(\d{3,})", response.url).group(1)
         type_ = parse.parse_qs(parse.splitquery(response.url)[1])["type"][0]
         
         # 转换图片类型：海报、剧照还是壁纸
         if type_ == "R":
-            item["type"] = "海报"
+            name = "海报"
             datum, next_ = Pictures.extract_poster(response)
         elif type_ == "S":
-            item["type"] = "剧照"
+            name = "剧照"
             datum, next_ = Pictures.extract_wallpaper_and_series_still(response)
         elif type_ == "W":
-            item["type"] = "壁纸"
+            name = "壁纸"
             datum, next_ = Pictures.extract_wallpaper_and_series_still(response)
         else:
+            name = None
             datum, next_ = [], False
         
         
-        # 遍历获取到数据，转换为 Item
+        # 遍历获取到数据，转换为 Item。图片内容由 DouBanImagePipeline 异步请求，每张图片
+        # 需要独立的 item 对象
         for data in datum:
-            item["pid"] = data.id
-            item["url"] = data.url
-            item['specification'] = data.specification
-            item["content"] = self.request_img_content(data.url)
-            item["description"] = data.description
+            item = DouBanPhotosItem(sid=sid, type=name, pid=data.id, url=data.url, \
+                specification=data.specification, description=data.description)
 
             yield item
         
@@ -460,99 +442,61 @@ class SeriesSpider(scrapy.Spider):
         if "comments" in response.url:
             datum, next_ = Comments.extract_short_comment(response)
         else:
-            with requests_html.HTMLSession() as session:
-                res = session.get(response.url)
-                datum, next_ = Comments.extract_reviews(res, True)
+            # 直接解析 Scrapy 的 response，不再重复下载页面
+            datum, next_ = Comments.extract_reviews(response)
         
         sid = re.search("subject/(\d+)/", response.url).group(1)
         
         for data in datum:
-            item = DouBanCommentsItemM(**{field: data._asdict().get(field) if field != "sid" else sid \
-                for field in DouBanCommentsItemM.fields})
+            item = DouBanCommentsItemM.from_record(data, sid=sid)
             # 根据 watched 字段是否为布尔值作为判断是短评论还是影评
             if isinstance(item['watched'], bool):
                 item['type'] = "短评论"
                 item['content_full'] = None
+                yield item
             else:
                 item['type'] = "影评"
-                # 获取影评全文
+                # 影评全文通过并发的请求获取，获取后和 item 一起传出
                 url = f"https://movie.douban.com/j/review/{item['comment_id']}/full"
-                with requests_html.HTMLSession() as session:
-                    res = session.get(url)
-                    if res.status_code == 200:
-                        content = res.json().get('html')
-                        item['content_full'] = content
-                    else:
-                        item['content_full'] = None
-
-            yield item
+                yield scrapy.Request(url, callback=self.parse_review_full, \
+                    errback=self.review_full_failed, meta={"item": item}, priority=1)
         
         # 下一页
         if next_:
             yield scrapy.Request(next_, callback=self.parse_comments)
 
 
+    def parse_review_full(self, response):
+        """影评全文
 
-    def request_img_content(self, url):
-        """请求图片的内容
-
-        需要根据全局设置判断是否需要获取图片的二进制内容
-        """
-        result = None
-        if self.config.getboolean("optional", "crawl_people_img"):
-            res = requests.get(url)
-            if int(res.status_code) == 200:
-                result = base64.b64encode(res.content)
-        
-        return result
-
-
-    def mongodb_query_count(self, table, query:dict):
-        """MongoDB 查询满足条件的数量
-
-        查询 MongoDB 数据库中数据是否已经存在，collection 是数据库中的文档名称，query 是
-        查询的字典条件, table 对应 mongodb 中的 collection 名称
+        接口返回 JSON 数据，全文在 html 字段中
         """
-        # 如果没有链接数据库，那么创建链接
-        if not hasattr(self, "database"):
-            self.create_mongo_connection()
-
-        collection = self.database[table]
-        result = collection.find(query).count()
-
-        return result
-
+        item = response.meta["item"]
+        try:
+            item['content_full'] = json.loads(response.text).get('html')
+        except ValueError:
+            self.log(f"影评全文解析失败: {response.url}", logging.WARNING)
+            item['content_full'] = None
+        yield item
 
 
-    def create_mongo_connection(self):
-        """创建 MongoDB 链接
-        """
-        port = configure.parser.getint("mongodb", "port")
-        host = configure.parser.get("mongodb", "host")
-        tz_aware = configure.parser.getboolean("mongodb", "tz_aware")
-        minPoolSize = configure.parser.getint("mongodb", "minPoolSize")
-        database = configure.parser.get("mongodb", "database")
-        
+    def review_full_failed(self, failure):
+        """影评全文请求失败时，保留已经解析的影评内容"""
+        item = failure.request.meta["item"]
+        self.log(f"影评全文请求失败: {failure.request.url}, {failure.value}", logging.WARNING)
+        item['content_full'] = None
+        yield item
 
-        self.mongo_client = pymongo.MongoClient(port=port, host=host, \
-            tz_aware=tz_aware, minPoolSize=minPoolSize)
-        self.database = self.mongo_client[database]
-        
 
 
     def check_series_id(self, id):
         """检查 ID 
 
-        确认 ID 是否已经在表中
+        确认 ID 是否已经爬取，通过去重对象判断，不再逐条查询数据表
         """
-        with manipulater.get_session() as session:
-            query = session.query(DouBanSeriesInfo) \
-                                        .filter_by(series_id=id)
-            
-            series_ids_count = query.count()
-            # 如果已经爬取，并且不是通过种子源爬取时，需要更新 seed 中 ID 状态
-            if series_ids_count > 0 and not global_config.getboolean("douban_seed", "check_table"):
-                self.log(f"影视已经爬取过，不再爬取: {id}", logging.DEBUG)
-                return True
+        # 如果已经爬取，并且不是通过种子源爬取时，不再爬取
+        if self.dedup.seen("series", id) and not global_config.getboolean("douban_seed", "check_table"):
+            self.log(f"影视已经爬取过，不再爬取: {id}", logging.DEBUG)
+            return True
         self.log(f"影视内容尚未爬取: {id}", logging.DEBUG)
-        return False
\ No newline at end of file
+        return False
@@ -0,0 +1,7 @@
+#coding:utf8
+"""
+The script archives raw items into rotated, compressed newline-delimited shards with a manifest
+index, and reads them back for replay
+"""
+
+from ._archive import *
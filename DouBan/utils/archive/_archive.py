@@ -0,0 +1,262 @@
+#coding:utf8
+from __future__ import absolute_import
+import io
+import os
+import json
+import gzip
+import time
+import queue
+import logging
+import threading
+
+from ..exceptions import InappropriateArgument
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+__all__ = ["ItemArchive", "read_manifest", "iter_records"]
+
+MANIFEST = "manifest.jsonl"
+SUFFIXES = {"gzip": ".jsonl.gz", "zstd": ".jsonl.zst", "none": ".jsonl"}
+
+logger = logging.getLogger(__name__)
+
+
+def _open_writer(filename, compression, level):
+    if compression == "gzip":
+        return gzip.open(filename, "wb", compresslevel=level or 6)
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=level or 3).stream_writer(open(filename, "wb"))
+    return open(filename, "wb")
+
+
+def _open_reader(filename, compression):
+    if compression == "gzip":
+        return gzip.open(filename, "rb")
+    if compression == "zstd":
+        if zstandard is None:
+            raise InappropriateArgument(f"读取 {filename} 需要安装 zstandard")
+        return zstandard.ZstdDecompressor().stream_reader(open(filename, "rb"))
+    return open(filename, "rb")
+
+
+
+class _Shard:
+    """正在写入的分片，写入时文件名带有 .part 后缀，关闭之后改名并写入 manifest"""
+    def __init__(self, directory, item_type, run_id, sequence, compression, level):
+        self.item_type = item_type
+        self.name = os.path.join(item_type, f"{run_id}-{sequence:05d}{SUFFIXES[compression]}")
+        self.filename = os.path.join(directory, self.name)
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        self.file = _open_writer(self.filename + ".part", compression, level)
+        self.opened = time.time()
+        self.first = None
+        self.last = None
+        self.count = 0
+        self.bytes = 0
+
+
+    def write(self, line, timestamp):
+        self.file.write(line)
+        self.first = timestamp if self.first is None else self.first
+        self.last = timestamp
+        self.count += 1
+        self.bytes += len(line)
+
+
+    def close(self):
+        self.file.close()
+        os.replace(self.filename + ".part", self.filename)
+        return {"path": self.name, "type": self.item_type, "first": self.first, \
+            "last": self.last, "count": self.count, "bytes": self.bytes, \
+            "size": os.path.getsize(self.filename)}
+
+
+
+class ItemArchive:
+    """原始数据归档
+
+    write 只把数据放入队列，后台线程序列化为 JSON 行，按照数据类型写入压缩的分片:
+
+        directory/DoubanDataItem/20240101-120000-1234-00000.jsonl.gz
+
+    分片未压缩的大小超过 max_bytes 或者打开超过 max_seconds 秒之后关闭并开始新的分片，每
+    flush_interval 秒 flush 一次。关闭的分片在 directory/manifest.jsonl 中追加一行索引，记录
+    分片路径、数据类型、运行编号、第一条和最后一条数据的时间、数据条数以及大小，回放时根据
+    manifest 只读取需要的分片。队列满时 write 阻塞，避免写入跟不上时占用过多内存
+
+    Args:
+    ---------
+    directory: 归档目录
+    compression: gzip、zstd(需要安装 zstandard)或者 none
+    level: 压缩级别，None 表示默认
+    max_bytes: 分片未压缩的最大字节数
+    max_seconds: 分片的最长时间(秒)
+    flush_interval: flush 间隔(秒)
+    queue_size: 队列长度
+    run_id: 运行编号，默认使用开始时间和进程号
+    """
+    def __init__(self, directory, compression="gzip", level=None, max_bytes=64 * 1024 * 1024, \
+            max_seconds=3600, flush_interval=5, queue_size=10000, run_id=None):
+        if compression not in SUFFIXES:
+            raise InappropriateArgument(f"压缩方式不正确: {compression}")
+        if compression == "zstd" and zstandard is None:
+            raise InappropriateArgument("zstd 压缩需要安装 zstandard")
+
+        self.directory = directory
+        self.compression = compression
+        self.level = level
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.flush_interval = flush_interval
+        self.run_id = run_id or f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self.shards = {}
+        self.counters = {"records": 0, "shards": 0, "bytes": 0, "size": 0, "errors": 0}
+        self._sequence = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+
+
+    def open(self):
+        if self._thread is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="ItemArchive", daemon=True)
+        self._thread.start()
+
+
+    def write(self, item_type, record):
+        """归档一条数据，record 是可以 JSON 序列化的字典"""
+        if self._thread is None:
+            self.open()
+        self._queue.put((item_type, record, time.time()))
+
+
+    def close(self):
+        """写入队列中剩余的数据并关闭所有分片"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+
+    def _run(self):
+        flushed = time.time()
+        while True:
+            try:
+                entry = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                entry = False
+
+            if entry is None:
+                break
+            if entry:
+                self._write(*entry)
+
+            now = time.time()
+            if now - flushed >= self.flush_interval:
+                self._flush(now)
+                flushed = now
+
+        for item_type in list(self.shards):
+            self._rotate(item_type)
+
+
+    def _write(self, item_type, record, timestamp):
+        try:
+            line = (json.dumps(record, ensure_ascii=False, default=str) + "\n").encode("utf8")
+            shard = self.shards.get(item_type)
+            if shard is None:
+                shard = self.shards[item_type] = _Shard(self.directory, item_type, self.run_id, \
+                    self._sequence, self.compression, self.level)
+                self._sequence += 1
+            shard.write(line, timestamp)
+            self.counters["records"] += 1
+            if shard.bytes >= self.max_bytes:
+                self._rotate(item_type)
+        except Exception as err:
+            self.counters["errors"] += 1
+            logger.error(f"归档 {item_type} 数据失败: {err}")
+
+
+    def _flush(self, now):
+        for item_type, shard in list(self.shards.items()):
+            if now - shard.opened >= self.max_seconds:
+                self._rotate(item_type)
+                continue
+            try:
+                shard.file.flush()
+            except Exception as err:
+                logger.error(f"flush 归档分片 {shard.name} 失败: {err}")
+
+
+    def _rotate(self, item_type):
+        shard = self.shards.pop(item_type)
+        try:
+            entry = shard.close()
+        except Exception as err:
+            self.counters["errors"] += 1
+            logger.error(f"关闭归档分片 {shard.name} 失败: {err}")
+            return
+
+        entry.update(run=self.run_id, compression=self.compression)
+        with open(os.path.join(self.directory, MANIFEST), "a", encoding="utf8") as file:
+            file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.counters["shards"] += 1
+        self.counters["bytes"] += entry["bytes"]
+        self.counters["size"] += entry["size"]
+        logger.info(f"归档分片 {entry['path']}: {entry['count']} 条数据")
+
+
+    @property
+    def stats(self):
+        return dict(self.counters, pending=self._queue.qsize())
+
+
+
+def read_manifest(directory, item_type=None, run=None, since=None, until=None):
+    """读取 manifest，返回时间范围与 [since, until] 有重叠的分片索引
+
+    Args:
+    ---------
+    directory: 归档目录
+    item_type: 数据类型，None 表示全部
+    run: 运行编号，None 表示全部
+    since, until: 时间戳，None 表示不限制
+    """
+    filename = os.path.join(directory, MANIFEST)
+    if not os.path.exists(filename):
+        return []
+
+    entries = []
+    with open(filename, encoding="utf8") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if item_type is not None and entry["type"] != item_type:
+                continue
+            if run is not None and entry["run"] != run:
+                continue
+            if since is not None and entry["last"] < since:
+                continue
+            if until is not None and entry["first"] > until:
+                continue
+            entries.append(entry)
+    return entries
+
+
+def iter_records(directory, item_type=None, run=None, since=None, until=None):
+    """按照 manifest 的顺序逐条读取归档的数据，只解压需要的分片
+
+    时间过滤以分片为单位，分片中的数据全部返回
+    """
+    for entry in read_manifest(directory, item_type=item_type, run=run, since=since, until=until):
+        with _open_reader(os.path.join(directory, entry["path"]), entry["compression"]) as file:
+            for line in io.TextIOWrapper(file, encoding="utf8"):
+                if line.strip():
+                    yield json.loads(line)
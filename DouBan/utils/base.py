@@ -165,6 +165,20 @@ class BaseSQLPipeline(object):
         return sentence
 
 
+    def insert_id_sentence(self, table, fields, key="id", symbol=r"%s"):
+        """Create SQL insert sentence whose `lastrowid` is always the row id
+        Create a insert sentence, like that:
+            INSERT INTO <table> (`col1`, `col2`) VALUES (%s, %s)
+                ON DUPLICATE KEY UPDATE `id` = LAST_INSERT_ID(`id`)
+
+        If the row is duplicated by a unique key, `LAST_INSERT_ID(id)` sets the existed id as
+        `cursor.lastrowid`, so the id never needs to be queried again
+        """
+        sentence = self.insert_sentence(table, fields, symbol=symbol).strip().rstrip(";")
+        return sentence.replace("INSERT IGNORE INTO", "INSERT INTO", 1) + \
+            " ON DUPLICATE KEY UPDATE `{key}` = LAST_INSERT_ID(`{key}`);".format(key=key)
+
+
 
 class BaseSpider(scrapy.Spider):
     """Base class for spider extension
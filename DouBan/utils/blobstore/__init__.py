@@ -0,0 +1,7 @@
+#coding:utf8
+"""
+The script stores image content once by SHA-256 digest in a sharded directory tree, and removes
+the blobs which are no longer referenced
+"""
+
+from ._store import *
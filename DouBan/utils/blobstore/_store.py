@@ -0,0 +1,166 @@
+#coding:utf8
+from __future__ import absolute_import
+import os
+import re
+import time
+import hashlib
+import itertools
+import logging
+import tempfile
+import threading
+
+from ..exceptions import InappropriateArgument
+
+
+__all__ = ["BlobStore"]
+
+
+class BlobStore:
+    """以内容 SHA-256 为 key 的图片存储
+
+    原始字节写入 root 下按照摘要前缀分层的目录，例如 depth=2、width=2 时:
+
+        root/3a/7b/3a7bd3e2360a3d29eea436fcfb7e44c735d117c42d1c1835420b6b9942dd4f1c
+
+    相同内容只写入一次，数据表中只保存摘要和字节数。写入时先写临时文件再改名，读取到的文件
+    总是完整的
+
+    Args:
+    ---------
+    root: 存储目录
+    depth: 目录层数
+    width: 每层目录名称的字符数
+    """
+    logger = logging.getLogger(__name__ + ".BlobStore")
+    blob_pattern = re.compile(r"[0-9a-f]{64}")
+    temp_prefix = ".tmp-"
+
+    def __init__(self, root, depth=2, width=2):
+        if depth * width >= 64:
+            raise InappropriateArgument(f"目录层数不正确: depth={depth}, width={width}")
+        self.root = root
+        self.depth = depth
+        self.width = width
+        self.counters = {"puts": 0, "stored": 0, "duplicated": 0, "bytes": 0, "removed": 0}
+        self._lock = threading.Lock()
+
+
+    @staticmethod
+    def digest(data):
+        return hashlib.sha256(data).hexdigest()
+
+
+    def path(self, digest):
+        if len(digest) != 64:
+            raise InappropriateArgument(f"SHA-256 摘要不正确: {digest}")
+        parts = [digest[i * self.width: (i + 1) * self.width] for i in range(self.depth)]
+        return os.path.join(self.root, *parts, digest)
+
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+
+    def put(self, data):
+        """写入内容，返回 (摘要, 字节数)，内容已经存在时不再写入"""
+        digest = self.digest(data)
+        filename = self.path(digest)
+
+        if os.path.exists(filename):
+            stored = False
+            # 更新修改时间，避免刚刚重新引用的内容被 gc 删除
+            os.utime(filename)
+        else:
+            directory = os.path.dirname(filename)
+            os.makedirs(directory, exist_ok=True)
+            fd, temp = tempfile.mkstemp(dir=directory, prefix=self.temp_prefix)
+            try:
+                with os.fdopen(fd, "wb") as file:
+                    file.write(data)
+                os.replace(temp, filename)
+            except BaseException:
+                os.unlink(temp)
+                raise
+            stored = True
+
+        with self._lock:
+            self.counters["puts"] += 1
+            self.counters["stored" if stored else "duplicated"] += 1
+            self.counters["bytes"] += len(data) if stored else 0
+        return digest, len(data)
+
+
+    def get(self, digest):
+        with open(self.path(digest), "rb") as file:
+            return file.read()
+
+
+    def delete(self, digest):
+        try:
+            os.unlink(self.path(digest))
+            return True
+        except FileNotFoundError:
+            return False
+
+
+    def iter_blobs(self):
+        """遍历已经保存的内容，返回 (摘要, 文件路径)，只包含文件名为 64 位十六进制摘要的文件"""
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if self.blob_pattern.fullmatch(filename):
+                    yield filename, os.path.join(directory, filename)
+
+
+    def iter_temps(self):
+        """遍历写入失败残留的临时文件，返回文件路径"""
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.startswith(self.temp_prefix):
+                    yield os.path.join(directory, filename)
+
+
+    def gc(self, referenced, grace=86400, dry_run=False):
+        """删除没有被引用的内容
+
+        gc 和爬虫同时运行时，刚写入的内容可能还没有写入数据表，因此只删除修改时间早于 grace 秒
+        之前的内容，同时删除残留的临时文件。只处理 iter_blobs 和 iter_temps 返回的文件，root
+        下的其他文件不会被删除
+
+        Args:
+        ---------
+        referenced: 数据表中引用的摘要集合
+        grace: 保留最近修改的内容的秒数
+        dry_run: 为 True 时只统计不删除
+
+        Returns:
+        ---------
+        (删除数量, 删除字节数)
+        """
+        deadline = time.time() - grace
+        removed, size = 0, 0
+        paths = (path for digest, path in self.iter_blobs() if digest not in referenced)
+        for path in itertools.chain(paths, self.iter_temps()):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if stat.st_mtime > deadline:
+                continue
+            if not dry_run:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    continue
+            removed += 1
+            size += stat.st_size
+
+        with self._lock:
+            self.counters["removed"] += 0 if dry_run else removed
+        self.logger.info(f"{'可以' if dry_run else ''}删除 {removed} 个未引用的内容，共 {size} 字节")
+        return removed, size
+
+
+    @property
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
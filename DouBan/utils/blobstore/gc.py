@@ -0,0 +1,70 @@
+#coding:utf8
+"""
+图片内容垃圾回收:
+1. 读取 series_info.cover_digest、picture.digest 以及 MongoDB person 集合 imgs_digest 中引用
+    的摘要
+2. 删除 IMAGE_STORE_DIR 中没有被引用并且修改时间早于 --grace 秒的内容
+
+使用示例:
+    python -m DouBan.utils.blobstore.gc --dry-run
+    python -m DouBan.utils.blobstore.gc --grace 86400
+"""
+from __future__ import absolute_import
+
+import sys
+import logging
+import argparse
+
+import pymongo
+from scrapy.utils.project import get_project_settings
+
+from DouBan.utils.blobstore import BlobStore
+from DouBan.database.conf import configure
+from DouBan.database.manager import DataBaseManipulater
+from DouBan.database.manager.datamodel import DouBanSeriesInfo, DouBanSeriesPic
+
+
+logger = logging.getLogger(__name__)
+
+
+def referenced_digests():
+    """数据表和 MongoDB 中引用的全部摘要"""
+    digests = set()
+    manipulater = DataBaseManipulater()
+    for column in (DouBanSeriesInfo.cover_digest, DouBanSeriesPic.digest):
+        digests.update(value for value in manipulater.iter_values(column, distinct=True) if value)
+
+    client = pymongo.MongoClient(host=configure.parser.get("mongodb", "host"), \
+        port=configure.parser.getint("mongodb", "port"))
+    try:
+        collection = client[configure.parser.get("mongodb", "database")][ \
+            configure.parser.get("mongodb", "person_collection")]
+        for document in collection.find({"imgs_digest": {"$ne": None}}, {"imgs_digest": 1}):
+            digests.update(value for value in document["imgs_digest"] or [] if value)
+    finally:
+        client.close()
+
+    logger.info(f"引用的内容: {len(digests)} 个")
+    return digests
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="删除没有被引用的图片内容")
+    parser.add_argument("--grace", type=int, default=None, \
+        help="只删除修改时间早于该秒数之前的内容，默认使用 IMAGE_STORE_GC_GRACE")
+    parser.add_argument("--dry-run", action="store_true", help="只统计不删除")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s: %(message)s")
+
+    settings = get_project_settings()
+    store = BlobStore(settings.get("IMAGE_STORE_DIR"), depth=settings.getint("IMAGE_STORE_DEPTH", 2))
+    grace = args.grace if args.grace is not None else settings.getint("IMAGE_STORE_GC_GRACE", 86400)
+
+    removed, size = store.gc(referenced_digests(), grace=grace, dry_run=args.dry_run)
+    print(f"{'可以删除' if args.dry_run else '删除'} {removed} 个内容，共 {size} 字节")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,6 @@
+#coding:utf8
+"""
+The script can deduplicate series, people and comments with pluggable backends
+"""
+
+from ._dedup import *
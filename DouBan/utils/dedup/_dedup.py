@@ -0,0 +1,304 @@
+#coding:utf8
+from __future__ import absolute_import
+import math
+import hashlib
+import logging
+
+import redis
+
+from ..exceptions import InappropriateArgument, ConnectionError
+
+
+__all__ = ["Deduplicator", "BloomFilter", "MemoryBackend", "BloomBackend", \
+    "RedisSetBackend", "RedisBloomBackend", "SQLWarmedBackend"]
+
+
+class BloomFilter:
+    """进程内布隆过滤器
+
+    根据容量 capacity 和误判率 error_rate 计算位数组长度以及哈希次数，使用 blake2b 得到两个
+    基础哈希值后以 double hashing 生成 k 个位置。不存在漏判，存在误判率范围内的误判
+
+    Examples:
+    >>> bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    >>> bloom.add("26794435")
+    >>> "26794435" in bloom
+        True
+    """
+    def __init__(self, capacity=1000000, error_rate=0.001):
+        if capacity <= 0 or not 0 < error_rate < 1:
+            raise InappropriateArgument(f"布隆过滤器参数不正确: capacity={capacity}, " +
+                f"error_rate={error_rate}")
+
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(str(key).encode("utf8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) \
+            for position in self._positions(key))
+
+
+    def __len__(self):
+        return self.count
+
+
+
+class MemoryBackend:
+    """进程内集合，精确去重"""
+    def __init__(self):
+        self.sets = {}
+
+
+    def seen_many(self, namespace, keys):
+        data = self.sets.get(namespace, ())
+        return [str(key) in data for key in keys]
+
+
+    def mark_many(self, namespace, keys):
+        self.sets.setdefault(namespace, set()).update(str(key) for key in keys)
+
+
+
+class BloomBackend:
+    """进程内布隆过滤器，每个 namespace 使用独立的过滤器"""
+    def __init__(self, capacity=1000000, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.filters = {}
+
+
+    def _filter(self, namespace):
+        if namespace not in self.filters:
+            self.filters[namespace] = BloomFilter(self.capacity, self.error_rate)
+        return self.filters[namespace]
+
+
+    def seen_many(self, namespace, keys):
+        bloom = self._filter(namespace)
+        return [str(key) in bloom for key in keys]
+
+
+    def mark_many(self, namespace, keys):
+        bloom = self._filter(namespace)
+        for key in keys:
+            bloom.add(str(key))
+
+
+
+class RedisSetBackend:
+    """Redis 集合，namespace 通过 key_format 转换为 Redis key
+
+    查询使用 pipeline 批量执行 SISMEMBER，写入使用一次 SADD
+    """
+    def __init__(self, connection, key_format="dedup:{namespace}"):
+        self.connection = connection
+        self.key_format = key_format
+
+
+    def seen_many(self, namespace, keys):
+        keys = list(keys)
+        if not keys:
+            return []
+        name = self.key_format.format(namespace=namespace)
+        pipeline = self.connection.pipeline(transaction=False)
+        for key in keys:
+            pipeline.sismember(name, key)
+        return [bool(result) for result in pipeline.execute()]
+
+
+    def mark_many(self, namespace, keys):
+        keys = list(keys)
+        if keys:
+            self.connection.sadd(self.key_format.format(namespace=namespace), *keys)
+
+
+
+class RedisBloomBackend:
+    """RedisBloom 模块的布隆过滤器
+
+    需要 Redis 服务加载 RedisBloom 模块，使用 BF.MEXISTS 和 BF.MADD 批量操作
+    """
+    def __init__(self, connection, key_format="dedup:bf:{namespace}", capacity=1000000, \
+            error_rate=0.001):
+        self.connection = connection
+        self.key_format = key_format
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.reserved = set()
+
+
+    def _name(self, namespace):
+        name = self.key_format.format(namespace=namespace)
+        if name not in self.reserved:
+            try:
+                self.connection.execute_command("BF.RESERVE", name, self.error_rate, \
+                    self.capacity)
+            except redis.exceptions.ResponseError:
+                # 过滤器已经存在
+                pass
+            self.reserved.add(name)
+        return name
+
+
+    def seen_many(self, namespace, keys):
+        keys = list(keys)
+        if not keys:
+            return []
+        result = self.connection.execute_command("BF.MEXISTS", self._name(namespace), *keys)
+        return [bool(i) for i in result]
+
+
+    def mark_many(self, namespace, keys):
+        keys = list(keys)
+        if keys:
+            self.connection.execute_command("BF.MADD", self._name(namespace), *keys)
+
+
+
+class SQLWarmedBackend:
+    """使用数据表预热的进程内去重
+
+    loaders 是 namespace 到加载函数的映射，加载函数返回已经存储的 ID 迭代对象。第一次使用某个
+    namespace 时调用加载函数预热，之后的查询都在进程内完成，不再查询数据库。bloom 为 True 时
+    使用布隆过滤器保存，适合数据量较大的表
+    """
+    def __init__(self, loaders, bloom=False, capacity=1000000, error_rate=0.001):
+        self.loaders = loaders
+        self.store = BloomBackend(capacity, error_rate) if bloom else MemoryBackend()
+        self.warmed = set()
+        self.logger = logging.getLogger(__name__ + ".SQLWarmedBackend")
+
+
+    def warm(self, namespace):
+        if namespace in self.warmed:
+            return
+        self.warmed.add(namespace)
+
+        loader = self.loaders.get(namespace)
+        if loader is None:
+            return
+        count = 0
+        batch = []
+        for key in loader():
+            batch.append(key)
+            if len(batch) >= 10000:
+                self.store.mark_many(namespace, batch)
+                count += len(batch)
+                batch = []
+        self.store.mark_many(namespace, batch)
+        count += len(batch)
+        self.logger.info(f"去重数据预热完成 {namespace}: {count} 条")
+
+
+    def seen_many(self, namespace, keys):
+        self.warm(namespace)
+        return self.store.seen_many(namespace, keys)
+
+
+    def mark_many(self, namespace, keys):
+        self.warm(namespace)
+        self.store.mark_many(namespace, keys)
+
+
+
+class Deduplicator:
+    """统一的去重对象
+
+    影视(series)和演职人员(people)等使用不同的 namespace，后端可以是
+    进程内布隆过滤器、Redis 集合、RedisBloom 或者数据表预热的集合。推荐使用批量方法
+    seen_many 和 mark_many 减少往返
+
+    Methods:
+    -----------
+    seen/seen_many: 判断 ID 是否已经存在
+    mark/mark_many: 记录 ID
+    filter_new: 返回尚未存在的 ID 并记录
+    from_settings: 根据 settings 中 DEDUP_* 配置创建对象
+    """
+    def __init__(self, backend):
+        self.backend = backend
+        self.stats = {}
+
+
+    def seen(self, namespace, key):
+        return self.seen_many(namespace, [key])[0]
+
+
+    def seen_many(self, namespace, keys):
+        keys = [str(key) for key in keys]
+        result = self.backend.seen_many(namespace, keys)
+
+        stats = self.stats.setdefault(namespace, {"checked": 0, "seen": 0})
+        stats["checked"] += len(keys)
+        stats["seen"] += sum(result)
+        return result
+
+
+    def mark(self, namespace, key):
+        self.mark_many(namespace, [key])
+
+
+    def mark_many(self, namespace, keys):
+        self.backend.mark_many(namespace, [str(key) for key in keys])
+
+
+    def filter_new(self, namespace, keys):
+        """返回尚未存在的 ID 并记录，保留原始顺序并去除重复值"""
+        keys = list(dict.fromkeys(str(key) for key in keys))
+        new = [key for key, seen in zip(keys, self.seen_many(namespace, keys)) if not seen]
+        self.mark_many(namespace, new)
+        return new
+
+
+    def add(self, namespace, key):
+        """记录 ID，如果是新的 ID 返回 True"""
+        return bool(self.filter_new(namespace, [key]))
+
+
+    @classmethod
+    def from_settings(cls, settings, loaders=None):
+        """根据配置创建去重对象
+
+        DEDUP_BACKEND 可选值: bloom、redis、redis-bloom、sql。使用 sql 时需要传入 loaders
+        """
+        backend = settings.get("DEDUP_BACKEND", "sql")
+        capacity = settings.getint("DEDUP_BLOOM_CAPACITY", 1000000)
+        error_rate = settings.getfloat("DEDUP_BLOOM_ERROR_RATE", 0.001)
+        prefix = settings.get("DEDUP_REDIS_KEY_PREFIX", "dedup:")
+
+        if backend == "bloom":
+            return cls(BloomBackend(capacity, error_rate))
+        elif backend in ("redis", "redis-bloom"):
+            connection = redis.StrictRedis(connection_pool=redis.ConnectionPool(
+                **settings["DATABASE_CONF"]["redis"]))
+            if not connection.ping():
+                raise ConnectionError("Can't connect the redis server. Checkout" +
+                                    " network and config parameters.")
+            if backend == "redis":
+                return cls(RedisSetBackend(connection, prefix + "{namespace}"))
+            return cls(RedisBloomBackend(connection, prefix + "bf:{namespace}", \
+                capacity, error_rate))
+        elif backend == "sql":
+            return cls(SQLWarmedBackend(loaders or {}, \
+                bloom=settings.getbool("DEDUP_SQL_BLOOM", False), \
+                capacity=capacity, error_rate=error_rate))
+        else:
+            raise InappropriateArgument(f"去重后端不正确: {backend}")
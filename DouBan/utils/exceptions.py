@@ -26,4 +26,9 @@ class ConnectionError(Exception):
 
 class ValueConsistenceError(Exception):
     """检测值和提取值不一致"""
-    pass
\ No newline at end of file
+    pass
+
+
+class DecryptError(Exception):
+    """解密数据失败"""
+    pass
@@ -0,0 +1,7 @@
+#coding:utf8
+"""
+The script provides a Redis backed scheduler and dupefilter, so that several spider processes
+share one priority queue and one fingerprint set
+"""
+
+from ._frontier import *
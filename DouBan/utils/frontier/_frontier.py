@@ -0,0 +1,278 @@
+#coding:utf8
+from __future__ import absolute_import
+import time
+import pickle
+import logging
+
+import redis
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
+
+try:
+    from scrapy.utils.request import request_from_dict
+except ImportError:
+    from scrapy.utils.reqser import request_from_dict
+
+try:
+    from scrapy.utils.request import fingerprint as _fingerprint
+except ImportError:
+    from scrapy.utils.request import request_fingerprint as _fingerprint
+
+from ..exceptions import ConnectionError, InappropriateArgument
+
+
+__all__ = ["RedisPriorityQueue", "RedisDupeFilter", "RedisScheduler", "connect", \
+    "encode_request", "decode_request", "request_key"]
+
+
+def connect(settings):
+    """根据 FRONTIER_REDIS_URL 连接 Redis，没有设置时使用 DATABASE_CONF["redis"]"""
+    url = settings.get("FRONTIER_REDIS_URL")
+    if url:
+        connection = redis.StrictRedis.from_url(url)
+    else:
+        config = dict(settings.getdict("DATABASE_CONF")["redis"])
+        connection = redis.StrictRedis(connection_pool=redis.ConnectionPool(**config))
+
+    if not connection.ping():
+        raise ConnectionError("Can't connect the redis server. Checkout" +
+                            " network and config parameters.")
+    return connection
+
+
+def encode_request(request, spider):
+    """请求序列化，callback、errback 保存为 spider 方法名"""
+    if hasattr(request, "to_dict"):
+        data = request.to_dict(spider=spider)
+    else:
+        from scrapy.utils.reqser import request_to_dict
+        data = request_to_dict(request, spider)
+    return pickle.dumps(data, protocol=4)
+
+
+def decode_request(data, spider):
+    return request_from_dict(pickle.loads(data), spider=spider)
+
+
+def request_key(request):
+    """请求指纹
+
+    不使用 crawler.request_fingerprinter，保证没有 crawler 的 feeder 和爬虫进程得到相同的指纹
+    """
+    value = _fingerprint(request)
+    return value.hex() if isinstance(value, bytes) else value
+
+
+class RedisPriorityQueue:
+    """Redis 有序集合实现的优先级队列
+
+    成员是序列化之后的请求，分数是 -priority，ZRANGE 和 ZREMRANGEBYRANK 在一个事务中执行，多个
+    进程同时取出时不会得到同一个请求。相同优先级的请求之间不保证先进先出
+    """
+    def __init__(self, connection, key):
+        self.connection = connection
+        self.key = key
+
+
+    def push(self, data, priority=0):
+        self.connection.zadd(self.key, {data: -priority})
+
+
+    def push_many(self, values, batch_size=1000):
+        """批量写入 (data, priority)，返回写入数量"""
+        count = 0
+        pipeline = self.connection.pipeline(transaction=False)
+        for data, priority in values:
+            pipeline.zadd(self.key, {data: -priority})
+            count += 1
+            if count % batch_size == 0:
+                pipeline.execute()
+        pipeline.execute()
+        return count
+
+
+    def pop(self):
+        """取出优先级最高的请求，队列为空时返回 None"""
+        pipeline = self.connection.pipeline()
+        pipeline.zrange(self.key, 0, 0).zremrangebyrank(self.key, 0, 0)
+        results, _ = pipeline.execute()
+        return results[0] if results else None
+
+
+    def clear(self):
+        self.connection.delete(self.key)
+
+
+    def __len__(self):
+        return self.connection.zcard(self.key)
+
+
+
+class RedisDupeFilter:
+    """Redis 集合实现的请求去重
+
+    SADD 返回 0 说明指纹已经存在，判断和写入是一次原子操作，多个进程共享同一个集合
+    """
+    logger = logging.getLogger(__name__ + ".RedisDupeFilter")
+
+    def __init__(self, connection, key, debug=False):
+        self.connection = connection
+        self.key = key
+        self.debug = debug
+        self.logdupes = True
+
+
+    @classmethod
+    def from_settings(cls, settings, connection=None, spider="default"):
+        return cls(connection or connect(settings), \
+            settings.get("FRONTIER_DUPEFILTER_KEY", "%(spider)s:dupefilter") % {"spider": spider}, \
+            debug=settings.getbool("DUPEFILTER_DEBUG"))
+
+
+    def request_seen(self, request):
+        return self.connection.sadd(self.key, request_key(request)) == 0
+
+
+    def seen_many(self, requests, batch_size=1000):
+        """批量判断并写入指纹，返回和 requests 顺序一致的布尔值列表"""
+        result = []
+        pipeline = self.connection.pipeline(transaction=False)
+        for index, request in enumerate(requests, 1):
+            pipeline.sadd(self.key, request_key(request))
+            if index % batch_size == 0:
+                result.extend(added == 0 for added in pipeline.execute())
+        result.extend(added == 0 for added in pipeline.execute())
+        return result
+
+
+    def open(self):
+        pass
+
+
+    def clear(self):
+        self.connection.delete(self.key)
+
+
+    def close(self, reason=""):
+        pass
+
+
+    def log(self, request, spider):
+        if self.debug:
+            self.logger.debug(f"Filtered duplicate request: {request}")
+        elif self.logdupes:
+            self.logger.debug(f"Filtered duplicate request: {request} - no more duplicates " +
+                "will be shown (see DUPEFILTER_DEBUG to show all duplicates)")
+            self.logdupes = False
+        spider.crawler.stats.inc_value("dupefilter/filtered", spider=spider)
+
+
+
+class RedisScheduler:
+    """共享 Redis 优先级队列和指纹集合的 Scrapy 调度器
+
+    多个主机上的爬虫进程使用相同的 key 时，从同一个队列中取出请求，新请求经过同一个指纹集合
+    去重之后写入队列。种子可以由单独的 feeder 写入队列(python -m DouBan.utils.frontier.feeder)
+
+    队列暂时为空时不立即关闭爬虫，等待 FRONTIER_IDLE_TIMEOUT 秒内没有新的请求才关闭，因为其他
+    进程或者 feeder 可能还会写入请求
+
+    Settings:
+    ---------
+    FRONTIER_REDIS_URL: Redis 地址，None 时使用 DATABASE_CONF["redis"]
+    FRONTIER_QUEUE_KEY: 队列 key，%(spider)s 替换为爬虫名称
+    FRONTIER_DUPEFILTER_KEY: 指纹集合 key
+    FRONTIER_PERSIST: 关闭时是否保留队列和指纹集合
+    FRONTIER_IDLE_TIMEOUT: 队列为空之后等待的秒数
+    """
+    logger = logging.getLogger(__name__ + ".RedisScheduler")
+
+    def __init__(self, connection, queue_key, dupefilter_key, persist=True, idle_timeout=60, \
+            stats=None, debug=False):
+        if idle_timeout < 0:
+            raise InappropriateArgument(f"等待时间不正确: {idle_timeout}")
+
+        self.connection = connection
+        self.queue_key = queue_key
+        self.dupefilter_key = dupefilter_key
+        self.persist = persist
+        self.idle_timeout = idle_timeout
+        self.stats = stats
+        self.debug = debug
+        self.spider = None
+        self.queue = None
+        self.df = None
+        self._active = time.time()
+
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        scheduler = cls(
+            connect(settings),
+            queue_key=settings.get("FRONTIER_QUEUE_KEY", "%(spider)s:requests"),
+            dupefilter_key=settings.get("FRONTIER_DUPEFILTER_KEY", "%(spider)s:dupefilter"),
+            persist=settings.getbool("FRONTIER_PERSIST", True),
+            idle_timeout=settings.getfloat("FRONTIER_IDLE_TIMEOUT", 60),
+            stats=crawler.stats,
+            debug=settings.getbool("DUPEFILTER_DEBUG"),
+        )
+        crawler.signals.connect(scheduler.spider_idle, signal=signals.spider_idle)
+        return scheduler
+
+
+    def open(self, spider):
+        self.spider = spider
+        keys = {"spider": spider.name}
+        self.queue = RedisPriorityQueue(self.connection, self.queue_key % keys)
+        self.df = RedisDupeFilter(self.connection, self.dupefilter_key % keys, debug=self.debug)
+        self._active = time.time()
+
+        pending = len(self.queue)
+        if pending:
+            self.logger.info(f"Resuming crawl ({pending} requests scheduled)")
+
+
+    def close(self, reason):
+        if not self.persist:
+            self.queue.clear()
+            self.df.clear()
+
+
+    def enqueue_request(self, request):
+        if not request.dont_filter and self.df.request_seen(request):
+            self.df.log(request, self.spider)
+            return False
+
+        self.queue.push(encode_request(request, self.spider), request.priority)
+        self._active = time.time()
+        if self.stats is not None:
+            self.stats.inc_value("scheduler/enqueued/redis", spider=self.spider)
+            self.stats.inc_value("scheduler/enqueued", spider=self.spider)
+        return True
+
+
+    def next_request(self):
+        data = self.queue.pop()
+        if data is None:
+            return None
+
+        self._active = time.time()
+        if self.stats is not None:
+            self.stats.inc_value("scheduler/dequeued/redis", spider=self.spider)
+            self.stats.inc_value("scheduler/dequeued", spider=self.spider)
+        return decode_request(data, self.spider)
+
+
+    def has_pending_requests(self):
+        return len(self) > 0
+
+
+    def spider_idle(self, spider):
+        """队列为空的时间没有超过 idle_timeout 时不关闭爬虫，等待其他进程写入请求"""
+        if time.time() - self._active < self.idle_timeout:
+            raise DontCloseSpider
+
+
+    def __len__(self):
+        return len(self.queue)
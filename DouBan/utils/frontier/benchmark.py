@@ -0,0 +1,170 @@
+#coding:utf8
+"""
+共享队列多进程基准测试:
+1. 启动本地 HTTP 服务，每个页面延迟 latency 秒返回，并包含两个指向其他页面的链接(全部是重复
+    请求，需要共享的指纹集合过滤)
+2. 所有页面写入 Redis 优先级队列，分别启动 1、2、4 ... 个 Scrapy 进程(RedisScheduler)共同爬取
+3. 根据服务端第一次和最后一次请求的时间计算每秒页面数，同时检查每个页面是否恰好被请求一次
+
+每一轮使用独立的 key，结束后删除。需要可以访问的 Redis 服务，默认使用 DATABASE_CONF["redis"]
+
+使用示例:
+    python -m DouBan.utils.frontier.benchmark --pages 2000 --workers 1 2 4
+    python -m DouBan.utils.frontier.benchmark --redis-url redis://127.0.0.1:6379/15
+"""
+from __future__ import absolute_import
+
+import sys
+import time
+import uuid
+import argparse
+import threading
+import multiprocessing
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import scrapy
+from scrapy.settings import Settings
+
+from DouBan.settings import DATABASE_CONF
+from DouBan.utils.frontier import connect
+from DouBan.utils.frontier.feeder import feed
+
+
+class BenchmarkSpider(scrapy.Spider):
+    """请求全部来自共享队列，解析页面中的链接生成重复请求"""
+    name = "frontier_benchmark"
+
+    def start_requests(self):
+        return []
+
+
+    def parse(self, response):
+        for href in response.css("a::attr(href)").getall():
+            yield response.follow(href, callback=self.parse)
+
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        index = int(self.path.rstrip("/").rsplit("/", 1)[-1])
+        with self.server.lock:
+            self.server.hits[self.path] += 1
+            self.server.times.append(time.time())
+
+        links = ((index * 7 + 1) % self.server.pages, (index + 1) % self.server.pages)
+        body = "<html><body>" + \
+            "".join(f'<a href="/page/{i}">{i}</a>' for i in links) + "</body></html>"
+        body = body.encode("utf8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+
+def start_server(pages, latency):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.daemon_threads = True
+    server.pages = pages
+    server.latency = latency
+    server.lock = threading.Lock()
+    server.hits = Counter()
+    server.times = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def frontier_settings(redis_url, prefix, concurrency=8, idle_timeout=3):
+    return {
+        "SCHEDULER": "DouBan.utils.frontier.RedisScheduler",
+        "DATABASE_CONF": {"redis": DATABASE_CONF["redis"]},
+        "FRONTIER_REDIS_URL": redis_url,
+        "FRONTIER_QUEUE_KEY": prefix + ":requests",
+        "FRONTIER_DUPEFILTER_KEY": prefix + ":dupefilter",
+        "FRONTIER_IDLE_TIMEOUT": idle_timeout,
+        "CONCURRENT_REQUESTS": concurrency,
+        "CONCURRENT_REQUESTS_PER_DOMAIN": concurrency,
+        "DOWNLOAD_DELAY": 0,
+        "ROBOTSTXT_OBEY": False,
+        "COOKIES_ENABLED": False,
+        "RETRY_ENABLED": False,
+        "TELNETCONSOLE_ENABLED": False,
+        "LOG_LEVEL": "WARNING",
+    }
+
+
+def _worker(settings):
+    from scrapy.crawler import CrawlerProcess
+
+    process = CrawlerProcess(settings=settings)
+    process.crawl(BenchmarkSpider)
+    process.start()
+
+
+def run(server, workers, pages, redis_url, concurrency):
+    """写入所有页面之后启动 workers 个爬虫进程，返回 (每秒页面数, 重复请求数, 缺失页面数)"""
+    prefix = f"frontier_benchmark:{uuid.uuid4().hex}"
+    options = frontier_settings(redis_url, prefix, concurrency=concurrency)
+    settings = Settings(options)
+    connection = connect(settings)
+
+    server.hits.clear()
+    server.times.clear()
+    base = f"http://127.0.0.1:{server.server_port}/page/"
+    try:
+        feed(BenchmarkSpider(), settings, \
+            (scrapy.Request(base + str(i)) for i in range(pages)))
+
+        context = multiprocessing.get_context("spawn")
+        processes = [context.Process(target=_worker, args=(options,)) for _ in range(workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    finally:
+        connection.delete(options["FRONTIER_QUEUE_KEY"], options["FRONTIER_DUPEFILTER_KEY"])
+
+    elapsed = max(server.times) - min(server.times) if len(server.times) > 1 else float("nan")
+    duplicated = sum(count - 1 for count in server.hits.values())
+    return len(server.times) / elapsed, duplicated, pages - len(server.hits)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="共享队列多进程基准测试")
+    parser.add_argument("--pages", type=int, default=2000, help="页面数量")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="进程数量")
+    parser.add_argument("--concurrency", type=int, default=8, help="每个进程的并发请求数量")
+    parser.add_argument("--latency", type=float, default=0.05, help="每个页面的响应延迟(秒)")
+    parser.add_argument("--redis-url", default=None, help="Redis 地址，默认使用 DATABASE_CONF")
+    args = parser.parse_args(argv)
+
+    server = start_server(args.pages, args.latency)
+    baseline, failed = None, False
+    try:
+        for workers in args.workers:
+            rate, duplicated, missing = run(server, workers, args.pages, args.redis_url, \
+                args.concurrency)
+            baseline = baseline or rate / workers
+            print(f"workers={workers:<3d} {rate:8.1f} pages/sec  " +
+                f"efficiency={rate / (baseline * workers):5.0%}  " +
+                f"duplicated={duplicated} missing={missing}")
+            failed = failed or duplicated > 0 or missing > 0
+    finally:
+        server.shutdown()
+
+    if failed:
+        print("存在重复或者缺失的页面")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
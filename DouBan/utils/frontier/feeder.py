@@ -0,0 +1,81 @@
+#coding:utf8
+"""
+种子写入共享队列:
+1. 读取 `series_temp` 中的种子(scrapy.cfg 中 recrawl 为 True 时使用重新爬取计划)，生成和
+    SeriesSpider 相同的详情页请求
+2. 请求经过共享的指纹集合去重之后批量写入 Redis 优先级队列，各个主机上的 series 爬虫进程
+    (FRONTIER_EXTERNAL_SEEDS = True)从队列中取出请求
+
+使用示例:
+    python -m DouBan.utils.frontier.feeder
+    python -m DouBan.utils.frontier.feeder --flush  # 清空队列和指纹集合，开始新的一轮爬取
+"""
+from __future__ import absolute_import
+
+import sys
+import logging
+import argparse
+from itertools import islice
+
+from scrapy.utils.project import get_project_settings
+
+from DouBan.utils.frontier import RedisPriorityQueue, RedisDupeFilter, connect, encode_request
+
+
+logger = logging.getLogger(__name__)
+
+
+def feed(spider, settings, requests, batch_size=1000):
+    """请求去重之后写入队列，返回 (写入数量, 重复数量)"""
+    connection = connect(settings)
+    keys = {"spider": spider.name}
+    queue = RedisPriorityQueue(connection, \
+        settings.get("FRONTIER_QUEUE_KEY", "%(spider)s:requests") % keys)
+    dupefilter = RedisDupeFilter(connection, \
+        settings.get("FRONTIER_DUPEFILTER_KEY", "%(spider)s:dupefilter") % keys)
+
+    pushed = duplicated = 0
+    requests = iter(requests)
+    while True:
+        batch = list(islice(requests, batch_size))
+        if not batch:
+            break
+
+        seen = dupefilter.seen_many([i for i in batch if not i.dont_filter])
+        seen = iter(seen)
+        values = [(encode_request(request, spider), request.priority) for request in batch \
+                    if request.dont_filter or not next(seen)]
+        pushed += queue.push_many(values, batch_size=batch_size)
+        duplicated += len(batch) - len(values)
+        logger.info(f"写入 {pushed} 个请求，重复 {duplicated} 个，队列长度 {len(queue)}")
+    return pushed, duplicated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="种子写入共享队列")
+    parser.add_argument("--flush", action="store_true", help="写入之前清空队列和指纹集合")
+    parser.add_argument("--batch-size", type=int, default=1000, help="每批写入的请求数量")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s: %(message)s")
+
+    from DouBan.spiders.series import SeriesSpider
+
+    settings = get_project_settings()
+    spider = SeriesSpider()
+
+    if args.flush:
+        connection = connect(settings)
+        keys = {"spider": spider.name}
+        RedisPriorityQueue(connection, \
+            settings.get("FRONTIER_QUEUE_KEY", "%(spider)s:requests") % keys).clear()
+        RedisDupeFilter.from_settings(settings, connection, spider=spider.name).clear()
+        logger.info("已清空队列和指纹集合")
+
+    pushed, duplicated = feed(spider, settings, spider.seed_requests(), batch_size=args.batch_size)
+    print(f"写入 {pushed} 个请求，重复 {duplicated} 个")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
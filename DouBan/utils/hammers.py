@@ -1,17 +1,17 @@
 #-*-coding:utf8-*-
 """
 The script is a addictive tool that can deal with some special task:
-1. extract the first PinYin character
+1. extract the first PinYin character, results are cached by `DouBan.utils.pinyin`
 """
 
 from __future__ import absolute_import
 
-from pypinyin import Style, pinyin
-
 import urllib3
 from requests import exceptions
 
-__all__ = ["extract1st_char", "_url_valid"]
+from .pinyin import initials
+
+__all__ = ["extract1st_char", "extract1st_chars", "_url_valid"]
 
 
 def extract1st_char(string):
@@ -24,10 +24,19 @@ def extract1st_char(string):
     >>> extract1st_char(string)
         'tlbltlytlbltly7.5'
     """
-    string = string.replace(" ", "")
-    result = pinyin(string, style=Style.INITIALS, errors="default", strict=False)
-    
-    return "".join(i[0] for i in result).lower()
+    return initials.get(string)
+
+
+def extract1st_chars(strings):
+    """Extract First Accent Character Of Many Strings
+
+    Convert a list of strings in one call, the cache is checked once for all of them.
+
+    Examples:
+    >>> extract1st_chars(["西尔莎·罗南", "艾玛·沃森"])
+        ['xsh·ln', 'm·ws']
+    """
+    return initials.get_many(strings)
 
 
 
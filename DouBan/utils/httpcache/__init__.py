@@ -0,0 +1,6 @@
+#coding:utf8
+"""
+The script stores compressed responses on disk for the downloader cache middleware
+"""
+
+from ._storage import *
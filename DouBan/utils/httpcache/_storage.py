@@ -0,0 +1,211 @@
+#coding:utf8
+from __future__ import absolute_import
+import os
+import re
+import json
+import time
+import zlib
+import sqlite3
+import logging
+import threading
+from collections import namedtuple
+
+from ..exceptions import InappropriateArgument
+
+
+__all__ = ["ResponseCache", "TTLPolicy"]
+
+
+class TTLPolicy:
+    """按照 URL 规则确定缓存有效期
+
+    rules 是 (正则表达式, 秒数) 组成的列表，按顺序匹配第一条规则，没有匹配时使用 default。
+    有效期小于等于 0 表示不缓存
+
+    Examples:
+    >>> policy = TTLPolicy([(r"/celebrity/\\d+/?$", 30 * 86400), (r"/comments", 3600)])
+    >>> policy("https://movie.douban.com/celebrity/1054443/")
+        2592000
+    """
+    def __init__(self, rules, default=0):
+        self.rules = [(re.compile(pattern), int(ttl)) for pattern, ttl in rules]
+        self.default = int(default)
+
+
+    def __call__(self, url):
+        for pattern, ttl in self.rules:
+            if pattern.search(url):
+                return ttl
+        return self.default
+
+
+
+class ResponseCache:
+    """响应内容磁盘缓存
+
+    使用一个 SQLite 文件保存响应，以请求指纹作为 key，响应内容使用 zlib 压缩。同时记录 ETag
+    和 Last-Modified，用于过期后的条件请求。缓存总大小(压缩后)超过 max_bytes 时，按照最近访
+    问时间删除最早的数据，直到低于上限的 90%
+
+    读取时只在内存中记录访问时间，写入和访问时间累计 commit_size 条或者超过 commit_interval
+    秒之后在一个事务中提交，不会每次读写都提交。方法可以在多个线程中调用(例如
+    deferToThread)，使用同一个连接并以锁串行执行
+
+    Args:
+    ---------
+    path: SQLite 文件路径
+    max_bytes: 缓存内容的字节数上限，0 表示不限制
+    level: zlib 压缩级别
+    commit_size: 未提交的写入和访问记录数量阈值
+    commit_interval: 提交的时间间隔，单位为秒
+    """
+    entry = namedtuple("entry", ["fingerprint", "url", "status", "headers", "body", \
+        "raw_size", "stored", "etag", "last_modified"])
+    logger = logging.getLogger(__name__ + ".ResponseCache")
+
+    def __init__(self, path, max_bytes=0, level=6, commit_size=100, commit_interval=5):
+        if max_bytes < 0:
+            raise InappropriateArgument(f"缓存上限不正确: {max_bytes}")
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self.level = level
+        self.commit_size = commit_size
+        self.commit_interval = commit_interval
+        self.evicted = 0
+        # 尚未写入的访问时间以及尚未提交的写入数量
+        self._accessed = {}
+        self._uncommitted = 0
+        self._committed = time.time()
+        self._lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries (" +
+            "fingerprint TEXT PRIMARY KEY, url TEXT NOT NULL, status INTEGER NOT NULL, " +
+            "headers TEXT NOT NULL, body BLOB NOT NULL, size INTEGER NOT NULL, " +
+            "raw_size INTEGER NOT NULL, stored REAL NOT NULL, accessed REAL NOT NULL, " +
+            "etag TEXT, last_modified TEXT)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS idx_accessed ON entries (accessed)"
+        )
+        self.connection.commit()
+        self.size = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+
+    def get(self, fingerprint):
+        """读取缓存，不存在时返回 None，headers 为 {name: [value, ...]}"""
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT fingerprint, url, status, headers, body, raw_size, stored, etag, " +
+                "last_modified FROM entries WHERE fingerprint = ?", (fingerprint,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            self._accessed[fingerprint] = time.time()
+            self._maybe_commit()
+        return self.entry(row[0], row[1], row[2], json.loads(row[3]), zlib.decompress(row[4]), \
+            *row[5:])
+
+
+    def set(self, fingerprint, url, status, headers, body, etag=None, last_modified=None):
+        """保存响应内容，已经存在时覆盖，返回超过上限删除的数量"""
+        compressed = zlib.compress(body, self.level)
+        with self._lock:
+            old = self.connection.execute("SELECT size FROM entries WHERE fingerprint = ?", \
+                (fingerprint,)).fetchone()
+
+            now = time.time()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries (fingerprint, url, status, headers, body, " +
+                "size, raw_size, stored, accessed, etag, last_modified) " +
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (fingerprint, url, status, json.dumps(headers), compressed, len(compressed), \
+                    len(body), now, now, etag, last_modified)
+            )
+            self._accessed.pop(fingerprint, None)
+            self._uncommitted += 1
+            self.size += len(compressed) - (old[0] if old else 0)
+            evicted = self.evict()
+            self._maybe_commit()
+        return evicted
+
+
+    def touch(self, fingerprint):
+        """条件请求确认内容没有变化，重置缓存时间"""
+        now = time.time()
+        with self._lock:
+            self.connection.execute(
+                "UPDATE entries SET stored = ?, accessed = ? WHERE fingerprint = ?", \
+                (now, now, fingerprint))
+            self._accessed.pop(fingerprint, None)
+            self._uncommitted += 1
+            self._maybe_commit()
+
+
+    def evict(self):
+        """缓存大小超过上限时删除最早访问的数据，返回删除的数量"""
+        if not self.max_bytes or self.size <= self.max_bytes:
+            return 0
+
+        with self._lock:
+            # 先写入内存中的访问时间，按照最新的访问时间删除
+            self._write_accessed()
+            target = self.max_bytes * 0.9
+            count = 0
+            while self.size > target:
+                rows = self.connection.execute(
+                    "SELECT fingerprint, size FROM entries ORDER BY accessed LIMIT 100").fetchall()
+                if not rows:
+                    break
+
+                removed, size = [], self.size
+                for fingerprint, length in rows:
+                    removed.append((fingerprint,))
+                    size -= length
+                    if size <= target:
+                        break
+                self.connection.executemany("DELETE FROM entries WHERE fingerprint = ?", removed)
+                self._uncommitted += len(removed)
+                self.size = size
+                count += len(removed)
+            self.evicted += count
+
+        self.logger.info(f"缓存超过上限，删除 {count} 条数据，当前大小 {self.size} 字节")
+        return count
+
+
+    def _write_accessed(self):
+        if self._accessed:
+            self.connection.executemany("UPDATE entries SET accessed = ? WHERE fingerprint = ?", \
+                [(accessed, fingerprint) for fingerprint, accessed in self._accessed.items()])
+            self._uncommitted += len(self._accessed)
+            self._accessed = {}
+
+
+    def _maybe_commit(self):
+        if self._uncommitted + len(self._accessed) >= self.commit_size or \
+                time.time() - self._committed >= self.commit_interval:
+            self.commit()
+
+
+    def commit(self):
+        """写入访问时间并提交"""
+        with self._lock:
+            self._write_accessed()
+            if self._uncommitted:
+                self.connection.commit()
+                self._uncommitted = 0
+            self._committed = time.time()
+
+
+    def close(self):
+        with self._lock:
+            self.commit()
+            self.connection.close()
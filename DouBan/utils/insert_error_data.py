@@ -6,15 +6,21 @@ from __future__ import absolute_import
 
 import copy
 import os
-import pandas as pd
+import sys
+import time
+import argparse
+import threading
 import numpy as np
 import logging
 import logging.config
 import json
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, ALL_COMPLETED
 
-from DouBan.settings import DATABASE_CONF, TABLE_FIELDS, LOG_ENABLED, LOG_FILE, LOG_LEVEL
+from DouBan.settings import DATABASE_CONF, TABLE_FIELDS, LOG_ENABLED, LOG_FILE, LOG_LEVEL, \
+    PINYIN_CACHE_SIZE, PINYIN_CACHE_PATH
 from DouBan.utils.base import BaseSQLPipeline
-from DouBan.utils.hammers import extract1st_char
+from DouBan.utils.hammers import extract1st_char, extract1st_chars
+from DouBan.utils.pinyin import initials
 
 
 
@@ -76,6 +82,10 @@ logger = logging.getLogger("FileLogger")
 
 
 class Dealer(BaseSQLPipeline):
+    # the tables which store video details, inserted once per video
+    child_tables = ("video_actor", "video_director", "video_type", "video_review", \
+        "video_extension_region", "video_character")
+
     def __init__(self, config=None, fields_mapping=None):
         if config is None:
             config = copy.deepcopy(DATABASE_CONF)
@@ -89,102 +99,196 @@ class Dealer(BaseSQLPipeline):
             basic_config=config["mysql"])
         
         # self.cache_connection = super().create_connection("redis", **config["redis"])
-        self._file = open(os.path.join(os.getcwd(), "error.json"), "w")
+        # share the PinYin initials cache file with the spider pipelines
+        initials.configure(maxsize=PINYIN_CACHE_SIZE, path=PINYIN_CACHE_PATH)
     
 
-    def get_data(self, func, filepath, **kwargs):
-        dataframe = func(filepath, **kwargs)
+    def validate(self, item):
+        """Check the item before inserting, return the reason if it's invalid else None"""
+        missing = [key for key in self.required_keys if key not in item]
+        if missing:
+            return f"missing keys {missing}"
+        if not item["title"]:
+            return "empty title"
+        for key in ("short_comment", "worker_detail"):
+            try:
+                json.loads(item[key])
+            except (TypeError, ValueError):
+                return f"invalid json in {key}"
+        return None
+
 
-        return dataframe
+    @property
+    def required_keys(self):
+        keys = {"id", "title", "actors", "director", "category", "short_comment", \
+            "play_location", "play_year", "release_year", "play_duration", "worker_detail"}
+        keys.update(key for key in self.schema["video"].values() if not key.endswith("jane"))
+        return keys
 
-    
-    def process_item(self, item):
-        def insert(sentence, data, single_query=True, cursor=None, insert_step=None):
+
+    def prefetch(self, cursor, items):
+        """Query video ids and inserted child tables for a batch of items at once
+
+        Returns:
+            video_ids: dict, video name maps with the latest video id
+            existing: dict, child table maps with the set of video ids already inserted
+        """
+        titles = list({item["title"] for item in items})
+        video_ids = {}
+        cursor.execute(f"SELECT `name`, id FROM video WHERE `name` IN ({','.join(['%s'] * len(titles))}) " + 
+            "ORDER BY create_time DESC;", titles)
+        for name, video_id in cursor.fetchall():
+            video_ids.setdefault(name, video_id)
+
+        existing = {table: set() for table in self.child_tables}
+        ids = list(set(video_ids.values()))
+        if ids:
+            for table in self.child_tables:
+                cursor.execute(f"SELECT DISTINCT video_id FROM `{table}` WHERE `video_id` IN " + 
+                    f"({','.join(['%s'] * len(ids))});", ids)
+                existing[table] = {row[0] for row in cursor.fetchall()}
+        return video_ids, existing
+
+
+    def process_batch(self, items):
+        """Insert a batch of items in a single transaction
+
+        If the batch fails, it's rolled back and the items are inserted one by one, so only the
+        wrong items are skipped. The errors which aren't raised by an insert step (e.g. the
+        connection is lost) are raised, so the replay stops before the batch
+
+        Returns:
+            inserted: number of inserted items
+            failures: list of (item, step, error), the items failed to insert
+        """
+        try:
+            self.write_batch(items)
+            return len(items), []
+        except Exception as err:
+            step = getattr(err, "query_step", None)
+            if step is None:
+                raise
+            if len(items) == 1:
+                logger.error(f"Insert data {items[0]['id']} at step <{step}> Failed, because {err}")
+                return 0, [(items[0], step, err)]
+            logger.warning(f"Insert batch of {len(items)} items Failed at step <{step}>, " + 
+                f"because {err}, retry one by one")
+
+        inserted, failures = 0, []
+        for item in items:
+            count, failed = self.process_batch([item])
+            inserted += count
+            failures.extend(failed)
+        return inserted, failures
+
+
+    def write_batch(self, items):
+        """Insert the items in a single transaction, roll back if any of them fails
+
+        Returns:
+            video_ids: dict, video name maps with the video id
+        """
+        self.db_connection.ping(reconnect=True)
+        cursor = self.db_connection.cursor()
+        try:
+            video_ids, existing = self.prefetch(cursor, items)
+            for item in items:
+                self.process_item(item, cursor=cursor, video_ids=video_ids, existing=existing)
+            self.db_connection.commit()
+            return video_ids
+        except Exception:
+            self.db_connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+
+    def process_item(self, item, cursor=None, video_ids=None, existing=None):
+        """Insert an item, return the video id
+
+        `video_ids` and `existing` come from `prefetch`, and are updated after inserting, so
+        the items in the same batch share them. The caller commits the transaction, without
+        `cursor` the item is inserted in its own transaction. The exception raised by an insert
+        step is marked with `query_step`
+        """
+        def insert(sentence, data, single_query=True, insert_step=None):
             """Insert Data Into Table"""
             try:
                 # insert a single data
                 if single_query:
                     cursor.execute(sentence, data)
-                    self.db_connection.commit()
                 # insert many data with executemany method
                 else:
                     cursor.executemany(sentence, data)
-                    self.db_connection.commit()
                 
                 logger.info(f"Insert data {item['id']} Success at step <{insert_step}>!")
             except Exception as err:
-                if insert_step is not None:
-                    msg = f"Insert data {item} at step <{insert_step}> Failed"
-                else:
-                    msg = f"Insert data {item} Failed"
-                logger.critical(msg)
+                err.query_step = insert_step
+                raise
 
+        if cursor is None:
+            return self.write_batch([item]).get(item["title"])
 
-        self.db_connection.ping(reconnect=True)
         # check whether video is contained and insert data
-        cursor = self.db_connection.cursor()
-        query = cursor.execute("SELECT id FROM video WHERE `name` = %s ORDER BY create_time DESC;", \
-            (item['title'],))
-        video_id = cursor.fetchone()[0]
-        if query == 0:
+        video_id = video_ids.get(item["title"])
+        if video_id is None:
             video_sent = self.insert_sentence("video", self.schema["video"].keys())
             video_data = self.extract_data(self.schema["video"], item, jane_key="title")  
-            video_data = [None if isinstance(i, np.float) and  np.isnan(i) else i for i in video_data]
-            insert(video_sent, video_data, cursor=cursor, insert_step="video")
+            video_data = [None if isinstance(i, float) and np.isnan(i) else i for i in video_data]
+            insert(video_sent, video_data, insert_step="video")
             # get id
             cursor.execute("SELECT id FROM video WHERE `name` = %s ORDER BY create_time DESC;", \
             (item['title'],))
-            video_id = cursor.fetchone()[0]
+            row = cursor.fetchone()
+            if row is None:
+                logger.critical(f"{item['id']} can't be inserted into video")
+                return None
+            video_id = video_ids[item["title"]] = row[0]
 
             logger.info("Insert data into video successfully")
         else:
             logger.info(f"{item['id']} inserted in video")
 
-        # store actor data into table, and query id
-        query = cursor.execute("SELECT id FROM video_actor WHERE `video_id`= %s", (video_id))
-        if query == 0:
+        # store actor data into table
+        if video_id not in existing["video_actor"]:
             actor_sent = self.insert_sentence("video_actor", self.schema["video_actor"].keys())
             actors_data = self.extract_list(item["actors"], True, video_id)
             
-            if len(actors_data) > 0:
-                insert(actor_sent, actors_data, single_query=False, cursor=cursor, \
-                    insert_step="video_actor")
+            if actors_data:
+                insert(actor_sent, actors_data, single_query=False, insert_step="video_actor")
             else:
                 logger.info(f"{item['id']} doesn't contain actors")
+        else:
+            logger.info(f"{item['id']} inserted in video_actor")
 
-        # store director data into table, and query id
-        query = cursor.execute("SELECT id FROM video_director WHERE `video_id`= %s", (video_id,))
-        if query == 0:
+        # store director data into table
+        if video_id not in existing["video_director"]:
             director_sent = self.insert_sentence("video_director", self.schema["video_director"].keys())
             directors_data = self.extract_list(item["director"], True, video_id)
 
-            if len(directors_data) > 0:
+            if directors_data:
                 insert(director_sent, directors_data, single_query=False, \
-                    cursor=cursor, insert_step="video_director")
+                    insert_step="video_director")
             else:
                 logger.info(f"{item['id']} doesn't contain directors")
-
         else:
             logger.info(f"{item['id']} inserted in video_director")
 
         
         # store category data into table
-        query = cursor.execute("SELECT id FROM video_type WHERE `video_id`= %s", (video_id,))
-        if query == 0:
+        if video_id not in existing["video_type"]:
             category_sent = self.insert_sentence("video_type", self.schema["video_type"].keys())
             category_data = self.extract_list(item["category"], appendix=video_id)
             
-            if len(category_data) > 0:
-                insert(category_sent, category_data, single_query=False, \
-                    cursor=cursor, insert_step="video_type")
+            if category_data:
+                insert(category_sent, category_data, single_query=False, insert_step="video_type")
             else:
                 logger.debug(f"Data id: {item['id']} doesn't contain Category information!")
         else:
             logger.info(f"{item['id']} inserted in video_type")
         
         # store review data into table
-        query = cursor.execute("SELECT id FROM video_review WHERE `video_id`= %s", (video_id,))
-        if query == 0:
+        if video_id not in existing["video_review"]:
             review_sent = self.insert_sentence("video_review", self.schema["video_review"].keys())
             reviews = json.loads(item["short_comment"])
 
@@ -193,8 +297,7 @@ class Dealer(BaseSQLPipeline):
                         reviews["time"], reviews["rate"], reviews["comment"]))]
             # 有评论数据再插入
             if len(review_data) > 0:
-                insert(review_sent, review_data, single_query=False, \
-                    cursor=cursor, insert_step="video_review")
+                insert(review_sent, review_data, single_query=False, insert_step="video_review")
             else:
                 logger.debug(f"Data id: {item['id']} has no short comment!")
         else:
@@ -206,13 +309,12 @@ class Dealer(BaseSQLPipeline):
         [(1, '中国大陆', '2019', '2020', '135分钟', 0),
         (1, '美国', '2019', '2019-12-25', '135分钟', 0)]
         """
-        query = cursor.execute("SELECT id FROM video_extension_region WHERE `video_id`= %s", (video_id,))
-        if query == 0:
+        if video_id not in existing["video_extension_region"]:
             extension_region_sent = self.insert_sentence("video_extension_region", \
                                     self.schema["video_extension_region"].keys())
 
-            regions = self.extract_list(item["play_location"])
-            release_times = self.extract_list(item["play_year"])
+            regions = self.extract_list(item["play_location"]) or []
+            release_times = self.extract_list(item["play_year"]) or []
             extension_region_data = []
             for region, time_ in zip(regions, release_times):
                 extension_region_data.append((video_id, region, \
@@ -220,15 +322,14 @@ class Dealer(BaseSQLPipeline):
             
             if len(extension_region_data) > 0:
                 insert(extension_region_sent, extension_region_data, \
-                    single_query=False, cursor=cursor, insert_step="video_extension_region")
+                    single_query=False, insert_step="video_extension_region")
             else:
                 logger.debug(f"Data id: {item['id']} has no extension region information!")
         else:
             logger.info(f"{item['id']} inserted in video_extension_region")
 
         # store role information into table
-        query = cursor.execute("SELECT id FROM video_character WHERE `video_id`= %s", (video_id,))
-        if query == 0:
+        if video_id not in existing["video_character"]:
             character_role_sent = self.insert_sentence("video_character", \
                                 self.schema["video_character"].keys())
             character_role_data = [(video_id, index, name, role, url) \
@@ -237,13 +338,15 @@ class Dealer(BaseSQLPipeline):
             
             if len(character_role_data) >= 1:
                 insert(character_role_sent, character_role_data, single_query=False, \
-                    cursor=cursor, insert_step="video_character")
+                    insert_step="video_character")
             else:
                 logger.debug(f"Data id: {item['id']} has no character information!")
         else:
             logger.info(f"{item['id']} inserted in video_character")
 
-        return query
+        for table in self.child_tables:
+            existing[table].add(video_id)
+        return video_id
 
 
     def extract_data(self, mapping, item, jane_key=None, append_data=None):
@@ -311,7 +414,7 @@ class Dealer(BaseSQLPipeline):
         split_data = [i.strip() for i in text.split(split_char)]
 
         if jane:
-            jane_data = [extract1st_char(i) for i in split_data]
+            jane_data = extract1st_chars(split_data)
             result = []
             for item, jane in zip(split_data, jane_data):
                 if appendix is not None:
@@ -341,19 +444,257 @@ class Dealer(BaseSQLPipeline):
 
     def close(self):
         self.db_connection.close()
+        logger.info(f"PinYin initials cache: {initials.stats}")
+
+
+class Replayer(object):
+    """Replay The Error File
+
+    Stream the JSON lines file in chunks of `chunk_size` lines, instead of loading it with
+    pandas. The chunks are validated and inserted by `workers` threads, each thread owns a
+    Dealer(one database connection) and inserts `batch_size` items per transaction. Every
+    worker has its own queue and the items are routed by `hash(title)`, so the items of the same
+    video are inserted by one connection in order, and the video isn't inserted twice by
+    different connections.
+    Invalid items and the items failed to insert are appended to `reject_path` with the reason
+    (and the insert step), a failed batch is rolled back and retried item by item.
+
+    The byte offset before which all the chunks are finished is saved into `checkpoint`, so an
+    interrupted replay resumes from it. Progress and rows/sec are logged every
+    `report_interval` seconds.
+
+    Arguments:
+        filepath: JSON lines error file, written by DoubanStoragePipeline
+        workers: number of worker threads and database connections
+        chunk_size: lines per chunk
+        batch_size: items per transaction
+        checkpoint: checkpoint file path, default `<filepath>.checkpoint`
+        reject_path: invalid items file path
+        report_interval: seconds between progress logs
+        dealer_factory: callable returns a Dealer, called once per worker
+    
+    Example:
+    >>> replayer = Replayer("./err.txt", workers=4)
+    >>> replayer.run()
+        {'rows': 120000, 'inserted': 119800, 'rejected': 200, 'seconds': 96.3, 'rows/sec': 1246.1}
+    """
+    def __init__(self, filepath, workers=4, chunk_size=2000, batch_size=100, checkpoint=None, \
+            reject_path="error.json", report_interval=10, dealer_factory=Dealer):
+        self.filepath = os.path.abspath(filepath)
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.checkpoint = checkpoint or self.filepath + ".checkpoint"
+        self.reject_path = reject_path
+        self.report_interval = report_interval
+        self.dealer_factory = dealer_factory
+
+        self.counters = {"rows": 0, "inserted": 0, "rejected": 0}
+        self.offset = 0
+        self._finished = {}
+        self._dealers = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+
+    def load_checkpoint(self):
+        """Return the offset and counters saved for the same file"""
+        if not os.path.exists(self.checkpoint):
+            return 0, {}
+        with open(self.checkpoint) as file:
+            state = json.load(file)
+        if state.get("path") != self.filepath or state["offset"] > os.path.getsize(self.filepath):
+            logger.warning(f"Checkpoint {self.checkpoint} doesn't match {self.filepath}, ignore it")
+            return 0, {}
+        return state["offset"], state.get("counters", {})
+
+
+    def save_checkpoint(self):
+        state = {"path": self.filepath, "offset": self.offset, "counters": self.counters, \
+            "updated": time.time()}
+        temp = self.checkpoint + ".tmp"
+        with open(temp, "w") as file:
+            json.dump(state, file)
+        os.replace(temp, self.checkpoint)
+
+
+    def chunks(self, offset):
+        """Yield (start offset, end offset, lines) from the offset"""
+        with open(self.filepath, "rb") as file:
+            file.seek(offset)
+            start, lines = offset, []
+            for line in file:
+                offset += len(line)
+                lines.append(line)
+                if len(lines) >= self.chunk_size:
+                    yield start, offset, lines
+                    start, lines = offset, []
+            if lines:
+                yield start, offset, lines
+
+
+    def _dealer(self):
+        dealer = getattr(self._local, "dealer", None)
+        if dealer is None:
+            dealer = self._local.dealer = self.dealer_factory()
+            with self._lock:
+                self._dealers.append(dealer)
+        return dealer
+
+
+    def split(self, lines):
+        """Parse the lines of a chunk and route the items to workers by title
+
+        Returns:
+            parts: list, the items of each worker
+            rejects: list, the lines aren't JSON objects
+        """
+        parts, rejects = [[] for _ in range(self.workers)], []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                item = None
+            if not isinstance(item, dict):
+                rejects.append({"line": line.decode("utf8", "replace"), "reason": "invalid json"})
+                continue
+            parts[hash(item.get("title")) % self.workers].append(item)
+        return parts, rejects
+
+
+    def replay_part(self, items, rejects=()):
+        """Validate and insert the items in the worker thread, return (inserted, rejected)"""
+        dealer = self._dealer()
+        valid, rejects = [], list(rejects)
+        for item in items:
+            reason = dealer.validate(item)
+            if reason is None:
+                valid.append(item)
+            else:
+                rejects.append(dict(item, reason=reason))
+
+        inserted = 0
+        for index in range(0, len(valid), self.batch_size):
+            count, failures = dealer.process_batch(valid[index: index + self.batch_size])
+            inserted += count
+            rejects.extend(dict(item, reason=f"insert failed at step <{step}>: {err}", \
+                step=step) for item, step, err in failures)
+
+        if rejects:
+            with self._lock:
+                with open(self.reject_path, "a") as file:
+                    for reject in rejects:
+                        file.write(json.dumps(reject, ensure_ascii=False) + "\n")
+        return inserted, len(rejects)
+
+
+    def _finish(self, start, end, inserted, rejected):
+        """Record a finished chunk, and move the checkpoint over the continuous finished chunks"""
+        self._finished[start] = (end, inserted, rejected)
+        moved = False
+        while self.offset in self._finished:
+            self.offset, inserted, rejected = self._finished.pop(self.offset)
+            self.counters["rows"] += inserted + rejected
+            self.counters["inserted"] += inserted
+            self.counters["rejected"] += rejected
+            moved = True
+        if moved:
+            self.save_checkpoint()
+
+
+    def report(self, rows, started):
+        elapsed = time.time() - started
+        size = os.path.getsize(self.filepath)
+        logger.info(f"Replayed {rows} rows, {rows / elapsed if elapsed else 0:.1f} rows/sec, " + 
+            f"offset {self.offset}/{size} ({self.offset / size * 100 if size else 100:.1f}%)")
+
+
+    def run(self, resume=True):
+        """Replay the file, return the counters with seconds and rows/sec of this run"""
+        if resume:
+            self.offset, counters = self.load_checkpoint()
+            self.counters.update(counters)
+            if self.offset:
+                logger.info(f"Resume {self.filepath} from offset {self.offset}")
+        else:
+            self.offset = 0
+
+        started = reported = time.time()
+        rows_before = self.counters["rows"]
+        # one single thread executor per worker, the queue of an executor keeps the order
+        executors = [ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"Replayer-{index}") \
+            for index in range(self.workers)]
+        pending, chunks = {}, {}
+        try:
+            for start, end, lines in self.chunks(self.offset):
+                parts, rejects = self.split(lines)
+                # chunk start maps with [end, unfinished parts, inserted, rejected]
+                chunks[start] = [end, 0, 0, 0]
+                for index, part in enumerate(parts):
+                    if part or (index == 0 and rejects):
+                        future = executors[index].submit(self.replay_part, part, \
+                            rejects if index == 0 else ())
+                        pending[future] = start
+                        chunks[start][1] += 1
+                if not chunks[start][1]:
+                    self._finish(start, chunks.pop(start)[0], 0, 0)
+
+                # keep a bounded number of chunks in memory
+                while len(chunks) >= self.workers * 2:
+                    self._collect(pending, chunks, FIRST_COMPLETED)
+                if time.time() - reported >= self.report_interval:
+                    self.report(self.counters["rows"] - rows_before, started)
+                    reported = time.time()
+            while pending:
+                self._collect(pending, chunks, ALL_COMPLETED)
+        finally:
+            for executor in executors:
+                executor.shutdown(wait=True, cancel_futures=True)
+            for dealer in self._dealers:
+                dealer.close()
+            self._dealers = []
+
+        seconds = time.time() - started
+        rows = self.counters["rows"] - rows_before
+        self.report(rows, started)
+        return dict(self.counters, seconds=round(seconds, 3), \
+            **{"rows/sec": round(rows / seconds, 1) if seconds else 0.0})
+
+
+    def _collect(self, pending, chunks, return_when):
+        done, _ = wait(pending, return_when=return_when)
+        for future in done:
+            start = pending.pop(future)
+            # a failed chunk stops the checkpoint, and the replay resumes from it next time
+            inserted, rejected = future.result()
+            chunk = chunks[start]
+            chunk[1] -= 1
+            chunk[2] += inserted
+            chunk[3] += rejected
+            if not chunk[1]:
+                del chunks[start]
+                self._finish(start, chunk[0], chunk[2], chunk[3])
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay the error file written by pipelines")
+    parser.add_argument("filepath", nargs="?", default="./err.txt", help="JSON lines error file")
+    parser.add_argument("--workers", type=int, default=4, help="worker threads and connections")
+    parser.add_argument("--chunk-size", type=int, default=2000, help="lines per chunk")
+    parser.add_argument("--batch-size", type=int, default=100, help="items per transaction")
+    parser.add_argument("--checkpoint", default=None, help="checkpoint file")
+    parser.add_argument("--rejects", default="error.json", help="invalid items file")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint")
+    args = parser.parse_args(argv)
+
+    replayer = Replayer(args.filepath, workers=args.workers, chunk_size=args.chunk_size, \
+        batch_size=args.batch_size, checkpoint=args.checkpoint, reject_path=args.rejects)
+    print(replayer.run(resume=not args.restart))
+    return 0
 
 
 if __name__ == "__main__":
-    # from DouBan.utils.insert_error_data import * 
-
-    dealer = Dealer()
-    # logger = logging.getLogger("StreamLogger")
-    data = dealer.get_data(pd.read_json, "./err.txt", lines=True)
-
-    for _, row in data.iterrows():
-        # import ipdb; ipdb.set_trace()
-        item = row.to_dict()
-        query = dealer.process_item(item)
-
-    # close connection
-    dealer.close()
\ No newline at end of file
+    sys.exit(main())
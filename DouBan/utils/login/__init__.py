@@ -27,13 +27,17 @@ def extract_info(filepath=None, sep=" "):
     with open(filepath, "r") as file:
         file.readline()
         for line in file.readlines():
-            data = line.split(sep)
+            data = line.strip().split(sep)
             user = data[0]
             passwd = data[1]
             yield {"name": user, "passwd": passwd}
 
 
-def generate_cookie(name, passwd, url=None, target="douban"):
+def generate_cookie(name, passwd, url=None, target="douban", wait_captcha=True):
+    """登录并返回 cookie 字典
+
+    需要验证码时，wait_captcha 为 True 则每隔 300 秒重新尝试，否则返回 None
+    """
     if url is None:
         if target.lower() == "douban":
             url = douban_url
@@ -48,12 +52,14 @@ def generate_cookie(name, passwd, url=None, target="douban"):
             cookies = session.cookies.get_dict()
             return cookies
         elif response.json()["status"] == "failed":
+            if not wait_captcha:
+                return None
             while response.json()["status"] == "failed" and response.json()["message"] == "captcha_required":
                 time.sleep(300)
                 response = session.post(url, data=payload, headers=headers)
-                # TODO: 需要后续根据实际情况判断，是否需要仅提取其中的字典信息
-                # cookies = session.cookies.get_dict()
-                return cookies
+            if response.json()["status"] == "success":
+                return session.cookies.get_dict()
+            return None
         else:
             raise ConnectionError("Can't login web")
 
@@ -66,6 +72,9 @@ def douban_cookie(filepath=None):
         yield generate_cookie(**item)
 
 
+from ._pool import *
+
+
 if __name__ == "__main__":
     mv_headers = headers.copy()
     del mv_headers["Origin"]
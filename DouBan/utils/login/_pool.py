@@ -0,0 +1,175 @@
+#-*-coding:utf8-*-
+from __future__ import absolute_import
+import json
+import time
+import logging
+from collections import deque
+
+from ..exceptions import InappropriateArgument
+
+
+__all__ = ["CookiePool", "RedisCookieStore"]
+
+
+class RedisCookieStore:
+    """Redis 哈希表保存登录 cookie，field 是账号，value 是 {"cookies": ..., "expires": ...}
+
+    爬虫重启或者多个进程共用账号时不需要重新登录
+    """
+    def __init__(self, connection, key="douban:cookies"):
+        self.connection = connection
+        self.key = key
+
+
+    def load(self):
+        result = {}
+        for name, value in self.connection.hgetall(self.key).items():
+            name = name.decode("utf8") if isinstance(name, bytes) else name
+            result[name] = json.loads(value)
+        return result
+
+
+    def save(self, name, cookies, expires):
+        self.connection.hset(self.key, name, json.dumps({"cookies": cookies, "expires": expires}))
+
+
+    def delete(self, name):
+        self.connection.hdel(self.key, name)
+
+
+
+class CookiePool:
+    """登录 cookie 池
+
+    每个账号登录一次，cookie 在 ttl 秒之后过期。get 只从内存中选择有效的 cookie，不会登录也不会
+    等待；需要登录的账号由 pending 给出，调用方在后台调用 login 之后通过 put 加入
+
+    账号被豆瓣要求重新登录时调用 retire，cookie 作废并在 retire_cooldown 秒之后重新登录；
+    登录失败(例如需要验证码)的账号在 login_cooldown 秒之后再次尝试
+
+    Args:
+    ---------
+    accounts: [{"name": ..., "passwd": ...}, ...]
+    ttl: cookie 有效秒数
+    strategy: round-robin 轮流使用，lru 使用最久没有使用的 cookie
+    login: 登录函数，参数为 name、passwd，返回 cookie 字典，默认使用 generate_cookie
+    store: RedisCookieStore 对象，None 表示只保存在内存中
+    """
+    strategies = ("round-robin", "lru")
+    logger = logging.getLogger(__name__ + ".CookiePool")
+
+    def __init__(self, accounts, ttl=12 * 3600, strategy="round-robin", login=None, store=None, \
+            login_cooldown=300, retire_cooldown=60):
+        if strategy not in self.strategies:
+            raise InappropriateArgument(f"cookie 选择策略不正确: {strategy}")
+
+        self.accounts = {account["name"]: account for account in accounts}
+        self.ttl = ttl
+        self.strategy = strategy
+        self.store = store
+        self.login_cooldown = login_cooldown
+        self.retire_cooldown = retire_cooldown
+        self._login = login
+
+        # name -> {"cookies", "expires", "used", "uses"}
+        self.cookies = {}
+        # name -> 可以再次登录的时间
+        self.blocked = {}
+        self._order = deque(self.accounts)
+        self.counters = {"logins": 0, "login_failures": 0, "retired": 0, "expired": 0}
+
+        if store is not None:
+            now = time.time()
+            for name, value in store.load().items():
+                if name in self.accounts and value["expires"] > now:
+                    self.cookies[name] = {"cookies": value["cookies"], \
+                        "expires": value["expires"], "used": 0.0, "uses": 0}
+
+
+    def get(self):
+        """选择一个有效的 cookie，返回 (账号, cookie 字典)，没有时返回 None"""
+        self.expire()
+        if not self.cookies:
+            return None
+
+        if self.strategy == "lru":
+            name = min(self.cookies, key=lambda i: self.cookies[i]["used"])
+        else:
+            for _ in range(len(self._order)):
+                name = self._order[0]
+                self._order.rotate(-1)
+                if name in self.cookies:
+                    break
+
+        entry = self.cookies[name]
+        entry["used"] = time.time()
+        entry["uses"] += 1
+        return name, dict(entry["cookies"])
+
+
+    def put(self, name, cookies):
+        self.counters["logins"] += 1
+        expires = time.time() + self.ttl
+        self.cookies[name] = {"cookies": cookies, "expires": expires, "used": 0.0, "uses": 0}
+        self.blocked.pop(name, None)
+        if self.store is not None:
+            self.store.save(name, cookies, expires)
+
+
+    def retire(self, name):
+        """cookie 失效，等待重新登录"""
+        if self.cookies.pop(name, None) is None:
+            return
+        self.counters["retired"] += 1
+        self.blocked[name] = time.time() + self.retire_cooldown
+        if self.store is not None:
+            self.store.delete(name)
+        self.logger.info(f"账号 {name} 的 cookie 已失效")
+
+
+    def expire(self):
+        now = time.time()
+        for name in [i for i, entry in self.cookies.items() if entry["expires"] <= now]:
+            del self.cookies[name]
+            self.counters["expired"] += 1
+
+
+    def pending(self):
+        """需要登录的账号"""
+        self.expire()
+        now = time.time()
+        return [account for name, account in self.accounts.items() \
+                if name not in self.cookies and self.blocked.get(name, 0) <= now]
+
+
+    def login(self, account):
+        """登录一个账号，返回 cookie 字典，失败时返回 None
+
+        会阻塞(网络请求)，需要在后台线程中调用，结果在主线程中通过 put 或者 failed 记录
+        """
+        login = self._login
+        if login is None:
+            from . import generate_cookie
+            login = lambda name, passwd: generate_cookie(name, passwd, wait_captcha=False)
+
+        try:
+            return login(account["name"], account["passwd"]) or None
+        except Exception as err:
+            self.logger.warning(f"账号 {account['name']} 登录失败: {err}")
+            return None
+
+
+    def failed(self, name):
+        """登录失败，login_cooldown 秒之后再次尝试"""
+        self.counters["login_failures"] += 1
+        self.blocked[name] = time.time() + self.login_cooldown
+
+
+    @property
+    def stats(self):
+        return dict(self.counters, accounts=len(self.accounts), valid=len(self.cookies), \
+            blocked=sum(1 for i in self.blocked.values() if i > time.time()))
+
+
+    def __len__(self):
+        return len(self.cookies)
@@ -0,0 +1,8 @@
+#coding:utf8
+"""
+The script records counters and latency histograms, and renders them in Prometheus text format
+or JSON
+"""
+
+from ._registry import *
+from ._instruments import *
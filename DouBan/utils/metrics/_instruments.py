@@ -0,0 +1,85 @@
+#coding:utf8
+from __future__ import absolute_import
+import time
+import logging
+
+
+__all__ = ["instrument_sqlalchemy", "instrument_pymongo"]
+
+logger = logging.getLogger(__name__)
+
+# 已经注册的指标集合，同一个进程只注册一次
+_instrumented = {"sqlalchemy": None, "pymongo": None}
+
+
+def _operation(statement):
+    """SQL 语句的类型，例如 SELECT、INSERT"""
+    words = statement.lstrip().split(None, 1)
+    return words[0].upper() if words else "UNKNOWN"
+
+
+def instrument_sqlalchemy(registry):
+    """记录所有 SQLAlchemy Engine(包括 DataBaseManipulater)的数据库往返次数和耗时
+
+    指标: db_seconds{backend, operation}、db_errors_total{backend, operation}
+    """
+    if _instrumented["sqlalchemy"] is not None:
+        return False
+
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    seconds = registry.histogram("db_seconds", "数据库往返耗时", ["backend", "operation"])
+    errors = registry.counter("db_errors_total", "数据库错误次数", ["backend", "operation"])
+
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_start", []).append(time.perf_counter())
+
+    def after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("metrics_start")
+        if starts:
+            seconds.observe(conn.engine.name, _operation(statement), \
+                value=time.perf_counter() - starts.pop())
+
+    def failed(context):
+        starts = context.connection.info.get("metrics_start") if context.connection else None
+        if starts:
+            starts.pop()
+        errors.inc(context.engine.name if context.engine else "unknown", \
+            _operation(context.statement or ""))
+
+    event.listen(Engine, "before_cursor_execute", before)
+    event.listen(Engine, "after_cursor_execute", after)
+    event.listen(Engine, "handle_error", failed)
+    _instrumented["sqlalchemy"] = registry
+    return True
+
+
+def instrument_pymongo(registry):
+    """记录之后创建的 MongoClient 的命令次数和耗时
+
+    pymongo 的监听器只对注册之后创建的客户端生效，需要在 Pipeline 的 open_spider 之前调用
+    指标: db_seconds{backend="mongodb", operation}、db_errors_total
+    """
+    if _instrumented["pymongo"] is not None:
+        return False
+
+    from pymongo import monitoring
+
+    seconds = registry.histogram("db_seconds", "数据库往返耗时", ["backend", "operation"])
+    errors = registry.counter("db_errors_total", "数据库错误次数", ["backend", "operation"])
+
+    class CommandListener(monitoring.CommandListener):
+        def started(self, event):
+            pass
+
+        def succeeded(self, event):
+            seconds.observe("mongodb", event.command_name, value=event.duration_micros / 1e6)
+
+        def failed(self, event):
+            seconds.observe("mongodb", event.command_name, value=event.duration_micros / 1e6)
+            errors.inc("mongodb", event.command_name)
+
+    monitoring.register(CommandListener())
+    _instrumented["pymongo"] = registry
+    return True
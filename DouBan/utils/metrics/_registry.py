@@ -0,0 +1,204 @@
+#coding:utf8
+from __future__ import absolute_import
+import math
+import bisect
+import threading
+
+from ..exceptions import InappropriateArgument
+
+
+__all__ = ["Counter", "Gauge", "Histogram", "MetricsRegistry", "metrics"]
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self._lock = threading.Lock()
+
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise InappropriateArgument(f"{self.name} 需要标签 {self.labelnames}，获取 {labels}")
+        return tuple(str(i) for i in labels)
+
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            lines.extend(self._render(key, value))
+        return lines
+
+
+    def _render(self, key, value):
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"]
+
+
+    def to_dict(self):
+        with self._lock:
+            return [dict(zip(self.labelnames, key), value=self._export(value)) \
+                for key, value in sorted(self.values.items())]
+
+
+    def _export(self, value):
+        return value
+
+
+
+class Counter(_Metric):
+    """只增加的计数"""
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+
+class Gauge(_Metric):
+    """可以任意设置的数值"""
+    kind = "gauge"
+
+    def set(self, *labels, value):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = value
+
+
+
+class Histogram(_Metric):
+    """累计分布直方图，buckets 是各个区间的上限(秒)"""
+    kind = "histogram"
+    default_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=None):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets or self.default_buckets)) + (math.inf,)
+
+
+    def observe(self, *labels, value):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            counts[index] += 1
+            self.values[key] = (counts, total + value)
+
+
+    def _render(self, key, value):
+        counts, total = value
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append(f"{self.name}_bucket" +
+                f"{_labels(self.labelnames, key, [('le', _number(float(bound)))])} {cumulative}")
+        lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+        lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+    def _export(self, value):
+        counts, total = value
+        count = sum(counts)
+        return {"count": count, "sum": total, "mean": total / count if count else 0.0, \
+            "p50": self._quantile(counts, 0.5), "p99": self._quantile(counts, 0.99)}
+
+
+    def _quantile(self, counts, q):
+        """按照区间上限估计分位数，超过最大区间时返回最大区间的上限"""
+        count = sum(counts)
+        if not count:
+            return 0.0
+        rank, cumulative = q * count, 0
+        for bound, value in zip(self.buckets, counts):
+            cumulative += value
+            if cumulative >= rank:
+                return bound if bound != math.inf else self.buckets[-2]
+        return self.buckets[-2]
+
+
+
+class MetricsRegistry:
+    """指标集合
+
+    同名指标只创建一次，多次调用 counter、histogram 返回同一个对象
+
+    Examples:
+    >>> registry = MetricsRegistry(prefix="douban_")
+    >>> registry.histogram("callback_seconds", "回调耗时", ["callback"]).observe("detail_page", value=0.2)
+    >>> print(registry.render())
+    """
+    def __init__(self, prefix="douban_"):
+        self.prefix = prefix
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+
+    def _get(self, cls, name, documentation, labelnames, **kwargs):
+        name = self.prefix + name
+        with self._lock:
+            if name not in self.metrics:
+                self.metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            metric = self.metrics[name]
+        if not isinstance(metric, cls):
+            raise InappropriateArgument(f"指标 {name} 已经存在，类型为 {metric.kind}")
+        return metric
+
+
+    def counter(self, name, documentation="", labelnames=()):
+        return self._get(Counter, name, documentation, labelnames)
+
+
+    def gauge(self, name, documentation="", labelnames=()):
+        return self._get(Gauge, name, documentation, labelnames)
+
+
+    def histogram(self, name, documentation="", labelnames=(), buckets=None):
+        return self._get(Histogram, name, documentation, labelnames, buckets=buckets)
+
+
+    def render(self):
+        """Prometheus 文本格式"""
+        with self._lock:
+            metrics = sorted(self.metrics.items())
+        lines = []
+        for _, metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+    def to_dict(self):
+        with self._lock:
+            metrics = sorted(self.metrics.items())
+        return {name: {"type": metric.kind, "values": metric.to_dict()} for name, metric in metrics}
+
+
+
+# 进程内共享的默认指标集合
+metrics = MetricsRegistry()
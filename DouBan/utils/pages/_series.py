@@ -37,6 +37,10 @@ class Details:
     * extract_directors, 提取导演信息
     * extract_screenwriter, 提取编剧信息
     * extract_actors, 提取演员信息
+    ------单次解析----------
+    * extract, 一次遍历 div#info 得到标签和值的映射，返回包含所有详情字段的 __detail。上面
+        读取 div#info 的 extract_* 方法只解析 div#info 并读取单个字段，需要多个字段时使用
+        extract
 
     Properties:
     --------------
@@ -46,6 +50,11 @@ class Details:
     __people: 演职人员信息，id 演职人员 ID，name 演职人员姓名
     __episode: 剧集简介信息，sid 剧集 ID，episode 当前集数，title 当前剧集标题，
         origin_title 当前剧集原始标题，date 当前剧集播放日期，plot 当前剧集剧情简介
+    __segment: div#info 中以 <br> 分隔的一行信息，label 为标签名称(不含冒号)，tail 为标签
+        后的文本，nodes 为该行中标签之后的元素
+    __detail: 详情页所有字段，字段名称和 DouBanDetailItem 保持一致，另外 title 保存
+        __content_name，directors、screenwriters、actors 保存 __people 列表，
+        recommendation_item 保存 __recommendation_item 列表
     """
     __recommendation_item = namedtuple("recommendation_item", \
         ["id", "name"])
@@ -54,12 +63,228 @@ class Details:
     __people = namedtuple("worker", ["id", "name"])
     __episode = namedtuple("episode", ["sid", "episode", "title", "origin_title", \
         "date", "plot"])
+    __segment = namedtuple("segment", ["label", "tail", "nodes"])
+    __detail = namedtuple("detail", ["title", "nick_name", "rate", "rate_collection", \
+        "main_tag", "genres", "product_country", "language", "release_year", \
+        "release_date", "play_duration", "imdb_id", "tags", "directors", "screenwriters", \
+        "actors", "plot", "set_number", "cover", "official_site", "recommendation_type", \
+        "recommendation_item"])
     # import ipdb; ipdb.set_trace()
     logger = logging.getLogger(__name__ + ".Details")
     def __init__(self):
         pass
 
 
+    @classmethod
+    def extract(cls, response):
+        """解析详情页所有字段
+
+        div#info 只遍历一次，其他区域的字段各自只查询一次
+
+        Results:
+        ---------
+        result: __detail，包含详情页的所有字段
+        """
+        if response is None:
+            raise LostArgument("response is missing")
+
+        info = cls.parse_info(response)
+        result = cls.__detail(
+            title=cls.extract_title(response),
+            nick_name=cls._info_text(info, "又名"),
+            rate=cls.extract_rate(response),
+            rate_collection=cls.extract_rate_collections(response),
+            main_tag=cls.extract_main_tag(response),
+            genres=cls._info_genres(info),
+            product_country=cls._info_text(info, "制片国家/地区"),
+            language=cls._info_text(info, "语言"),
+            release_year=cls.extract_release_year(response),
+            release_date=cls._info_release_date(info),
+            play_duration=cls._info_play_duration(info),
+            imdb_id=cls._info_imdb_id(info),
+            tags=cls.extract_tags(response),
+            directors=cls._info_people(info, "导演", r"\d+"),
+            screenwriters=cls._info_people(info, "编剧", r"\d+"),
+            actors=cls._info_people(info, "主演", r"\/(\d{2,})\/"),
+            plot=cls.extract_plot(response),
+            set_number=cls._info_text(info, "集数", slash=False),
+            cover=cls.extract_cover_url(response),
+            official_site=cls._info_link(info, "官方小站"),
+            recommendation_type=cls.extract_recommendation_type(response),
+            recommendation_item=cls.extract_recommendation_item(response)
+        )
+        return result
+
+
+    @classmethod
+    def parse_info(cls, response):
+        """遍历一次 div#info
+
+        div#info 中每一行信息以 <br> 结束，一行的第一个 span.pl 是标签，标签可能直接是
+        div#info 的子元素(例如 "类型:")，也可能包含在一个 span 中(例如 导演、编剧、主演)。
+
+        Results:
+        ---------
+        result: dict，以标签名称(不含冒号)为 key，__segment 为 value
+        """
+        result = {}
+        elements = response.css("div#info")
+        if not elements:
+            return result
+
+        rows, row = [], []
+        for child in elements[0].root:
+            # 跳过注释等非元素节点
+            if not isinstance(child.tag, str):
+                continue
+            if child.tag == "br":
+                rows.append(row)
+                row = []
+            else:
+                row.append(child)
+        rows.append(row)
+
+        for row in rows:
+            for index, node in enumerate(row):
+                if "pl" in (node.get("class") or "").split():
+                    label, nodes = node, row[index + 1:]
+                    break
+                inner = node.find("span[@class='pl']")
+                if inner is not None:
+                    label = inner
+                    nodes = [i for i in node if i is not inner] + row[index + 1:]
+                    break
+            else:
+                continue
+
+            name = (label.text or "").strip().rstrip(":：").strip()
+            if name and name not in result:
+                result[name] = cls.__segment(label=name, tail=label.tail, nodes=nodes)
+        return result
+
+
+    @staticmethod
+    def _iter_nodes(segment, tag, **attrib):
+        """遍历一行信息中指定 tag 和属性的元素，包括子孙元素"""
+        for node in segment.nodes:
+            for element in node.iter(tag):
+                if all(element.get(key) == value for key, value in attrib.items()):
+                    yield element
+
+
+    @classmethod
+    def _info_text(cls, info, label, slash=True):
+        """标签之后的文本，slash 为 True 时将 " / " 调整为 "/" """
+        segment = info.get(label)
+        if segment is None or segment.tail is None:
+            return None
+
+        result = segment.tail.strip()
+        if slash:
+            result = result.replace(" / ", "/")
+        return result
+
+
+    @classmethod
+    def _info_link(cls, info, label):
+        """标签之后第一个链接"""
+        segment = info.get(label)
+        if segment is None:
+            return None
+        for element in cls._iter_nodes(segment, "a"):
+            return element.get("href")
+
+
+    @classmethod
+    def _info_genres(cls, info):
+        segment = info.get("类型")
+        if segment is None:
+            return None
+        return "/".join(i.text or "" for i in \
+            cls._iter_nodes(segment, "span", property="v:genre"))
+
+
+    @classmethod
+    def _info_release_date(cls, info):
+        """上映日期，以国家名称为 key，上映日期为 value
+
+        电影使用 "上映日期"，电视剧使用 "首播"
+        """
+        elements = []
+        for label in ("上映日期", "首播"):
+            if label in info:
+                elements.extend(i.text or "" for i in \
+                    cls._iter_nodes(info[label], "span", property="v:initialReleaseDate"))
+
+        result = {}
+        for index, element in enumerate(elements):
+            country = re.search("\((.*)\)", element)
+            date = re.search("([\d\-]+)", element)
+
+            if not country and not date:
+                continue
+            
+            value = date.group().strip() if date else element.strip()
+            # 如果没有对应的国家，直接使用 index 来替代
+            if country is None:
+                result[index] = value
+            elif country.group() in result:
+                key = f"{country.group(1).strip()}_{index}"
+                result[key] = value
+            else:
+                key = country.group(1).strip()
+                result[key] = value
+
+        return result
+
+
+    @classmethod
+    def _info_play_duration(cls, info):
+        """播放时长，电视剧为 "单集片长"，电影为 "片长" """
+        result = None
+        if "单集片长" in info:
+            result = info["单集片长"].tail
+
+        if "片长" in info:
+            runtime = next(cls._iter_nodes(info["片长"], "span", property="v:runtime"), None)
+            if runtime is not None:
+                result = runtime.text or ""
+                # 拼接数据值以及删除多余的空格
+                if runtime.tail:
+                    result += runtime.tail.replace(" / ", "/")
+            else:
+                result = info["片长"].tail
+
+        if result:
+            result = result.strip()
+        return result
+
+
+    @classmethod
+    def _info_imdb_id(cls, info):
+        """IMDB ID，旧页面为 "IMDb链接" 的链接文本，新页面为 "IMDb" 之后的文本"""
+        if "IMDb链接" in info:
+            for element in cls._iter_nodes(info["IMDb链接"], "a"):
+                return element.text
+        return cls._info_text(info, "IMDb")
+
+
+    @classmethod
+    def _info_people(cls, info, label, pattern):
+        """导演、编剧以及演员信息，返回 __people 列表"""
+        segment = info.get(label)
+        if segment is None:
+            return None
+
+        result = []
+        for element in cls._iter_nodes(segment, "a"):
+            name, id_ = element.text or "", element.get("href") or ""
+            matchobj = None if "search_text" in id_ else re.search(pattern, id_)
+            id_ = matchobj.group(matchobj.lastindex or 0).strip() if matchobj else None
+            result.append(cls.__people(id=id_, name=name.strip()))
+        return result
+
+
     @classmethod
     def extract_title(cls, response, origin_title=None):
         """解析响应页面的 title
@@ -75,7 +300,7 @@ class Details:
 
         """
         if response is None:
-            raise LostArgument(f"response is missing")
+            raise LostArgument("response is missing")
 
         title = response.css('h1 > span::text').extract_first()
 
@@ -144,10 +369,7 @@ class Details:
         
         如果存在多个类型，使用 slash 分隔
         """
-        if not response.css("div#info > span.pl").re("类型"):
-            return None
-        
-        return "/".join(response.css("span[property='v:genre']::text").extract())
+        return cls._info_genres(cls.parse_info(response))
 
 
     @classmethod
@@ -156,14 +378,7 @@ class Details:
 
         如果存在多个国家，使用 slash 分隔
         """
-        result = response.xpath(
-            "//div[@id='info']//span[text()='制片国家/地区:']/following-sibling::text()"
-        ).extract_first()
-
-        if result:
-            result = result.strip().replace(" / ", "/")
-        
-        return  result
+        return cls._info_text(cls.parse_info(response), "制片国家/地区")
 
 
     @classmethod
@@ -172,14 +387,7 @@ class Details:
 
         存在多个语言时，使用 slash 分隔
         """
-        result = response.xpath(
-            "//div[@id='info']//span[text()='语言:']/following-sibling::text()"
-        ).extract_first()
-        
-        if result:
-            result = result.strip().replace(" / ", "/")
-        
-        return result
+        return cls._info_text(cls.parse_info(response), "语言")
 
 
     @classmethod
@@ -199,7 +407,7 @@ class Details:
 
 
     @classmethod
-    def extract_release_date(csl, response):
+    def extract_release_date(cls, response):
         """提取播放日期
 
         提取具体的播放日期信息，信息可能分为不同国家地区或者版本信息，而存在差异。如果内容在一
@@ -209,59 +417,17 @@ class Details:
         ---------
         result: dict, 以国家名称为 key，上映日期为 value
         """
-        elements = response.css("span[property='v:initialReleaseDate']::text").extract()
-        result = {}
-        for index, element in enumerate(elements):
-            country = re.search("\((.*)\)", element)
-            date = re.search("([\d\-]+)", element)
-
-            if not country and not date:
-                continue
-            
-            value = date.group().strip()
-            # 如果没有对应的国家，直接使用 index 来替代
-            if country is None:
-                result[index] = value
-            elif country.group() in result:
-                key = f"{country.group(1).strip()}_{index}"
-                result[key] = value
-            else:
-                key = country.group(1).strip()
-                result[key] = value
-
-        return result
+        return cls._info_release_date(cls.parse_info(response))
 
 
     @classmethod
     def extract_play_duration(cls, response):
         """提取影片播放时长信息
         
-        可能不同时间、国家地区以及版本差异有不同时间长度，使用 slash 分隔。如果是处理电视剧的
-        信息，那么提取的方式是筛选出"单集片长:" 的兄弟元素信息，否则就是可以直接提取到 "片
-        长:" 元素的兄弟元素 
+        可能不同时间、国家地区以及版本差异有不同时间长度，使用 slash 分隔。电视剧提取 "单集片
+        长:" 之后的信息，电影提取 "片长:" 之后的信息
         """
-        result = None
-        if response.css("div#info > span").re("单集片长:"):
-            result = response.xpath(
-                "//div[@id='info']//span[text()='单集片长:']/following-sibling::text()"
-            ).extract_first()
-
-        if response.css("div#info > span").re("(?<!单集)片长:"):
-            result = response.css(
-                    "div#info > span[property='v:runtime']::text"
-                ).extract_first()
-
-            additional = response.xpath(
-                    "//span[@property='v:runtime']/following-sibling::text()"
-                ).extract_first()
-            
-            # 拼接数据值以及删除多余的空格
-            if additional:
-                result += additional.replace(" / ", "/")
-
-        if result:
-            result = result.strip()
-        return result
+        return cls._info_play_duration(cls.parse_info(response))
 
 
     @classmethod
@@ -270,29 +436,22 @@ class Details:
         
         可能有多个别名，使用 slash 分隔。如果有其他提取到的别名信息直接添加到别名中
         """
-        result = response.xpath(
-                "//div[@id='info']//span[text()='又名:']/following-sibling::text()"
-            ).extract_first()
+        result = cls._info_text(cls.parse_info(response), "又名")
 
         if not result and optional_name is None:
             return None
         elif result:
-            result = result.strip()
             if optional_name is not None:
-                return result.replace(" / ", "/") + f"/{optional_name}"
+                return result + f"/{optional_name}"
             else:
-                return result.replace(" / ", "/")
+                return result
         
 
     @classmethod
     def extract_imdb_id(cls, response):
         """提取 IMDB 的 ID
         """
-        result = response.xpath(
-                "//div[@id='info']/span[text()='IMDb链接:']/following::a/text()"
-            ).extract_first() 
-        
-        return result
+        return cls._info_imdb_id(cls.parse_info(response))
 
 
     @classmethod
@@ -341,81 +500,21 @@ class Details:
         提取导演以及豆瓣的 ID 信息——以导演名称和 ID 构成的 key-value，结果保存为 json 处
         理后的字符串
         """
-        # 如果类型是导演存在，再查询到导演信息
-        # if Details.check_attribute(response, name="导演", \
-        #     query="div#info > span:nth-of-type(1) > span::text"):
-        if response.xpath(
-                "//div[@id='info']/span/span[contains(text(),'导演')]/text()"
-            ).extract_first():
-            result = []
-
-            # 遍历导演以及豆瓣导演 ID
-            names = response.css(
-                    "div#info > span:nth-of-type(1) > span.attrs > a::text"
-                ).extract()
-            ids_  = response.css(
-                    "div#info > span:nth-of-type(1) > span.attrs > a::attr(href)"
-                ).extract()
-            for name, id_ in zip(names, ids_):
-                id_ = None if "search_text" in id_ else re.search(r"\d+", id_).group().strip()
-                result.append(cls.__people(id=id_, name=name.strip()))
-
-            return result
+        return cls._info_people(cls.parse_info(response), "导演", r"\d+")
 
 
     @classmethod
     def extract_screenwriter(cls, response):
         """提取页面的编剧信息
         """
-        # 如果类型是编剧存在，再查询编剧信息
-        # if Details.check_attribute(response, name="编剧", \
-        #     query="div#info > span:nth-of-type(2) > span::text"):
-        #     result = []
-        if response.xpath(
-                "//div[@id='info']/span/span[contains(text(),'编剧')]/text()"
-            ).extract_first():
-
-            names = response.xpath(
-                    "//div[@id='info']//span[contains(text(),'编剧')]/parent::span/span[@class='attrs']/a/text()"
-                ).extract()
-
-            ids_ = response.xpath(
-                "//div[@id='info']//span[contains(text(),'编剧')]/parent::span/span[@class='attrs']/a/attribute::href"
-            ).extract()
-
-            result = []
-            for name, id_ in zip(names, ids_):
-                id_ = None if "search_text" in id_ else re.search(r"\d+", id_).group().strip()
-                result.append(cls.__people(name=name.strip(), id=id_))
-
-            return result
+        return cls._info_people(cls.parse_info(response), "编剧", r"\d+")
 
 
     @classmethod
     def extract_actors(cls, response):
         """提取演员信息
         """
-        # 如果类型是演员存在，再查询演员信息
-        # if Details.check_attribute(response, name="主演", \
-        #     query="div#info > span:nth-of-type(3) > span::text"):
-        if response.xpath(
-                "//div[@id='info']/span[@class='actor']/span[contains(text(),'主演')]/text()"
-            ).extract_first():
-            result = []
-
-            names = response.xpath(
-                    "//div[@id='info']/span[@class='actor']/span[@class='attrs']/a/text()"
-                ).extract()
-
-            ids = response.xpath(
-                "//div[@id='info']/span[@class='actor']/span[@class='attrs']/a/attribute::href"
-            ).extract()
-
-            for name, id_ in zip(names, ids):
-                id_ = None if "search_text" in id_ else re.search(r"\/(\d{2,})\/", id_).group(1).strip()
-                result.append(cls.__people(name=name.strip(), id=id_))
-
-            return result
+        return cls._info_people(cls.parse_info(response), "主演", r"\/(\d{2,})\/")
 
     @classmethod
     def extract_recommendation_type(cls, response):
@@ -564,10 +663,8 @@ class Details:
         """提取豆瓣影视专题网站链接
 
         """
-        return response.xpath(
-            "//div[@id='info']/span[contains(text(), '官方小站')]/following::a/attribute::href"
-        ).extract_first()
-        
+        return cls._info_link(cls.parse_info(response), "官方小站")
+
 
 
 class Workers:
@@ -858,7 +955,7 @@ class Comments:
 
 
     @classmethod
-    def extract_reviews(cls, response, another=True):
+    def extract_reviews(cls, response, another=False):
         """
         提取长评论信息
 
@@ -870,7 +967,8 @@ class Comments:
         Args:
         --------
         another: 布尔值，如果是使用 request_html 解析得到的结果，response 对象方法存在差异，
-            requests_html 调用的是 html 模块下 xpath 或者 pq 方法处理
+            requests_html 调用的是 html 模块下 xpath 或者 pq 方法处理。默认为 False，直接解
+            析 Scrapy 的 response
 
         Results:
         ------------
@@ -947,53 +1045,45 @@ class Comments:
                     next_ = False
                 return  result, next_
         else:
-            elements = response.css("div.review-list > div")
+            elements = response.xpath("//div[contains(@class, 'review-list')]/div[@data-cid]")
 
             if elements:
                 result = []
                 for element in elements:
-                    uname = element.css("header.main-hd > a.name::text") \
-                        .extract_first().strip()
-                    uid = element.css("header.main-hd > a.name::attr(href)") \
-                        .extract_first().strip() 
-
-                    upic = element.css("header.main-hd > a.avator > img::attr(src)") \
-                        .extract_first().strip()
-
-                    date = element.css("header.main-hd > span.main-meta::text") \
-                        .extract_first().strip()
-                    
-                    comment_id = element.css("::attr(data-cid)") \
-                        .extract_first().strip()
-                    
-                    rate = element.css(
-                            "header.main-hd > span.main-title-rating::attr(class)"
-                        ).re("\d+")
-            
-                    # 如果没有评分值，则返回 None
-                    rate = None if not rate else int(float(rate[0].strip())) // 10
-
-                    content = "".join(i.strip() for i in element.css(
-                            "div.main-bd > div.review-short > div.short-content::text"
+                    comment_id = element.attrib["data-cid"].strip()
+                    uname = cls.scrapy_parse(element, \
+                        "./div/header[@class='main-hd']/a[@class='name']/text()")
+                    uid = cls.scrapy_parse(element, \
+                        "./div/header[@class='main-hd']/a[@class='name']/attribute::href")
+                    upic = cls.scrapy_parse(element, \
+                        "./div/header[@class='main-hd']/a[@class='avator']/img/attribute::src")
+                    date = cls.scrapy_parse(element, \
+                        "./div/header[@class='main-hd']/span[@class='main-meta']/text()")
+                    rate = cls.scrapy_parse(element, \
+                        "./div/header[@class='main-hd']/span[contains(attribute::class, 'main-title-rating')]/attribute::class")
+
+                    rate = int(re.search("(\d+)", rate).group(1)) if rate else 0
+
+                    content = "".join(re.sub("^\)|\($", "", i).strip() for i in element.xpath(
+                            "./div/div[@class='main-bd']/div[@class='review-short']/div/text()"
                         ).extract())
+                    title = cls.scrapy_parse(element, \
+                        "./div/div[@class='main-bd']/h2/a/text()")
+                    content_url = cls.scrapy_parse(element, \
+                        "./div/div[@class='main-bd']/h2/a/attribute::href")
 
-                    title = element.css("div.main-bd > h2 > a::text").extract_first().strip()
-                    content_url = element.css("div.main-bd > h2 > a::attr(href)") \
-                        .extract_first().strip()
-                    
-                    thumb = element.css("div.main-bd > div.action a[title='有用'] > span::text") \
-                        .extract_first().strip()
-
-                    thumb = 0 if not thumb else int(float(thumb.strip()))
-
-                    down = element.css("div.main-bd > div.action a[title='没用'] > span::text") \
-                        .extract_first().strip()
+                    thumb = cls.scrapy_parse(element, \
+                        "./div/div[@class='main-bd']/div[@class='action']//span[contains(attribute::id, 'useful_count')]/text()")
+                    thumb = int(thumb) if thumb else 0
 
-                    down = 0 if not down else int(float(down.strip()))
+                    down = cls.scrapy_parse(element, \
+                        "./div/div[@class='main-bd']/div[@class='action']//span[contains(attribute::id, 'useless_count')]/text()")
+                    down = int(down) if down else 0
 
-                    reply = element.css("div.main-bd > div.action a.reply::text").re("\d+")
-
-                    reply = 0 if not reply else int(float(reply[0].strip()))
+                    reply = cls.scrapy_parse(element, \
+                        "./div/div[@class='main-bd']/div[@class='action']/a[contains(attribute::class, 'reply')]/text()")
+                    reply = re.search("(\d+)", reply) if reply else None
+                    reply = int(reply.group(1)) if reply else 0
 
                     result.append(cls.__review(uname=uname, uid=uid, upic=upic, \
                         date=date, comment_id=comment_id, rate=rate, content=content,
@@ -1001,9 +1091,8 @@ class Comments:
                         reply=reply))
 
                 # 如果有下一页需要和结果一起传出
-                has_next = response.css(
-                    "div#wrapper div#content div.article > div.paginator > span.next >a::attr(href)"
-                    ).extract_first()
+                has_next = response.css("span.next > link::attr(href)").extract_first() or \
+                    response.css("span.next > a::attr(href)").extract_first()
 
                 if has_next:
                     next_ = re.sub("^(.*reviews).*$", 
@@ -1033,6 +1122,19 @@ class Comments:
             raise ValueConsistenceError(f"can't get review: {response.url}")
 
 
+    @classmethod
+    def scrapy_parse(cls, element, query):
+        """解析 Scrapy Selector 获得数据
+
+        和 requests_html_parse 一样使用 xpath 的方式解析数据，没有数据时返回 None
+        """
+        result = element.xpath(query).extract_first()
+
+        if result:
+            result = result.strip()
+        return result
+
+
     @classmethod
     def requests_html_parse(cls, element, query):
         """解析 requests_html 包获得数据
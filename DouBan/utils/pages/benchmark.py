@@ -0,0 +1,307 @@
+#coding:utf8
+"""
+页面解析基准测试:
+1. record 请求页面并保存到语料目录，目录中的 index.json 记录每个文件对应的 URL
+2. run 读取语料目录，将页面构造为 HtmlResponse，按照 URL 匹配解析方法后重复解析，统计每个
+    解析方法的 pages/sec、p50/p99 耗时以及峰值内存(RSS)
+3. run 可以通过 --revision、--baseline 指定 git 版本，加载对应版本的 `_series.py` 在同一批
+    页面上对比，解析变慢超过 --threshold 时返回非零状态
+
+每个解析方法在独立的子进程中运行，峰值内存互不影响。使用示例:
+    python -m DouBan.utils.pages.benchmark record corpus/ https://movie.douban.com/subject/26794435/
+    python -m DouBan.utils.pages.benchmark run corpus/ --repeat 5 --baseline HEAD~1
+
+DouBan/utils/pages/corpus 中是一个合成的详情页，可以直接离线运行；对比解析速度应当使用 record
+保存的真实页面
+"""
+from __future__ import absolute_import
+
+import os
+import re
+import sys
+import json
+import time
+import types
+import hashlib
+import inspect
+import argparse
+import resource
+import subprocess
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+
+__all__ = ["EXTRACTORS", "load_corpus", "load_revision", "parse_details", "benchmark", \
+    "compare", "record"]
+
+INDEX = "index.json"
+
+# 没有单次解析方法的版本，按照 SeriesSpider.detail_page 的顺序逐个调用
+DETAIL_METHODS = ["extract_title", "extract_nick_name", "extract_rate", \
+    "extract_rate_collections", "extract_main_tag", "extract_genres", \
+    "extract_product_country", "extract_language", "extract_release_year", \
+    "extract_release_date", "extract_play_duration", "extract_imdb_id", "extract_tags", \
+    "extract_directors", "extract_screenwriter", "extract_actors", "extract_plot", \
+    "extract_cover_url", "extract_official_web", "extract_recommendation_type", \
+    "extract_recommendation_item"]
+
+
+def parse_details(module, response):
+    """解析一个详情页的所有字段"""
+    details = module.Details
+    if hasattr(details, "extract"):
+        return details.extract(response)
+    return [getattr(details, method)(response) for method in DETAIL_METHODS]
+
+
+def parse_reviews(module, response):
+    """解析长评论列表，只使用 Scrapy response 解析，不请求完整评论"""
+    method = module.Comments.extract_reviews
+    if "another" in inspect.signature(method).parameters:
+        return method(response, another=False)
+    return method(response)
+
+
+# 解析方法名称、匹配的页面 URL 以及调用方式，调用参数为 `_series` 模块和 response
+_extractor = namedtuple("extractor", ["name", "pattern", "parse"])
+EXTRACTORS = [
+    _extractor("Details.extract", r"/subject/\d+/?$", parse_details),
+    # 只读取 div#info 中单个字段的方法，不能因为 extract 的改动变慢
+    _extractor("Details.extract_genres", r"/subject/\d+/?$",
+        lambda module, response: module.Details.extract_genres(response)),
+    _extractor("Details.extract_actors", r"/subject/\d+/?$",
+        lambda module, response: module.Details.extract_actors(response)),
+    _extractor("Details.extract_episode_info", r"/subject/\d+/episode/\d+",
+        lambda module, response: module.Details.extract_episode_info(response)),
+    _extractor("Workers.extract_basic", r"/subject/\d+/celebrities",
+        lambda module, response: module.Workers.extract_basic(response)),
+    _extractor("Workers.extract_duties", r"/subject/\d+/celebrities",
+        lambda module, response: module.Workers.extract_duties(response)),
+    _extractor("Pictures.extract_poster", r"/photos\?type=R",
+        lambda module, response: module.Pictures.extract_poster(response)),
+    _extractor("Pictures.extract_wallpaper_and_series_still", r"/photos\?type=[SW]",
+        lambda module, response: module.Pictures.extract_wallpaper_and_series_still(response)),
+    _extractor("Comments.extract_short_comment", r"/comments\?",
+        lambda module, response: module.Comments.extract_short_comment(response)),
+    _extractor("Comments.extract_reviews", r"/subject/\d+/reviews", parse_reviews),
+    _extractor("Comments.extract_review_content", r"/review/\d+",
+        lambda module, response: module.Comments.extract_review_content(response)),
+    _extractor("People.extract_bio_informaton", r"/celebrity/\d+/?$",
+        lambda module, response: module.People.extract_bio_informaton(response)),
+    _extractor("Awards.extract_awards", r"/subject/\d+/awards",
+        lambda module, response: module.Awards.extract_awards(response)),
+]
+
+
+def load_corpus(path):
+    """读取语料目录，返回 (url, body) 列表"""
+    with open(os.path.join(path, INDEX), encoding="utf8") as file:
+        index = json.load(file)
+
+    result = []
+    for entry in index:
+        with open(os.path.join(path, entry["file"]), "rb") as file:
+            result.append((entry["url"], file.read()))
+    return result
+
+
+def record(path, urls, cookie=None, delay=1):
+    """请求页面并保存到语料目录，已经存在的 URL 会被覆盖"""
+    import requests
+
+    os.makedirs(path, exist_ok=True)
+    index_path = os.path.join(path, INDEX)
+    index = {}
+    if os.path.exists(index_path):
+        with open(index_path, encoding="utf8") as file:
+            index = {entry["url"]: entry for entry in json.load(file)}
+
+    headers = {"User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_2) " + \
+        "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/79.0.3945.117 Safari/537.36"}
+    if cookie:
+        headers["Cookie"] = cookie
+
+    for url in urls:
+        response = requests.get(url, headers=headers, timeout=10)
+        if response.status_code != 200:
+            print(f"跳过 {url}: {response.status_code}")
+            continue
+
+        name = hashlib.sha1(url.encode("utf8")).hexdigest()[:16] + ".html"
+        with open(os.path.join(path, name), "wb") as file:
+            file.write(response.content)
+        index[url] = {"file": name, "url": url}
+        print(f"保存 {url} -> {name}")
+        time.sleep(delay)
+
+    with open(index_path, "w", encoding="utf8") as file:
+        json.dump(list(index.values()), file, ensure_ascii=False, indent=2)
+
+
+def load_revision(revision):
+    """加载指定 git 版本的 `_series.py` 为独立模块，revision 为 None 时使用当前代码"""
+    if revision is None:
+        from DouBan.utils.pages import _series
+        return _series
+
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)))))
+    source = subprocess.check_output(
+        ["git", "show", f"{revision}:DouBan/utils/pages/_series.py"], cwd=root
+    )
+    module = types.ModuleType(f"DouBan.utils.pages._series_{revision}")
+    module.__package__ = "DouBan.utils.pages"
+    exec(compile(source, f"{revision}:_series.py", "exec"), module.__dict__)
+    return module
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(percent / 100 * len(values))) - 1))
+    return values[index]
+
+
+def _run(name, path, revision, repeat):
+    """在子进程中运行一个解析方法，返回统计结果"""
+    from scrapy.http import HtmlResponse
+
+    extractor = next(i for i in EXTRACTORS if i.name == name)
+    module = load_revision(revision)
+    pages = [(url, body) for url, body in load_corpus(path) \
+                if re.search(extractor.pattern, url)]
+    if not pages:
+        return None
+
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    latencies, errors = [], 0
+    for _ in range(repeat):
+        for url, body in pages:
+            # 每次解析都重新构造 response，HTML 解析的时间也包含在内
+            response = HtmlResponse(url, body=body, encoding="utf-8")
+            start = time.perf_counter()
+            try:
+                result = extractor.parse(module, response)
+                # 生成器需要迭代才会执行解析
+                if inspect.isgenerator(result):
+                    result = list(result)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    total = sum(latencies)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "pages": len(pages),
+        "runs": len(latencies),
+        "errors": errors,
+        "pages_per_sec": len(latencies) / total if total else 0.0,
+        "p50_ms": _percentile(latencies, 50) * 1000,
+        "p99_ms": _percentile(latencies, 99) * 1000,
+        # Linux 下 ru_maxrss 单位为 KB
+        "peak_rss_mb": peak_rss / 1024,
+        "rss_delta_mb": (peak_rss - start_rss) / 1024,
+    }
+
+
+def benchmark(path, revision=None, repeat=5, names=None):
+    """运行所有解析方法，返回 {解析方法名称: 统计结果}
+
+    没有匹配页面的解析方法不会出现在结果中
+    """
+    context = multiprocessing.get_context("spawn")
+    result = {}
+    for extractor in EXTRACTORS:
+        if names and extractor.name not in names:
+            continue
+        # 每个解析方法使用新的进程，保证峰值内存只来自该解析方法
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            stats = executor.submit(_run, extractor.name, path, revision, repeat).result()
+        if stats is not None:
+            result[extractor.name] = stats
+    return result
+
+
+def compare(current, baseline, threshold=0.1):
+    """对比两个版本的结果，返回 p50 耗时增加超过 threshold 的解析方法"""
+    result = []
+    for name, stats in current.items():
+        if name not in baseline or not baseline[name]["p50_ms"]:
+            continue
+        change = stats["p50_ms"] / baseline[name]["p50_ms"] - 1
+        if change > threshold:
+            result.append((name, change))
+    return result
+
+
+def _report(title, results, baseline=None):
+    print(title)
+    print(f"{'extractor':<46}{'pages':>7}{'pages/s':>10}{'p50 ms':>9}{'p99 ms':>9}" + \
+        f"{'rss MB':>9}{'errors':>8}{'vs base':>9}")
+    for name, stats in results.items():
+        change = ""
+        if baseline and name in baseline and baseline[name]["p50_ms"]:
+            change = f"{(stats['p50_ms'] / baseline[name]['p50_ms'] - 1) * 100:+.1f}%"
+        print(f"{name:<46}{stats['pages']:>7}{stats['pages_per_sec']:>10.1f}" + \
+            f"{stats['p50_ms']:>9.3f}{stats['p99_ms']:>9.3f}{stats['peak_rss_mb']:>9.1f}" + \
+            f"{stats['errors']:>8}{change:>9}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="页面解析基准测试")
+    commands = parser.add_subparsers(dest="command")
+
+    recorder = commands.add_parser("record", help="请求页面并保存到语料目录")
+    recorder.add_argument("path", help="语料目录")
+    recorder.add_argument("urls", nargs="+", help="页面 URL")
+    recorder.add_argument("--cookie", default=None, help="请求使用的 Cookie")
+    recorder.add_argument("--delay", type=float, default=1, help="请求间隔，单位为秒")
+
+    runner = commands.add_parser("run", help="运行基准测试")
+    runner.add_argument("path", help="语料目录")
+    runner.add_argument("--repeat", type=int, default=5, help="重复解析次数")
+    runner.add_argument("--revision", default=None, help="测试的 git 版本，默认为当前代码")
+    runner.add_argument("--baseline", default=None, help="对比的 git 版本")
+    runner.add_argument("--threshold", type=float, default=0.1, \
+        help="p50 耗时增加超过该比例时返回非零状态")
+    runner.add_argument("--extractor", action="append", default=None, \
+        help="只运行指定的解析方法，可以重复使用")
+    runner.add_argument("--json", default=None, help="将结果保存为 JSON 文件")
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        record(args.path, args.urls, args.cookie, args.delay)
+        return 0
+    elif args.command != "run":
+        parser.print_help()
+        return 1
+
+    current = benchmark(args.path, args.revision, args.repeat, args.extractor)
+    if not current:
+        print(f"语料目录中没有可以解析的页面: {args.path}")
+        return 1
+
+    baseline = None
+    if args.baseline:
+        baseline = benchmark(args.path, args.baseline, args.repeat, args.extractor)
+
+    _report(f"revision: {args.revision or 'working tree'}", current, baseline)
+    if baseline:
+        _report(f"baseline: {args.baseline}", baseline)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf8") as file:
+            json.dump({"revision": args.revision, "baseline": args.baseline, \
+                "current": current, "baseline_results": baseline}, file, indent=2)
+
+    if baseline:
+        regressions = compare(current, baseline, args.threshold)
+        for name, change in regressions:
+            print(f"解析变慢: {name} p50 {change * 100:+.1f}%")
+        if regressions:
+            return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,6 @@
+#coding:utf8
+"""
+The script converts names to PinYin initials with an in-process LRU and an optional SQLite cache
+"""
+
+from ._initials import *
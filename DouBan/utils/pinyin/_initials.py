@@ -0,0 +1,215 @@
+#coding:utf8
+from __future__ import absolute_import
+import os
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from pypinyin import Style, pinyin
+
+from ..exceptions import InappropriateArgument
+
+
+__all__ = ["PinyinInitials", "initials", "convert"]
+
+
+def convert(string):
+    """计算拼音首字母，非中文字符保持不变
+
+    Examples:
+    >>> convert("逃离比勒陀利亚 逃离比勒陀利亚 7.5")
+        'tlbltlytlbltly7.5'
+    """
+    string = string.replace(" ", "")
+    result = pinyin(string, style=Style.INITIALS, errors="default", strict=False)
+
+    return "".join(i[0] for i in result).lower()
+
+
+
+class PinyinInitials:
+    """带缓存的拼音首字母转换
+
+    进程内使用容量为 maxsize 的 LRU 缓存，path 不为 None 时使用 SQLite 文件作为二级缓存，进程
+    重启后不需要重新计算。批量方法 get_many 对未命中的名称只查询一次 SQLite，新计算的结果一
+    次写入。可以通过 warm_from_tables 使用 person、worker 表中已有的姓名预热
+
+    Args:
+    ---------
+    maxsize: 进程内缓存的最大数量
+    path: SQLite 文件路径，None 表示不使用磁盘缓存
+
+    Examples:
+    >>> cache = PinyinInitials(maxsize=10000)
+    >>> cache.get_many(["西尔莎·罗南", "艾玛·沃森"])
+        ['xsh·ln', 'm·ws']
+    >>> cache.stats
+        {'hits': 0, 'disk_hits': 0, 'misses': 2, 'hit_rate': 0.0, 'size': 2}
+    """
+    logger = logging.getLogger(__name__ + ".PinyinInitials")
+
+    def __init__(self, maxsize=100000, path=None):
+        if maxsize <= 0:
+            raise InappropriateArgument(f"缓存容量不正确: {maxsize}")
+
+        self.maxsize = maxsize
+        self.path = path
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+        self._disk = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+
+    def configure(self, maxsize=None, path=None):
+        """调整缓存容量或者磁盘缓存路径，参数为 None 时保留原值"""
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = int(maxsize)
+                self._evict()
+            if path is not None and path != self.path:
+                self.close()
+                self.path = path
+
+
+    def get(self, string):
+        """转换一个名称"""
+        return self.get_many([string])[0]
+
+
+    def get_many(self, strings):
+        """批量转换名称，返回结果的顺序和输入一致"""
+        strings = list(strings)
+        result = {}
+        with self._lock:
+            missing = []
+            for string in strings:
+                if string in result:
+                    continue
+                if string in self._cache:
+                    self._cache.move_to_end(string)
+                    result[string] = self._cache[string]
+                    self.hits += 1
+                else:
+                    result[string] = None
+                    missing.append(string)
+
+            if missing:
+                found = self._disk_get(missing)
+                self.disk_hits += len(found)
+                computed = {string: convert(string) for string in missing \
+                                if string not in found}
+                self.misses += len(computed)
+                self._disk_set(computed)
+
+                found.update(computed)
+                for string, value in found.items():
+                    result[string] = value
+                    self._cache[string] = value
+                self._evict()
+
+        return [result[string] for string in strings]
+
+
+    def warm(self, strings, batch_size=10000):
+        """预先转换名称，返回处理的数量
+
+        预热不计入命中率
+        """
+        count, batch = 0, []
+        hits, disk_hits, misses = self.hits, self.disk_hits, self.misses
+        for string in strings:
+            if not string:
+                continue
+            batch.append(string)
+            if len(batch) >= batch_size:
+                self.get_many(batch)
+                count += len(batch)
+                batch = []
+        self.get_many(batch)
+        count += len(batch)
+
+        with self._lock:
+            self.hits, self.disk_hits, self.misses = hits, disk_hits, misses
+        return count
+
+
+    def warm_from_tables(self, manipulater):
+        """使用 person、worker 表中已有的姓名预热"""
+        from DouBan.database.manager.datamodel import DouBanSeriesPerson, DouBanSeriesWorker
+
+        count = 0
+        for column in (DouBanSeriesPerson.name, DouBanSeriesWorker.name):
+            count += self.warm(manipulater.iter_values(column, distinct=True))
+        self.logger.info(f"拼音首字母缓存预热完成: {count} 条")
+        return count
+
+
+    @property
+    def stats(self):
+        """命中统计，hit_rate 包括进程内缓存和磁盘缓存的命中"""
+        total = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / total if total else 0.0,
+            "size": len(self._cache),
+        }
+
+
+    def close(self):
+        with self._lock:
+            if self._disk is not None:
+                self._disk.close()
+                self._disk = None
+
+
+    def _evict(self):
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+
+    def _connection(self):
+        if self.path is None:
+            return None
+        if self._disk is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Scrapy 的线程池也可能调用，由 self._lock 保证串行访问
+            self._disk = sqlite3.connect(self.path, check_same_thread=False)
+            self._disk.execute("CREATE TABLE IF NOT EXISTS initials " +
+                "(name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        return self._disk
+
+
+    def _disk_get(self, strings):
+        connection = self._connection()
+        if connection is None:
+            return {}
+
+        result = {}
+        # SQLite 默认最多 999 个参数
+        for start in range(0, len(strings), 900):
+            chunk = strings[start:start + 900]
+            query = "SELECT name, value FROM initials WHERE name IN (%s)" % \
+                ",".join("?" * len(chunk))
+            result.update(connection.execute(query, chunk).fetchall())
+        return result
+
+
+    def _disk_set(self, mapping):
+        connection = self._connection()
+        if connection is None or not mapping:
+            return
+        with connection:
+            connection.executemany("INSERT OR REPLACE INTO initials (name, value) " +
+                "VALUES (?, ?)", mapping.items())
+
+
+
+# 默认的转换对象，extract1st_char 使用该对象
+initials = PinyinInitials()
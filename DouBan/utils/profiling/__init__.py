@@ -0,0 +1,7 @@
+#coding:utf8
+"""
+The script profiles spider callbacks and pipelines with a stack sampler or cProfile, and writes
+collapsed stacks or pstats files per interval
+"""
+
+from ._profiler import *
@@ -0,0 +1,269 @@
+#coding:utf8
+from __future__ import absolute_import
+import os
+import sys
+import time
+import cProfile
+import logging
+import threading
+from collections import Counter
+
+from ..exceptions import InappropriateArgument
+
+
+__all__ = ["Profiler", "StackSampler", "profiler"]
+
+
+class StackSampler:
+    """低开销的调用栈采样
+
+    后台线程每隔 interval 秒读取一次 sys._current_frames()，只记录处于 scope 中的线程，调用栈从
+    进入 scope 的位置开始，前面加上 scope 名称，例如:
+
+        callback:detail_page;extract (_series.py:120);parse_info (_series.py:200) 12
+
+    每一行是一条调用栈以及采样次数(collapsed stacks)，可以直接交给 flamegraph.pl 或者 speedscope
+    """
+    logger = logging.getLogger(__name__ + ".StackSampler")
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        # 线程 -> [(scope 名称, 进入 scope 的 frame), ...]
+        self.scopes = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="StackSampler", daemon=True)
+        self._thread.start()
+
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+
+    def enter(self, name, frame):
+        self.scopes.setdefault(threading.get_ident(), []).append((name, frame))
+
+
+    def exit(self):
+        scopes = self.scopes.get(threading.get_ident())
+        if scopes:
+            scopes.pop()
+
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self._sample()
+            except Exception:
+                self.logger.exception("采样失败")
+
+
+    def _sample(self):
+        frames = sys._current_frames()
+        for ident, scopes in list(self.scopes.items()):
+            # reactor 线程可能同时 enter、exit，复制之后再判断和读取
+            scopes = list(scopes)
+            if not scopes or ident not in frames:
+                continue
+            name, top = scopes[-1]
+            stack = self._stack(frames[ident], top)
+            with self._lock:
+                self.stacks[";".join([name] + stack)] += 1
+                self.samples += 1
+
+
+    @staticmethod
+    def _stack(frame, top):
+        """从 frame 向上读取到 top 为止的调用栈，返回由外到内的列表"""
+        stack = []
+        while frame is not None and frame is not top:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:" +
+                f"{code.co_firstlineno})")
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+
+    def collect(self):
+        """取出已有的采样结果并清空"""
+        with self._lock:
+            stacks, self.stacks = self.stacks, Counter()
+            self.samples = 0
+        return stacks
+
+
+
+class Profiler:
+    """回调和 Pipeline 的性能分析
+
+    只分析通过 wrap、wrap_iter 或者 scope 包装的代码，没有启用时包装只多一次属性判断。mode 为
+    sample 时使用 StackSampler，flush 写入 .collapsed 文件；为 cprofile 时在 scope 中启用
+    cProfile，flush 写入 .prof 文件(可以使用 snakeviz、flameprof 查看)
+
+    Args:
+    ---------
+    mode: sample 或者 cprofile
+    output_dir: 输出目录
+    sample_interval: 采样间隔(秒)
+    """
+    modes = ("sample", "cprofile")
+    logger = logging.getLogger(__name__ + ".Profiler")
+
+    def __init__(self, mode="sample", output_dir="profile", sample_interval=0.01):
+        self.configure(mode=mode, output_dir=output_dir, sample_interval=sample_interval)
+        self.active = False
+        self.sampler = None
+        self.profile = None
+        self._depth = 0
+
+
+    def configure(self, mode=None, output_dir=None, sample_interval=None):
+        if mode is not None and mode not in self.modes:
+            raise InappropriateArgument(f"性能分析方式不正确: {mode}")
+        if getattr(self, "active", False):
+            self.stop()
+        if mode is not None:
+            self.mode = mode
+        if output_dir is not None:
+            self.output_dir = output_dir
+        if sample_interval is not None:
+            self.sample_interval = sample_interval
+
+
+    def start(self, mode=None):
+        """开始分析，mode 为 None 时使用当前的方式"""
+        if mode is not None and mode != self.mode:
+            self.configure(mode=mode)
+        if self.active:
+            return
+
+        if self.mode == "sample":
+            self.sampler = StackSampler(self.sample_interval)
+            self.sampler.start()
+        else:
+            self.profile = cProfile.Profile()
+        self.active = True
+        self.logger.info(f"开始性能分析: {self.mode}")
+
+
+    def stop(self):
+        """停止分析并写入剩余的结果"""
+        if not self.active:
+            return
+        self.flush()
+        if self.sampler is not None:
+            self.sampler.stop()
+        self.active = False
+        self.sampler, self.profile = None, None
+        self.logger.info("停止性能分析")
+
+
+    def toggle(self):
+        if self.active:
+            self.stop()
+        else:
+            self.start()
+
+
+    def _enter(self, name, frame):
+        if self.sampler is not None:
+            self.sampler.enter(name, frame)
+        elif self.profile is not None:
+            # cProfile 不能嵌套启用
+            self._depth += 1
+            if self._depth == 1:
+                self.profile.enable()
+
+
+    def _exit(self):
+        if self.sampler is not None:
+            self.sampler.exit()
+        elif self.profile is not None:
+            self._depth -= 1
+            if self._depth == 0:
+                self.profile.disable()
+
+
+    def wrap(self, name, func):
+        """包装普通函数，例如 Pipeline 的 process_item"""
+        def wrapper(*args, **kwargs):
+            if not self.active:
+                return func(*args, **kwargs)
+            self._enter(name, sys._getframe())
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._exit()
+        wrapper.__name__ = getattr(func, "__name__", "wrapper")
+        wrapper.__wrapped__ = func
+        return wrapper
+
+
+    def wrap_iter(self, name, iterable):
+        """包装生成器，每次取下一个值时进入 scope，例如回调的输出"""
+        iterator = iter(iterable)
+        while True:
+            if not self.active:
+                try:
+                    value = next(iterator)
+                except StopIteration:
+                    return
+            else:
+                self._enter(name, sys._getframe())
+                try:
+                    value = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    self._exit()
+            yield value
+
+
+    def flush(self, prefix="douban"):
+        """写入这一段时间的分析结果，返回文件路径，没有结果时返回 None"""
+        if not self.active:
+            return None
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        filename = os.path.join(self.output_dir, \
+            f"{prefix}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+
+        if self.sampler is not None:
+            stacks = self.sampler.collect()
+            if not stacks:
+                return None
+            filename += ".collapsed"
+            with open(filename, "w", encoding="utf8") as file:
+                for stack, count in stacks.most_common():
+                    file.write(f"{stack} {count}\n")
+        else:
+            if self._depth:
+                # 正在分析的 scope 结束之前不能切换
+                return None
+            profile, self.profile = self.profile, cProfile.Profile()
+            if not profile.getstats():
+                return None
+            filename += ".prof"
+            profile.dump_stats(filename)
+
+        self.logger.info(f"性能分析结果: {filename}")
+        return filename
+
+
+
+# 进程内共享的性能分析对象，由 ProfilerExtension 根据配置启用
+profiler = Profiler()
@@ -4,6 +4,7 @@ import hashlib
 import requests
 import time
 from .conf import configure
+from ._pool import *
 
 QUANTITY_PROXY_LICENSE = configure.parser.get("abuyun", "QUANTITY_PROXY_LICENSE")
 QUANTITY_PROXY_SECRET = configure.parser.get("abuyun", "QUANTITY_PROXY_SECRET")
@@ -34,4 +35,5 @@ def request_abuyun(cnt, secret=QUANTITY_PROXY_SECRET, license_proxy=QUANTITY_PRO
     return result
 
 
-__all__ = ["configure", "request_abuyun"]
\ No newline at end of file
+__all__ = ["configure", "request_abuyun", "ProxyPool", "ProxyState", "ABuYunProvider", \
+    "StaticProvider"]
\ No newline at end of file
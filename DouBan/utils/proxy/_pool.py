@@ -0,0 +1,236 @@
+#coding:utf8
+from __future__ import absolute_import
+import time
+import logging
+
+from ..exceptions import InappropriateArgument, ConnectionError
+
+
+__all__ = ["ProxyPool", "ProxyState", "ABuYunProvider", "StaticProvider"]
+
+
+class ProxyState:
+    """单个代理的健康状态
+
+    success 和 latency 是成功率以及响应时间的 EWMA，新加入的代理成功率为 1、响应时间未知；
+    cooldown 是冷却结束的时间，冷却期间不会被选中
+    """
+    def __init__(self, address, added=None):
+        self.address = address
+        self.added = added or time.time()
+        self.success = 1.0
+        self.latency = None
+        self.samples = 0
+        self.failures = 0
+        self.ejections = 0
+        self.cooldown = 0.0
+        self.inflight = 0
+
+
+    def healthy(self, now):
+        return self.cooldown <= now
+
+
+    def __repr__(self):
+        return f"<ProxyState {self.address} success={self.success:.2f} latency={self.latency}>"
+
+
+
+class ProxyPool:
+    """代理池
+
+    记录每个代理的成功率和响应时间(EWMA)，选择健康代理中最快的一个，正在使用的请求数量越多，
+    排序越靠后。成功率低于 min_success(至少 min_samples 次样本之后)或者连续失败 max_failures
+    次的代理会被剔除并冷却，冷却时间随剔除次数翻倍，最长 max_cooldown；冷却结束后重新加入，
+    成功率重置为 min_success，再次失败会立即剔除。剔除次数超过 max_ejections 或者加入时间超过
+    max_age 的代理直接删除
+
+    代理池本身不请求代理，healthy 数量低于 min_size 时 needs_refill 为 True，由调用方使用
+    provider 补充之后调用 add
+
+    Args:
+    ---------
+    min_size: 健康代理数量下限
+    alpha: EWMA 平滑系数，越大越重视最近的结果
+    min_success: 成功率下限
+    min_samples: 判断成功率之前需要的样本数量
+    max_failures: 连续失败次数上限
+    cooldown: 第一次剔除的冷却秒数
+    max_cooldown: 冷却秒数上限
+    max_ejections: 剔除次数上限，0 表示不限制
+    max_age: 代理的最长使用秒数，0 表示不限制
+    """
+    logger = logging.getLogger(__name__ + ".ProxyPool")
+
+    def __init__(self, min_size=5, alpha=0.3, min_success=0.5, min_samples=5, max_failures=3, \
+            cooldown=60, max_cooldown=1800, max_ejections=3, max_age=0):
+        if not 0 < alpha <= 1:
+            raise InappropriateArgument(f"EWMA 平滑系数不正确: {alpha}")
+
+        self.min_size = min_size
+        self.alpha = alpha
+        self.min_success = min_success
+        self.min_samples = min_samples
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.max_ejections = max_ejections
+        self.max_age = max_age
+        self.proxies = {}
+        self.counters = {"requests": 0, "successes": 0, "failures": 0, "ejected": 0, \
+            "removed": 0, "added": 0}
+
+
+    def add(self, addresses):
+        """加入新的代理，已经存在的代理保持原有状态，返回新加入的数量"""
+        now, count = time.time(), 0
+        for address in addresses:
+            if address and address not in self.proxies:
+                self.proxies[address] = ProxyState(address, added=now)
+                count += 1
+        self.counters["added"] += count
+        return count
+
+
+    def remove(self, address):
+        if self.proxies.pop(address, None) is not None:
+            self.counters["removed"] += 1
+
+
+    def get(self):
+        """选择最快的健康代理，没有健康代理时返回 None"""
+        now = time.time()
+        self.expire(now)
+        candidates = [state for state in self.proxies.values() if state.healthy(now)]
+        if not candidates:
+            return None
+
+        # 没有响应时间的新代理按照当前最快的响应时间计算，以便尽快得到样本
+        known = [i.latency for i in candidates if i.latency is not None]
+        default = min(known) if known else 1.0
+        state = min(candidates, key=lambda i: ((default if i.latency is None else i.latency) * \
+                        (1 + i.inflight) / max(i.success, 0.01), i.latency is not None, i.inflight))
+        state.inflight += 1
+        return state.address
+
+
+    def release(self, address):
+        """请求结束后释放代理，每次 get 对应一次 release"""
+        state = self.proxies.get(address)
+        if state is not None and state.inflight > 0:
+            state.inflight -= 1
+
+
+    def report(self, address, ok, latency=None):
+        """记录一次请求结果，不释放代理"""
+        self.counters["requests"] += 1
+        self.counters["successes" if ok else "failures"] += 1
+
+        state = self.proxies.get(address)
+        if state is None:
+            return
+
+        state.samples += 1
+        state.success += self.alpha * ((1.0 if ok else 0.0) - state.success)
+        if latency is not None:
+            state.latency = latency if state.latency is None else \
+                state.latency + self.alpha * (latency - state.latency)
+        state.failures = 0 if ok else state.failures + 1
+
+        if not ok and (state.failures >= self.max_failures or \
+                (state.samples >= self.min_samples and state.success < self.min_success)):
+            self.eject(state)
+
+
+    def eject(self, state):
+        """剔除代理并冷却"""
+        state.ejections += 1
+        self.counters["ejected"] += 1
+        if self.max_ejections and state.ejections > self.max_ejections:
+            self.logger.debug(f"删除代理: {state}")
+            self.remove(state.address)
+            return
+
+        seconds = min(self.cooldown * 2 ** (state.ejections - 1), self.max_cooldown)
+        state.cooldown = time.time() + seconds
+        # 冷却结束后按照刚好达到下限的成功率重新试用，样本数量满足条件，再次失败时立即剔除
+        state.success = self.min_success
+        state.samples = self.min_samples
+        state.failures = 0
+        self.logger.debug(f"剔除代理 {seconds:.0f}s: {state}")
+
+
+    def expire(self, now=None):
+        if not self.max_age:
+            return
+        now = now or time.time()
+        for address in [i.address for i in self.proxies.values() if now - i.added > self.max_age]:
+            self.remove(address)
+
+
+    def healthy(self):
+        now = time.time()
+        return sum(1 for state in self.proxies.values() if state.healthy(now))
+
+
+    @property
+    def needs_refill(self):
+        return self.healthy() < self.min_size
+
+
+    @property
+    def stats(self):
+        now = time.time()
+        latencies = [i.latency for i in self.proxies.values() if i.latency is not None]
+        requests = self.counters["requests"]
+        return dict(self.counters,
+            size=len(self.proxies),
+            healthy=self.healthy(),
+            cooling=sum(1 for i in self.proxies.values() if not i.healthy(now)),
+            inflight=sum(i.inflight for i in self.proxies.values()),
+            success_rate=self.counters["successes"] / requests if requests else 0.0,
+            latency=sum(latencies) / len(latencies) if latencies else 0.0,
+        )
+
+
+    def __len__(self):
+        return len(self.proxies)
+
+
+
+class ABuYunProvider:
+    """阿布云高质量代理，每次请求 count 个代理"""
+    def __init__(self, count=5):
+        self.count = count
+
+
+    @classmethod
+    def from_settings(cls, settings):
+        from .conf import configure
+        return cls(count=settings.getint("PROXY_POOL_REFILL_SIZE") or \
+            configure.parser.getint("abuyun", "PROXY_COUNT"))
+
+
+    def __call__(self):
+        from . import request_abuyun
+
+        data = request_abuyun(cnt=self.count)
+        if not data or not data.get("proxies"):
+            raise ConnectionError(f"获取代理失败: {data}")
+        return ["http://" + proxy for proxy in data["proxies"]]
+
+
+
+class StaticProvider:
+    """固定的代理列表，用于本地测试或者自建代理"""
+    def __init__(self, proxies):
+        self.proxies = list(proxies)
+
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(settings.getlist("PROXY_POOL_STATIC"))
+
+
+    def __call__(self):
+        return list(self.proxies)
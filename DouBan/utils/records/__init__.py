@@ -0,0 +1,7 @@
+#coding:utf8
+"""
+The script defines compact slotted record types for high-volume items, which convert to MongoDB
+documents and ORM rows without intermediate copies
+"""
+
+from ._record import *
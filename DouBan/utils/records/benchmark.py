@@ -0,0 +1,107 @@
+#coding:utf8
+"""
+评论 item 基准测试:
+1. 生成 number 条合成的短评数据(namedtuple，和 Comments.extract_short_comment 的结果一致)
+2. 分别使用 scrapy.Item 实现的评论 item 和 DouBanCommentsItemM(Record) 创建全部 item，对比
+    创建耗时以及 tracemalloc 统计的每个 item 占用的内存
+3. 对比转换为 MongoDB 文档(dict(item) 和 to_document)以及数据表字典(dict(item) 和 to_row)
+    的耗时
+
+使用示例:
+    python -m DouBan.utils.records.benchmark --number 1000000
+"""
+from __future__ import absolute_import
+
+import gc
+import sys
+import time
+import argparse
+import tracemalloc
+from collections import namedtuple
+
+import scrapy
+
+from DouBan.items import DouBanCommentsItemM
+
+
+ShortComment = namedtuple("short_comment", ["uname", "uid", "upic", "date", "comment_id", \
+    "rate", "content", "thumb", "watched"])
+
+
+# 改为 Record 之前的评论 item
+ScrapyCommentsItem = type("ScrapyCommentsItem", (scrapy.Item,), \
+    {name: scrapy.Field() for name in DouBanCommentsItemM.fields})
+
+
+def synthetic(number):
+    return [ShortComment(f"user{i}", f"https://www.douban.com/people/{i}/", \
+        f"https://img.doubanio.com/icon/u{i}.jpg", "2020-01-01 12:00:00", str(10 ** 9 + i), \
+        "40", "短评内容" * 10, str(i % 100), True) for i in range(number)]
+
+
+def create_scrapy(datum, sid):
+    items = []
+    for data in datum:
+        item = ScrapyCommentsItem(**{field: data._asdict().get(field) if field != "sid" else sid \
+            for field in ScrapyCommentsItem.fields})
+        item["type"] = "短评论"
+        items.append(item)
+    return items
+
+
+def create_record(datum, sid):
+    items = []
+    for data in datum:
+        item = DouBanCommentsItemM.from_record(data, sid=sid)
+        item["type"] = "短评论"
+        items.append(item)
+    return items
+
+
+def measure(func, *args):
+    """返回 (结果, 秒数, tracemalloc 统计的新增内存字节数)"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    seconds = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, size
+
+
+def timeit(func, items):
+    start = time.perf_counter()
+    for item in items:
+        func(item)
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="评论 item 基准测试")
+    parser.add_argument("--number", type=int, default=1000000, help="评论数量")
+    args = parser.parse_args(argv)
+
+    datum = synthetic(args.number)
+    sid = "1291546"
+    print(f"{args.number} comments")
+
+    results = {}
+    for name, func in [("scrapy.Item", create_scrapy), ("Record", create_record)]:
+        items, seconds, size = measure(func, datum, sid)
+        results[name] = items
+        print(f"{name:12s}: create {args.number / seconds:10.1f} items/sec, " +
+            f"{size / args.number:7.1f} bytes/item")
+
+    old, new = results["scrapy.Item"], results["Record"]
+    assert dict(old[0]) == dict(new[0])
+
+    print(f"document    : dict(item) {timeit(dict, old):6.3f}s, " +
+        f"to_document {timeit(DouBanCommentsItemM.to_document, new):6.3f}s")
+    print(f"row         : dict(item) {timeit(dict, old):6.3f}s, " +
+        f"to_row {timeit(DouBanCommentsItemM.to_row, new):6.3f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
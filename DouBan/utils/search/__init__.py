@@ -3,4 +3,5 @@
 The script can deal with decrypt douban search response data
 """
 
-from ._decrypt import Decrypt
\ No newline at end of file
+from ._decrypt import Decrypt
+from ._worker import JSWorker, JSWorkerPool
@@ -1,24 +1,40 @@
 import requests
-import execjs
 import re
 
 
 from os import path
 
 
-from ..exceptions import InappropriateArgument
+from ..exceptions import InappropriateArgument, DecryptError
 from ..hammers import _url_valid
+from ._worker import JSWorkerPool, _decrypt_file
 
 # 导入js
-_current = path.dirname(__file__)
-_encrypt_file = path.join(_current, "./libs/decrypt.js")
-
-if not path.exists(_encrypt_file):
+if not path.exists(_decrypt_file):
     raise FileNotFoundError("解密使用 JavaScript 文件未找到")
 
-with open(_encrypt_file, 'r', encoding='utf-8', errors='ignore') as file:
-    js = file.read()
-    ctx = execjs.compile(js)
+# 默认的解密进程池，第一次解密时启动
+_pool = None
+
+
+def get_pool(size=2):
+    """获取默认的解密进程池"""
+    global _pool
+    if _pool is None:
+        _pool = JSWorkerPool(size=size)
+    return _pool
+
+
+def compile_execjs():
+    """使用 execjs 编译 decrypt.js
+
+    原来的解密方式，基准测试中用于对比。execjs 的外部运行环境每次调用都会启动新的进程
+    """
+    import execjs
+
+    with open(_decrypt_file, 'r', encoding='utf-8', errors='ignore') as file:
+        js = file.read()
+    return execjs.compile(js)
 
 
 class Decrypt:
@@ -30,9 +46,17 @@ class Decrypt:
     Methods:
     -----------
     request: 以 URL 方式请求数据解析，默认使用 'GET' 方法，其他请求需要参数以关键字方式调用
-    _decrypt: 对获取到的响应对象，进行解密处理。处理对方式是调用 JS 方法
-    
+    _decrypt: 对获取到的响应对象，进行解密处理。处理对方式是调用常驻的 JS 解密进程
+    decrypt_many: 批量解密响应对象或者加密文本，多个解密进程并行处理
+
+    Args:
+    -----------
+    pool: JSWorkerPool 对象，默认使用模块共享的进程池
     """
+    def __init__(self, pool=None):
+        self.pool = pool
+
+
     def request(self, url, *, method="GET", **kwargs):
         """对 URL 响应结果解密
 
@@ -42,28 +66,44 @@ class Decrypt:
         return self._decrypt(response)
 
 
+    @staticmethod
+    def extract(response):
+        """提取页面中需要解密的部分数据"""
+        matchobj = re.search('window.__DATA__ = "([^"]+)"', response.text)
+        if matchobj is None:
+            raise DecryptError(f"页面中没有需要解密的数据: {response.url}")
+        return matchobj.group(1)
+
+
     def _decrypt(self, response):
         """解密获取到的页面响应结果
 
         对请求到的响应页面进行解密
         """
-        # 需要解密的部分数据
-        text = re.search('window.__DATA__ = "([^"]+)"', response.text).group(1)
-        data = ctx.call('decrypt', text)
-        return data
+        return (self.pool or get_pool()).decrypt(self.extract(response))
+
+
+    def decrypt_many(self, values):
+        """批量解密
+
+        values 中可以是页面响应对象或者已经提取的加密文本，返回结果的顺序和输入一致
+        """
+        texts = [value if isinstance(value, str) else self.extract(value) \
+                    for value in values]
+        return (self.pool or get_pool()).decrypt_many(texts)
+
 
- 
     def __call__(self, *args, **kwargs):
         # 位置参数数量不正确，说明传入的参数不正确：位置参数只能是 response 或者 URL
         if len(args) != 1:
             raise InappropriateArgument("传输的位置参数数量不正确，只需要一个位置参数")
-        
+
         # 位置参数是网页请求响应
         if isinstance(args[0], requests.Response):
             return self._decrypt(args[0])
-        
+
         # 位置参数是 URL
         elif _url_valid(args[0]):
             return self.request(args[0], **kwargs)
         else:
-            raise InappropriateArgument(f"解密仅能针对页面响应结果或者 URL，获取参数为:{args[0]}")
\ No newline at end of file
+            raise InappropriateArgument(f"解密仅能针对页面响应结果或者 URL，获取参数为:{args[0]}")
@@ -0,0 +1,148 @@
+#coding:utf8
+from __future__ import absolute_import
+import json
+import queue
+import atexit
+import shutil
+import logging
+import threading
+import subprocess
+
+from os import path
+from concurrent.futures import ThreadPoolExecutor
+
+from ..exceptions import DecryptError, InappropriateArgument
+
+
+__all__ = ["JSWorker", "JSWorkerPool"]
+
+_current = path.dirname(__file__)
+_worker_file = path.join(_current, "./libs/worker.js")
+_decrypt_file = path.join(_current, "./libs/decrypt.js")
+
+
+class JSWorker:
+    """长期运行的 Node.js 解密进程
+
+    进程启动时加载一次 decrypt.js，之后通过标准输入输出逐行交换 JSON 请求和结果，不需要每次
+    调用都启动新的进程。进程意外退出时，下一次调用会重新启动
+    """
+    logger = logging.getLogger(__name__ + ".JSWorker")
+
+    def __init__(self, runtime, script=_decrypt_file):
+        self.runtime = runtime
+        self.script = script
+        self.process = None
+        self.calls = 0
+        self._counter = 0
+
+
+    def start(self):
+        self.process = subprocess.Popen(
+            [self.runtime, _worker_file, self.script],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, encoding="utf-8"
+        )
+        self.logger.debug(f"启动解密进程: {self.process.pid}")
+
+
+    def decrypt(self, text):
+        if self.process is None or self.process.poll() is not None:
+            self.start()
+
+        self._counter += 1
+        try:
+            self.process.stdin.write(json.dumps({"id": self._counter, "text": text}) + "\n")
+            self.process.stdin.flush()
+            line = self.process.stdout.readline()
+        except (BrokenPipeError, OSError) as err:
+            self.close()
+            raise DecryptError(f"解密进程异常退出: {err}")
+
+        if not line:
+            self.close()
+            raise DecryptError("解密进程异常退出，没有返回结果")
+
+        self.calls += 1
+        response = json.loads(line)
+        if "error" in response:
+            raise DecryptError(f"解密失败: {response['error']}")
+        return response["result"]
+
+
+    def close(self):
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.stdin.close()
+                try:
+                    self.process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    self.process.kill()
+            self.process = None
+
+
+
+class JSWorkerPool:
+    """解密进程池
+
+    维护 size 个 JSWorker，每次调用占用一个空闲进程，多个线程可以同时调用。decrypt_many 将
+    数据分配到所有进程并行解密，结果顺序和输入一致
+
+    Args:
+    ---------
+    size: 进程数量
+    runtime: Node.js 可执行文件，默认在 PATH 中查找 node 或者 nodejs
+
+    Examples:
+    >>> pool = JSWorkerPool(size=2)
+    >>> pool.decrypt_many([text1, text2])
+        [{'type': 'INIT', 'payload': {...}}, {'type': 'INIT', 'payload': {...}}]
+    """
+    def __init__(self, size=2, runtime=None):
+        if size <= 0:
+            raise InappropriateArgument(f"解密进程数量不正确: {size}")
+
+        runtime = runtime or shutil.which("node") or shutil.which("nodejs")
+        if runtime is None:
+            raise FileNotFoundError("没有找到 Node.js，无法启动解密进程")
+
+        self.size = size
+        self.workers = [JSWorker(runtime) for _ in range(size)]
+        self._idle = queue.Queue()
+        for worker in self.workers:
+            self._idle.put(worker)
+        self._executor = None
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+
+    def decrypt(self, text):
+        worker = self._idle.get()
+        try:
+            return worker.decrypt(text)
+        finally:
+            self._idle.put(worker)
+
+
+    def decrypt_many(self, texts):
+        texts = list(texts)
+        if len(texts) <= 1 or self.size == 1:
+            return [self.decrypt(text) for text in texts]
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.size)
+        return list(self._executor.map(self.decrypt, texts))
+
+
+    @property
+    def stats(self):
+        return {"workers": self.size, "calls": sum(worker.calls for worker in self.workers)}
+
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+        for worker in self.workers:
+            worker.close()
@@ -0,0 +1,83 @@
+#coding:utf8
+"""
+搜索数据解密基准测试:
+1. 使用 decrypt.js 中的示例数据或者文件中的加密文本(每行一条)
+2. 对比 execjs 逐条调用、解密进程池逐条调用以及 decrypt_many 批量调用的每秒调用次数，并检查
+    结果是否和 execjs 一致
+
+使用示例:
+    python -m DouBan.utils.search.benchmark --number 200 --size 4
+"""
+from __future__ import absolute_import
+
+import re
+import sys
+import time
+import argparse
+
+from DouBan.utils.search import JSWorkerPool
+from DouBan.utils.search._decrypt import compile_execjs
+from DouBan.utils.search._worker import _decrypt_file
+
+
+def sample_texts(path=None):
+    """读取加密文本，没有文件时使用 decrypt.js 中的示例数据"""
+    if path is not None:
+        with open(path, encoding="utf8") as file:
+            return [line.strip() for line in file if line.strip()]
+
+    with open(_decrypt_file, encoding="utf8", errors="ignore") as file:
+        return [re.search('var r = "([^"]+)"', file.read()).group(1)]
+
+
+def timeit(func, texts):
+    """返回 (每秒调用次数, 结果)"""
+    start = time.perf_counter()
+    result = func(texts)
+    return len(texts) / (time.perf_counter() - start), result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="搜索数据解密基准测试")
+    parser.add_argument("--file", default=None, help="加密文本文件，每行一条")
+    parser.add_argument("--number", type=int, default=200, help="解密次数")
+    parser.add_argument("--size", type=int, default=2, help="解密进程数量")
+    parser.add_argument("--skip-execjs", action="store_true", help="不测试 execjs")
+    args = parser.parse_args(argv)
+
+    samples = sample_texts(args.file)
+    texts = (samples * (args.number // len(samples) + 1))[:args.number]
+    expected = None
+
+    if not args.skip_execjs:
+        ctx = compile_execjs()
+        # execjs 每次调用都启动新的进程，只测试少量数据
+        count = min(len(texts), 20)
+        rate, expected = timeit(lambda items: [ctx.call("decrypt", i) for i in items], \
+            texts[:count])
+        print(f"execjs      : {rate:8.1f} calls/sec ({count} calls)")
+
+    pool = JSWorkerPool(size=args.size)
+    try:
+        # 启动进程的时间不计入
+        pool.decrypt_many(samples * args.size)
+
+        rate, single = timeit(lambda items: [pool.decrypt(i) for i in items], texts)
+        print(f"pool        : {rate:8.1f} calls/sec ({len(texts)} calls)")
+
+        rate, many = timeit(pool.decrypt_many, texts)
+        print(f"decrypt_many: {rate:8.1f} calls/sec ({len(texts)} calls, {args.size} workers)")
+    finally:
+        pool.close()
+
+    if single != many:
+        print("解密进程池结果不一致")
+        return 1
+    if expected is not None and expected != single[:len(expected)]:
+        print("解密结果和 execjs 不一致")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,27 @@
+// 长期运行的解密进程: 启动时加载一次 decrypt.js，之后每行读取一个 JSON 请求
+// {"id": ..., "text": ...}，每行输出一个 JSON 结果 {"id": ..., "result": ...} 或者
+// {"id": ..., "error": ...}
+const fs = require("fs");
+const vm = require("vm");
+const readline = require("readline");
+
+const file = process.argv[2];
+const source = fs.readFileSync(file, "utf8");
+
+// decrypt.js 加载时会打印示例数据的解密结果，加载期间屏蔽输出，避免污染响应
+const log = console.log;
+console.log = function() {};
+vm.runInThisContext(source, {filename: file});
+console.log = log;
+
+const input = readline.createInterface({input: process.stdin, terminal: false});
+input.on("line", function(line) {
+    let request, response;
+    try {
+        request = JSON.parse(line);
+        response = {id: request.id, result: decrypt(request.text)};
+    } catch (err) {
+        response = {id: request ? request.id : null, error: String(err)};
+    }
+    process.stdout.write(JSON.stringify(response) + "\n");
+});
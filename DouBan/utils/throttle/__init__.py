@@ -0,0 +1,6 @@
+#coding:utf8
+"""
+The script adjusts download concurrency and delay from anti-spider block signals
+"""
+
+from ._aimd import *
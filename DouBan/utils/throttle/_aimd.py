@@ -0,0 +1,140 @@
+#coding:utf8
+from __future__ import absolute_import
+import time
+import logging
+
+from ..exceptions import InappropriateArgument
+
+
+__all__ = ["AIMDController", "SlotLimit"]
+
+
+class SlotLimit:
+    """一个下载 slot 当前的并发数量、请求间隔以及封禁率(EWMA)"""
+    def __init__(self, concurrency, delay):
+        self.concurrency = concurrency
+        self.delay = delay
+        self.block_rate = 0.0
+        self.responses = 0
+        self.blocks = 0
+        self.successes = 0
+        # 上一次调整的时间和方向
+        self.changed = time.time()
+        self.last = None
+
+
+    def __repr__(self):
+        return f"<SlotLimit concurrency={self.concurrency} delay={self.delay:.2f} " + \
+            f"block_rate={self.block_rate:.3f}>"
+
+
+
+class AIMDController:
+    """AIMD 方式调整每个 slot 的并发数量和请求间隔
+
+    每个响应更新 slot 的封禁率 EWMA:
+
+    * 出现封禁信号(跳转到安全验证页面、403、429 等)时乘性减小: 并发数量乘以 decrease_factor，
+        请求间隔除以 decrease_factor(至少增加 delay_step)。减小之后 interval 秒内的封禁信号只记
+        录不再减小，因为这些请求是在减小之前发出的
+    * 封禁率低于 target，距离上一次调整超过 interval 秒，并且这段时间内至少有 concurrency 个成
+        功响应时加性增大: 请求间隔大于 min_delay 时先减小 delay_step，否则并发数量加 1
+
+    速率大约是 concurrency / (响应时间 + delay)，最终在封禁率接近 target 的位置附近波动
+
+    Args:
+    ---------
+    target: 目标封禁率
+    min_concurrency, max_concurrency: 并发数量范围
+    min_delay, max_delay: 请求间隔范围(秒)
+    start_concurrency, start_delay: 新 slot 的初始值
+    delay_step: 请求间隔的加性步长
+    decrease_factor: 乘性减小系数
+    alpha: 封禁率 EWMA 平滑系数
+    interval: 两次调整之间的最短秒数
+    """
+    logger = logging.getLogger(__name__ + ".AIMDController")
+
+    def __init__(self, target=0.02, min_concurrency=1, max_concurrency=16, min_delay=0.0, \
+            max_delay=60.0, start_concurrency=1, start_delay=3.0, delay_step=0.25, \
+            decrease_factor=0.5, alpha=0.1, interval=5.0):
+        if not 0 < decrease_factor < 1:
+            raise InappropriateArgument(f"乘性减小系数不正确: {decrease_factor}")
+        if min_concurrency < 1 or min_concurrency > max_concurrency:
+            raise InappropriateArgument(f"并发数量范围不正确: {min_concurrency}-{max_concurrency}")
+
+        self.target = target
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.start_concurrency = min(max(start_concurrency, min_concurrency), max_concurrency)
+        self.start_delay = min(max(start_delay, min_delay), max_delay)
+        self.delay_step = delay_step
+        self.decrease_factor = decrease_factor
+        self.alpha = alpha
+        self.interval = interval
+        self.slots = {}
+        self.counters = {"responses": 0, "blocks": 0, "increases": 0, "decreases": 0}
+
+
+    def limit(self, key):
+        if key not in self.slots:
+            self.slots[key] = SlotLimit(self.start_concurrency, self.start_delay)
+        return self.slots[key]
+
+
+    def record(self, key, blocked, now=None):
+        """记录一个响应，limit 发生变化时返回 True"""
+        now = now or time.time()
+        limit = self.limit(key)
+        limit.responses += 1
+        limit.block_rate += self.alpha * ((1.0 if blocked else 0.0) - limit.block_rate)
+        self.counters["responses"] += 1
+
+        if blocked:
+            limit.blocks += 1
+            self.counters["blocks"] += 1
+            # 刚刚减小过，这些封禁来自减小之前发出的请求
+            if limit.last == "decrease" and now - limit.changed < self.interval:
+                return False
+            return self.decrease(limit, now)
+
+        limit.successes += 1
+        if limit.block_rate < self.target and now - limit.changed >= self.interval and \
+                limit.successes >= limit.concurrency:
+            return self.increase(limit, now)
+        return False
+
+
+    def decrease(self, limit, now):
+        concurrency = max(self.min_concurrency, int(limit.concurrency * self.decrease_factor))
+        delay = min(self.max_delay, max(limit.delay / self.decrease_factor, \
+            limit.delay + self.delay_step))
+        changed = (concurrency, delay) != (limit.concurrency, limit.delay)
+
+        limit.concurrency, limit.delay = concurrency, delay
+        limit.changed, limit.successes, limit.last = now, 0, "decrease"
+        self.counters["decreases"] += 1
+        self.logger.debug(f"降低速率: {limit}")
+        return changed
+
+
+    def increase(self, limit, now):
+        if limit.delay > self.min_delay:
+            limit.delay = max(self.min_delay, limit.delay - self.delay_step)
+        elif limit.concurrency < self.max_concurrency:
+            limit.concurrency += 1
+        else:
+            return False
+
+        limit.changed, limit.successes, limit.last = now, 0, "increase"
+        self.counters["increases"] += 1
+        self.logger.debug(f"提高速率: {limit}")
+        return True
+
+
+    @property
+    def stats(self):
+        return dict(self.counters, block_rate=self.counters["blocks"] / \
+            self.counters["responses"] if self.counters["responses"] else 0.0)